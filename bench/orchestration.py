@@ -0,0 +1,213 @@
+#!/usr/bin/python
+"""
+Orchestration benchmark for labtool without docker.
+
+Runs the labtool command line flows (create, --repair, --stage N, --upgrade,
+and --cleanup) against synthetic ring topologies with stub docker, ip, and
+curl executables (bench/stub.py) first on PATH and all flexswitch
+SystemStatus and stage requests answered by a local http responder.  Each
+stub invocation sleeps a configurable latency so the time reported is
+labtool's own orchestration overhead plus the simulated latencies.  For each
+flow the wall time, number of subprocesses executed by labtool, and peak RSS
+of the labtool process are reported.  Stub interfaces are not visible
+within /proc/<pid>/net/dev so --repair rewires every link (the worst case).
+Network namespace handles are still created in /var/run/netns so this must
+be executed as root.
+
+    sudo python bench/orchestration.py --sizes 3,32,128,512
+    sudo python bench/orchestration.py --sizes 32 --latency '{"docker run":0.5}'
+    sudo python bench/orchestration.py --json base.json
+    sudo python bench/orchestration.py --baseline base.json --tolerance 0.25
+"""
+import os, sys, json, time, shutil, tempfile, subprocess, argparse
+bench_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, bench_dir)
+from scale import StatusServer
+
+flows = ["create", "repair", "stage", "upgrade", "cleanup"]
+default_latency = {"docker": 0.01, "docker run": 0.05, "ip": 0.002,
+    "curl": 0.01, "dpkg": 0.05}
+port_base = 30000
+labtool_max_devices = 32    # larger topologies require --scale
+
+# execute labtool.py as __main__ and record peak rss of the process on exit
+bootstrap = """
+import sys, json, atexit, resource, imp
+def report(path=sys.argv[1]):
+    with open(path, "w") as f:
+        json.dump({"maxrss": resource.getrusage(resource.RUSAGE_SELF
+            ).ru_maxrss}, f)
+atexit.register(report)
+sys.argv = sys.argv[2:]
+main = imp.new_module("__main__")
+main.__file__ = sys.argv[0]
+sys.bench_bootstrap = sys.modules["__main__"]
+sys.modules["__main__"] = main
+exec compile(open(sys.argv[0]).read(), sys.argv[0], "exec") in main.__dict__
+"""
+
+def build_tree(root, count, stage_lines=4):
+    """ create labtool tree in root with stubs and a 'bench' lab containing
+        a ring topology of count devices, a native stage 1 and a bash stage 2
+    """
+    src = os.path.dirname(bench_dir)
+    os.makedirs("%s/labs/bench" % root)
+    os.makedirs("%s/bin" % root)
+    shutil.copy("%s/labtool.py" % src, root)
+    shutil.copy("%s/labs/__init__.py" % src, "%s/labs/" % root)
+    for cmd in ("docker", "ip", "curl"):
+        with open("%s/bin/%s" % (root, cmd), "w") as f:
+            f.write("#!/bin/sh\nexec %s %s/stub.py %s \"$@\"\n" % (
+                sys.executable, bench_dir, cmd))
+        os.chmod("%s/bin/%s" % (root, cmd), 0755)
+    lab = "%s/labs/bench" % root
+    with open("%s/__init__.py" % lab, "w") as f:
+        f.write('"""\nbench: Synthetic ring of %s devices\n"""\n' % count)
+    names = ["d%04d" % i for i in xrange(count)]
+    devices = [{"name": n, "port": port_base+i} for (i, n) in enumerate(names)]
+    connections = [{names[i]: "fpPort1", names[(i+1) % count]: "fpPort2"}
+        for i in xrange(count)]
+    with open("%s/topology.json" % lab, "w") as f:
+        json.dump({"devices": devices, "connections": connections}, f)
+    url = "'http://localhost:%s/public/v1/config/%s'"
+    with open("%s/stage1.sh" % lab, "w") as f:
+        f.write("#!/bin/bash\n")
+        for (i, n) in enumerate(names):
+            for l in xrange(stage_lines):
+                f.write("curl -sX PATCH -d '{\"IntfRef\":\"fpPort%s\","\
+                    "\"AdminState\":\"UP\"}' %s\n" % (l+1, url % (port_base+i,
+                    "Port")))
+    with open("%s/stage2.sh" % lab, "w") as f:
+        f.write("#!/bin/bash\nset -e\n")
+        for (i, n) in enumerate(names):
+            f.write("curl -s %s > /dev/null\n" % (url % (port_base+i,
+                "SystemStatus")))
+    os.chmod("%s/stage2.sh" % lab, 0755)
+    # flexswitch image used by --upgrade must be at least 1MB
+    with open("%s/flexswitch_docker_bench.deb" % root, "wb") as f:
+        f.write("\0" * 2*1024*1024)
+
+def run_flow(root, flow, latency, stage=2, scale=False):
+    """ execute labtool flow and return dict with seconds, subprocesses,
+        maxrss (KB), and success
+    """
+    # stub containers do not consume the host limits verified by --scale
+    args = ["--scale", "--no-capacity-check"] if scale else []
+    args+= {"create": [], "repair": ["--repair"], "cleanup": ["--cleanup"],
+        "stage": ["--stage", "%s" % stage],
+        "upgrade": ["--upgrade", "*", "--image",
+            "%s/flexswitch_docker_bench.deb" % root]}[flow]
+    env = dict(os.environ)
+    env.pop("DOCKER_HOST", None)
+    env["PATH"] = "%s/bin:%s" % (root, env.get("PATH", ""))
+    env["LABBENCH_STATE"] = "%s/state" % root
+    env["LABBENCH_LATENCY"] = json.dumps(latency)
+    cmd = [sys.executable, "-c", bootstrap, "%s/rss.json" % root,
+        "%s/labtool.py" % root, "--lab", "bench", "--docker", "cli",
+        "--debug", "error", "--metrics", "%s/metrics.json" % root] + args
+    with open("%s/%s.log" % (root, flow), "w") as log:
+        start = time.time()
+        rc = subprocess.call(cmd, env=env, stdout=log, stderr=log,
+            stdin=open(os.devnull))
+        elapsed = time.time() - start
+    with open("%s/metrics.json" % root) as f: metrics = json.load(f)
+    with open("%s/rss.json" % root) as f: rss = json.load(f)
+    # docker api and rest requests are not subprocesses
+    count = sum([m["count"] for (c, m) in metrics["commands"].items()
+        if not c.startswith("docker api") and not c.startswith("rest ")])
+    return {"seconds": elapsed, "subprocesses": count,
+        "maxrss": rss["maxrss"], "success": rc == 0}
+
+def kill_containers(root):
+    """ remove containers and netns handles left behind by a failed flow """
+    cdir = "%s/state/containers" % root
+    if not os.path.isdir(cdir): return
+    for fname in os.listdir(cdir):
+        with open("%s/%s" % (cdir, fname)) as f: pid = json.load(f)["State"][
+            "Pid"]
+        if pid == 0: continue
+        try: os.kill(pid, 9)
+        except OSError as e: pass
+        handle = "/var/run/netns/%s" % pid
+        if os.path.islink(handle): os.remove(handle)
+
+def bench(count, latency):
+    """ run all flows on ring of count devices and return dict of flow to
+        result (see run_flow)
+    """
+    root = tempfile.mkdtemp(prefix="labtool-bench-")
+    server = None
+    results = {}
+    try:
+        build_tree(root, count)
+        server = StatusServer([port_base+i for i in xrange(count)])
+        for flow in flows:
+            results[flow] = run_flow(root, flow, latency, 
+                scale=count > labtool_max_devices)
+            if not results[flow]["success"]:
+                sys.stderr.write("%s failed for %s devices, see %s/%s.log\n"
+                    % (flow, count, root, flow))
+                break
+    finally:
+        if server is not None: server.close()
+        kill_containers(root)
+        if len(results) == len(flows) and all([r["success"] for r in
+            results.values()]):
+            shutil.rmtree(root, True)
+    return results
+
+def compare(results, baseline, tolerance):
+    """ return list of regressions of results against baseline where wall
+        time or subprocess count grew by more than tolerance
+    """
+    regressions = []
+    for (count, flows_result) in sorted(results.items()):
+        for (flow, r) in sorted(flows_result.items()):
+            b = baseline.get("%s" % count, {}).get(flow)
+            if b is None: continue
+            for attr in ("seconds", "subprocesses"):
+                if r[attr] > b[attr] * (1 + tolerance):
+                    regressions.append("%s devices %s: %s %.2f > %.2f" % (
+                        count, flow, attr, r[attr], b[attr]))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split(
+        "\n")[0])
+    parser.add_argument("--sizes", default="3,32,128,512",
+        help="comma separated list of device counts")
+    parser.add_argument("--latency", default=None,
+        help="json object of command class to simulated latency in seconds"\
+        " (default %s)" % json.dumps(default_latency, sort_keys=True))
+    parser.add_argument("--json", default=None,
+        help="write results to the provided file")
+    parser.add_argument("--baseline", default=None,
+        help="results file of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+        help="allowed growth over baseline before failing (default 0.25)")
+    args = parser.parse_args()
+    if os.geteuid() != 0: sys.exit("must be executed as root")
+    latency = dict(default_latency)
+    if args.latency is not None: latency.update(json.loads(args.latency))
+
+    results = {}
+    success = True
+    print "%8s %-8s %10s %8s %9s" % ("devices", "flow", "seconds",
+        "subprocs", "rss(MB)")
+    for count in [int(s) for s in args.sizes.split(",")]:
+        results[count] = bench(count, latency)
+        for flow in flows:
+            if flow not in results[count]: continue
+            r = results[count][flow]
+            success = success and r["success"]
+            print "%8s %-8s %10.2f %8s %9.1f%s" % (count, flow, r["seconds"],
+                r["subprocesses"], r["maxrss"]/1024.0,
+                "" if r["success"] else "  FAILED")
+    if args.json is not None:
+        with open(args.json, "w") as f: json.dump(results, f, indent=4)
+    if args.baseline is not None:
+        with open(args.baseline) as f: baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for r in regressions: print "regression: %s" % r
+        success = success and len(regressions) == 0
+    sys.exit(0 if success else 1)
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+"""
+Synthetic large topology benchmark for labtool --scale mode.
+
+Brings up generated ring topologies of increasing size through the same
+start_topology path used by labtool and reports bring-up time per device.
+Containers are replaced by 'unshare -n' processes (each with its own network
+namespace, so links are really created with ip) and flexswitch SystemStatus
+is served for every device by a single local http responder.  Docker latency
+can be simulated with --run-latency.  Must be executed as root.
+
+    sudo python bench/scale.py --sizes 32,64,128,256
+"""
+import os, sys, json, time, shutil, tempfile, subprocess, argparse
+import threading, select, socket, logging
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+    ".."))
+import labtool
+
+status_body = json.dumps({"Object": {"UpTime": "1m0s", "Ready": True}})
+
+class SyntheticDocker(labtool.DockerBackend):
+    """ docker backend where each container is an 'unshare -n' process """
+    def __init__(self, run_latency=0):
+        self.run_latency = run_latency
+        self.lock = threading.Lock()
+        self.procs = {}
+
+    def ping(self): return True
+    def images(self): return set([labtool.docker_image])
+    def pull(self, image, progress=None): pass
+
+    def record(self, name):
+        p = self.procs[name]
+        running = p.poll() is None
+        return {"id": name, "name": name, "running": running,
+            "state": "running" if running else "exited",
+            "pid": "%s" % p.pid if running else "0", "mounts": [],
+            "image": labtool.docker_image, "labels": {}, "ip": ""}
+
+    def containers(self, names=None):
+        with self.lock:
+            return [self.record(n) for n in self.procs if names is None or
+                n in names]
+
+    def inspect(self, name):
+        with self.lock:
+            if name not in self.procs: return None
+            r = self.record(name)
+        return {"Id": r["id"], "Name": "/%s" % name, "Mounts": [],
+            "State": {"Running": r["running"], "Pid": int(r["pid"]),
+                "Status": r["state"]},
+            "Config": {"Image": r["image"], "Labels": {}}}
+
+    def run(self, name, image, port, port_internal, fs_image=None, dopt=None,
+            labels=None):
+        time.sleep(self.run_latency)
+        p = subprocess.Popen(["unshare", "-n", "sleep", "3600"],
+            close_fds=True)
+        with self.lock: self.procs[name] = p
+
+    def remove(self, name):
+        with self.lock: p = self.procs.pop(name, None)
+        if p is not None:
+            p.kill()
+            p.wait()
+
+    def execute(self, name, cmd): return ""
+
+    def remove_all(self):
+        for name in list(self.procs): self.remove(name)
+
+class StatusServer(object):
+    """ single threaded keep-alive http responder answering every request on
+        all provided ports with a ready SystemStatus
+    """
+    def __init__(self, ports):
+        self.epoll = select.epoll()
+        self.listeners = {}
+        self.clients = {}
+        for port in ports:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind(("127.0.0.1", port))
+            s.listen(64)
+            self.listeners[s.fileno()] = s
+            self.epoll.register(s.fileno(), select.EPOLLIN)
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        response = "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+        response+= "Content-Length: %s\r\n\r\n%s" % (len(status_body),
+            status_body)
+        while self.running:
+            for (fd, event) in self.epoll.poll(0.2):
+                if fd in self.listeners:
+                    (c, addr) = self.listeners[fd].accept()
+                    self.clients[c.fileno()] = [c, ""]
+                    self.epoll.register(c.fileno(), select.EPOLLIN)
+                    continue
+                (c, buf) = self.clients[fd]
+                data = c.recv(4096)
+                if len(data) == 0:
+                    self.epoll.unregister(fd)
+                    self.clients.pop(fd)
+                    c.close()
+                    continue
+                buf+= data
+                while "\r\n\r\n" in buf:
+                    buf = buf.split("\r\n\r\n", 1)[1]
+                    c.sendall(response)
+                self.clients[fd][1] = buf
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        for (c, buf) in self.clients.values(): c.close()
+        for s in self.listeners.values(): s.close()
+
+def ring_topology(path, count):
+    """ write ring topology of count devices without host ports """
+    devices = [{"name": "d%04d" % i} for i in xrange(count)]
+    connections = []
+    for i in xrange(count):
+        connections.append({"d%04d" % i: "fpPort1",
+            "d%04d" % ((i+1) % count): "fpPort2"})
+    with open("%s/topology.json" % path, "w") as f:
+        json.dump({"devices": devices, "connections": connections}, f)
+
+def bring_up(count, run_latency):
+    """ bring up ring topology of count devices and return elapsed seconds """
+    path = tempfile.mkdtemp(prefix="labtool-scale-")
+    docker = SyntheticDocker(run_latency)
+    labtool.docker = docker
+    labtool.inventory.invalidate()
+    server = None
+    try:
+        ring_topology(path, count)
+        topo = labtool.get_topology("%s/topology.json" % path, scale=True)
+        if topo is None: raise Exception("invalid topology")
+        server = StatusServer([topo[n].port for n in topo])
+        start = time.time()
+        if not labtool.start_topology(path, topo)[0]:
+            raise Exception("failed to start %s devices" % count)
+        return time.time() - start
+    finally:
+        if server is not None: server.close()
+        for r in docker.containers():
+            handle = "%s/%s" % (labtool.netns_dir, r["pid"])
+            if os.path.islink(handle): os.remove(handle)
+        docker.remove_all()
+        shutil.rmtree(path, True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split(
+        "\n")[0])
+    parser.add_argument("--sizes", default="32,64,128,256",
+        help="comma separated list of device counts")
+    parser.add_argument("--run-latency", type=float, default=0.05,
+        help="simulated docker run latency in seconds")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+    if os.geteuid() != 0: sys.exit("must be executed as root")
+    logging.basicConfig(format="%(asctime)s  %(message)s",
+        level=logging.DEBUG if args.debug else logging.ERROR)
+    labtool.MAX_THREADS = labtool.SCALE_MAX_THREADS
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    print "%8s %10s %14s" % ("devices", "seconds", "ms/device")
+    per_device = []
+    for count in sizes:
+        elapsed = bring_up(count, args.run_latency)
+        per_device.append(elapsed*1000.0/count)
+        print "%8s %10.2f %14.2f" % (count, elapsed, per_device[-1])
+    # linear growth keeps time per device roughly constant
+    ratio = max(per_device) / min(per_device)
+    print "max/min time per device: %.2f (%s)" % (ratio,
+        "linear" if ratio <= 2 else "super-linear")
+    sys.exit(0 if ratio <= 2 else 1)
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+"""
+Stand-in for the docker, ip, and curl executables used by bench/orchestration.
+
+The command is selected by the first argument, the benchmark places wrapper
+scripts named docker, ip, and curl on PATH that execute:
+    python bench/stub.py <docker|ip|curl> <args>
+State is kept in $LABBENCH_STATE:
+    containers/<name>.json  docker inspect record of each container, every
+                            container is a detached 'sleep' process so its
+                            pid is real
+    netns/<pid>.json        interface names within each container namespace
+    calls.log               one line per invocation with the command class
+$LABBENCH_LATENCY is a json object of command class (for example
+"docker run", "docker exec", "ip", "curl") to seconds slept per invocation.
+"""
+import os, sys, json, time, fcntl, signal, hashlib, subprocess
+
+state_dir = os.environ.get("LABBENCH_STATE", "/tmp/labbench")
+images = ["snapos/flex:latest"]
+
+def latency(cmd_class):
+    """ sleep configured latency of command class and log the invocation """
+    lat = json.loads(os.environ.get("LABBENCH_LATENCY", "{}"))
+    t = lat.get(cmd_class, lat.get(cmd_class.split(" ")[0], 0))
+    if t > 0: time.sleep(t)
+    with open("%s/calls.log" % state_dir, "a") as f: f.write("%s\n" % cmd_class)
+
+class Locked(object):
+    """ exclusive lock over all stub state """
+    def __enter__(self):
+        self.f = open("%s/lock" % state_dir, "a")
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+    def __exit__(self, *args):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+def container_path(name):
+    return "%s/containers/%s.json" % (state_dir, name)
+
+def load_container(ref):
+    """ return container record by name or id or None """
+    if os.path.exists(container_path(ref)):
+        with open(container_path(ref)) as f: return json.load(f)
+    for fname in os.listdir("%s/containers" % state_dir):
+        with open("%s/containers/%s" % (state_dir, fname)) as f: js=json.load(f)
+        if js["Id"] == ref: return js
+    return None
+
+def save_container(js):
+    with open(container_path(js["Name"].lstrip("/")), "w") as f: json.dump(js,f)
+
+def alive(pid):
+    try: os.kill(pid, 0)
+    except OSError as e: return False
+    return True
+
+def refresh(js):
+    """ update running state from the container process """
+    if js["State"]["Running"] and not alive(js["State"]["Pid"]):
+        js["State"].update({"Running": False, "Status": "exited", "Pid": 0})
+    return js
+
+def fail(msg):
+    sys.stderr.write("Error: %s\n" % msg)
+    sys.exit(1)
+
+def docker(args):
+    cmd = args[0] if len(args) > 0 else ""
+    if cmd == "exec" and len(args) > 2 and args[2] in ("dpkg","curl","wget"):
+        latency(args[2])
+    else: latency("docker %s" % cmd)
+    if cmd == "ps":
+        with Locked():
+            names = sorted(os.listdir("%s/containers" % state_dir))
+            if len([a for a in args[1:] if a.startswith("-") and "q" in a]):
+                for n in names: print load_container(n[:-5])["Id"]
+            else: print "CONTAINER ID        IMAGE               NAMES"
+    elif cmd == "images":
+        for i in images: print i
+    elif cmd == "pull":
+        if args[-1] not in images: images.append(args[-1])
+    elif cmd == "inspect":
+        found, missing = ([], False)
+        if "--type=image" in args:
+            for i in args[2:]:
+                if i in images:
+                    found.append({"Id": "sha256:%s" % hashlib.sha256(
+                        i).hexdigest(), "Size": 100*1024*1024})
+                else: missing = True
+        else:
+            with Locked():
+                for ref in args[1:]:
+                    js = load_container(ref)
+                    if js is None: missing = True
+                    else: found.append(refresh(js))
+        print json.dumps(found)
+        if missing: fail("No such object")
+    elif cmd == "run":
+        (mounts, labels, name, i) = ([], {}, None, 1)
+        while i < len(args) - 1:
+            if args[i] == "--volume":
+                (src, dst) = args[i+1].split(":")[:2]
+                mounts.append({"Source": src, "Destination": dst})
+                i+= 1
+            elif args[i] == "--label":
+                (k, v) = args[i+1].split("=", 1)
+                labels[k] = v
+                i+= 1
+            elif args[i] == "--name":
+                name = args[i+1]
+                i+= 1
+            i+= 1
+        with Locked():
+            if name is None or load_container(name) is not None:
+                fail("Conflict. The container name %s is already in use"%name)
+            devnull = open(os.devnull, "w")
+            p = subprocess.Popen(["sleep", "3600"], stdin=devnull,
+                stdout=devnull, stderr=devnull, close_fds=True,
+                preexec_fn=os.setsid)
+            js = {"Id": hashlib.sha256("%s%s" % (name, time.time())
+                ).hexdigest(), "Name": "/%s" % name, "Mounts": mounts,
+                "State": {"Running": True, "Pid": p.pid, "Status":"running"},
+                "Config": {"Image": args[-1], "Labels": labels},
+                "NetworkSettings": {"IPAddress": "172.17.0.2"}}
+            save_container(js)
+            print js["Id"]
+    elif cmd == "rm":
+        missing = False
+        with Locked():
+            for ref in [a for a in args[1:] if not a.startswith("-")]:
+                js = load_container(ref)
+                if js is None:
+                    missing = True
+                    continue
+                if js["State"]["Running"]:
+                    try: os.killpg(js["State"]["Pid"], signal.SIGKILL)
+                    except OSError as e: pass
+                os.remove(container_path(js["Name"].lstrip("/")))
+        if missing: fail("No such container")
+    elif cmd == "rename":
+        with Locked():
+            js = load_container(args[1])
+            if js is None: fail("No such container: %s" % args[1])
+            os.remove(container_path(js["Name"].lstrip("/")))
+            js["Name"] = "/%s" % args[2]
+            save_container(js)
+    elif cmd == "exec":
+        with Locked(): js = load_container(args[1])
+        if js is None or not refresh(js)["State"]["Running"]:
+            fail("container %s is not running" % args[1])
+    elif cmd == "cp":
+        if args[1] == "-": sys.stdin.read()
+
+def netns_path(pid):
+    return "%s/netns/%s.json" % (state_dir, pid)
+
+def netns_update(pid, func):
+    """ apply func to interface list of namespace pid """
+    path = netns_path(pid)
+    intfs = []
+    if os.path.exists(path):
+        with open(path) as f: intfs = json.load(f)
+    intfs = func(intfs)
+    with open(path, "w") as f: json.dump(intfs, f)
+
+def ip(args):
+    latency("ip")
+    if args[:2] == ["netns", "exec"]:
+        path = netns_path(args[2])
+        intfs = []
+        if os.path.exists(path):
+            with open(path) as f: intfs = json.load(f)
+        print "1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 state UNKNOWN"
+        for (i, intf) in enumerate(intfs):
+            print "%s: %s@if%s: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 "\
+                "state UP" % (i+2, intf, i+1000)
+        return
+    if "-batch" not in args: return
+    netns = args[args.index("-netns")+1] if "-netns" in args else None
+    cmds = [l.split() for l in sys.stdin.read().split("\n") if len(l) > 0]
+    with Locked():
+        for c in cmds:
+            if netns is None and c[:2] == ["link", "set"] and c[3] == "netns":
+                netns_update(c[4], lambda intfs: intfs + [c[2]])
+            elif netns is not None and c[:2] == ["link", "set"] and \
+                len(c) == 5 and c[3] == "name":
+                netns_update(netns, lambda intfs: [c[4] if i == c[2] else i
+                    for i in intfs])
+            elif netns is not None and c[:2] == ["link", "delete"]:
+                netns_update(netns, lambda intfs: [i for i in intfs
+                    if i != c[2]])
+
+def curl(args):
+    latency("curl")
+    print json.dumps({"Result": "Success"})
+
+if __name__ == "__main__":
+    for d in ("containers", "netns"):
+        if not os.path.isdir("%s/%s" % (state_dir, d)):
+            try: os.makedirs("%s/%s" % (state_dir, d))
+            except OSError as e: pass
+    {"docker": docker, "ip": ip, "curl": curl}[sys.argv[1]](sys.argv[2:])
@@ -1,23 +1,44 @@
-# import all labs packages and provide importable list
-import os, imp
+# lab packages are loaded on demand, labs provides an importable list of all
+import os, imp, sys
 
 ldir = os.path.dirname(os.path.realpath(__file__))
-unsorted_labs = {}
-for fm in os.listdir(ldir):
-    if os.path.isdir("%s/%s" % (ldir, fm)):
-        try:
-            f, fname, desc = imp.find_module(fm, [ldir])
-            mod = imp.load_module("%s" % fm, f, fname, desc)
-            # ensure module has correctly formated docstring
-            if mod.__doc__ is None: mod.__doc__ = ""
-            lines = mod.__doc__.strip().split("\n")
-            if ":" not in lines[0]: lines[0] = "%s: %s" % (fm, fm)
-            if len(lines)==1: lines.append("")
-            mod.__doc__ = "\n".join(lines) 
-            unsorted_labs[fm] = mod
-        except ImportError as e: pass
 
-labs = []
-for fm in sorted(unsorted_labs.keys()):
-    labs.append(unsorted_labs[fm])
+def lab_dirs():
+    """ return sorted list of lab package directory names """
+    return sorted([fm for fm in os.listdir(ldir)
+        if os.path.isdir("%s/%s" % (ldir, fm))])
 
+def load(fm):
+    """ import single lab package by directory name and return the module
+        with a correctly formatted docstring or None if it cannot be imported
+    """
+    if fm in sys.modules and getattr(sys.modules[fm], "__path__", [None])[0]\
+        == "%s/%s" % (ldir, fm):
+        return sys.modules[fm]
+    try:
+        f, fname, desc = imp.find_module(fm, [ldir])
+        mod = imp.load_module("%s" % fm, f, fname, desc)
+    except ImportError as e: return None
+    # ensure module has correctly formated docstring
+    if mod.__doc__ is None: mod.__doc__ = ""
+    lines = mod.__doc__.strip().split("\n")
+    if ":" not in lines[0]: lines[0] = "%s: %s" % (fm, fm)
+    if len(lines)==1: lines.append("")
+    mod.__doc__ = "\n".join(lines)
+    return mod
+
+class LazyLabs(object):
+    """ sequence of all lab modules, sorted by directory name, imported on
+        first access
+    """
+    def __init__(self): self.mods = None
+    def modules(self):
+        if self.mods is None:
+            self.mods = [m for m in [load(fm) for fm in lab_dirs()]
+                if m is not None]
+        return self.mods
+    def __iter__(self): return iter(self.modules())
+    def __len__(self): return len(self.modules())
+    def __getitem__(self, i): return self.modules()[i]
+
+labs = LazyLabs()
@@ -1,20 +1,85 @@
 #!/usr/bin/python
 import logging, logging.handlers, json, re, time
 import subprocess, os, signal, sys, traceback, argparse
-import threading
+import threading, multiprocessing, hashlib, shutil
+import httplib, socket, urllib, Queue, struct, tarfile, StringIO
+import ssl, base64, heapq, shlex, urlparse, fcntl, contextlib, binascii
+import collections, urllib2, functools, atexit, pipes
+import multiprocessing.pool
 logger = logging.getLogger(__name__)
 
 MAX_DEVICE_COUNT = 32
+MAX_SCALE_DEVICE_COUNT = 1000
+MAX_TOPOLOGY_ERRORS = 50
 MAX_THREADS = 16
+SCALE_MAX_THREADS = 64
+SCALE_PIDS_PER_DEVICE = 64
+SCALE_INOTIFY_PER_DEVICE = 4
+SCALE_WATCHES_PER_DEVICE = 512
+MIN_LINK_BATCH = 8
 docker_image = "snapos/flex:latest"
 flexswitch_timeout = 180
+cleanup_timeout = 30
+READY_BACKOFF_MIN = 0.25
+READY_BACKOFF_MAX = 4
+READY_MAX_RESTARTS = 2
+READY_DEADLINE = 900
+PULL_PROGRESS_INTERVAL = 5
 netns_dir = "/var/run/netns/"
 fs_image_dir = "./images/"
+fs_image_max_bytes = 4*1024*1024*1024
 gen_flex_path = "/usr/local/flex.deb"
+upgrade_mount = "/usr/local/labtool/images"
+docker_socket = "/var/run/docker.sock"
+if os.environ.get("DOCKER_HOST", "").startswith("unix://"):
+    docker_socket = os.environ["DOCKER_HOST"][len("unix://"):]
+# docker api path segments that are not resource identifiers
+api_collection_routes = ("json", "create", "prune", "load", "search")
+api_image_actions = ("json", "history", "push", "tag", "get")
+docker = None
+tracer = None
+instance = None
+stage_cache_dir = "./.cache/stages/"
+lab_catalog_path = "./.cache/labs.json"
+stage_cache_repo = "labtool-stage-cache"
+stage_cache_label = "labtool.stage-cache"
+stage_cache_max_bytes = 10*1024*1024*1024
+pool_prefix = "labtool-pool-"
+pool_warming_prefix = "%swarming-" % pool_prefix
+pool_label = "labtool.pool"
+pool_lock = "./.cache/pool.lock"
+route_localnet_path = "/proc/sys/net/ipv4/conf/all/route_localnet"
+route_localnet_saved = "./.cache/route_localnet"
+port_rule_tag = "labtool:"
+host_port_base = 20000
+instance_index_path = "./.cache/instances.json"
 lab_doc_reg = "^[ ]*(?P<id>[^:]+):(?P<name>[^\n]+)\n(?P<desc>.*)"
 device_name_reg = "^[a-zA-Z0-9\-\._]{2,64}$"
-link_name_reg = "^(fpPort[0-9]{1,4})|ma1|eth[0-9]+$"
+instance_name_reg = "^[a-zA-Z0-9][a-zA-Z0-9_\-]{0,31}$"
+stage_port_reg = "(?P<host>localhost|127\.0\.0\.1):(?P<port>[0-9]+)"
+link_name_reg = "^(fpPort[0-9]{1,4}|ma1|eth[0-9]+)$"
+scale_link_name_reg = "^[a-zA-Z][a-zA-Z0-9_\-\.]{0,14}$"
 link_state_reg = "^[0-9]+:[ ]*(?P<intf>[^@:]+)(@[^:]+)?:"
+shell_var_reg = "\\$(\\{(?P<b>[A-Za-z0-9_]+)\\}|(?P<a>[A-Za-z_][A-Za-z0-9_]*))"
+port_rule_reg = "--comment \"?%s(?P<name>[^\" ]+)" % port_rule_tag
+batch_error_reg = "^Command failed [^:]*:(?P<line>[0-9]+)"
+exec_class_regs = [
+    ("docker run", "^docker (run|create) "),
+    ("docker ps", "^docker ps"),
+    ("docker inspect", "^docker inspect "),
+    ("docker rm", "^docker rmi? "),
+    ("dpkg", "^(docker exec [^ ]+ )?dpkg "),
+    ("curl", "^(docker exec [^ ]+ |/bin/bash -c )?curl "),
+    ("wget", "^(docker exec [^ ]+ )?wget "),
+    ("docker exec", "^docker exec "),
+    ("docker", "^docker "),
+    ("ip netns exec", "^ip netns exec "),
+    ("ip -batch", "^ip .*-batch"),
+    ("ip link", "^ip (-[^ ]+ [^ ]+ )*link "),
+    ("ip", "^ip "),
+    ("iptables", "^iptables"),
+    ("stage script", "^/bin/bash -c "),
+]
 
 def get_args():
     """ get user arguments """
@@ -39,9 +104,21 @@ def get_args():
     reloaded, the vEth interface references become invalid and need to be 
     rebuilt.  Use the --repair option to repair broken topology links.
     """
+    watchHelp = """
+    Repair the lab connections and keep running, following the docker event
+    stream.  When a lab container restarts, only the links of that device
+    are rebuilt using its new pid.  Use ctrl+c to stop watching
+    """
+    reconcileHelp = """
+    Apply changes to the lab topology without rebuilding the entire lab.
+    Only devices and connections added, removed, or changed since the lab
+    was last started/reconciled are modified, all other containers keep
+    running with their current configuration
+    """
     imageHelp = """
     Flexswitch image to run on the container. Image can be the full path to 
-    .deb package or a url in which to download the image. By default, the
+    .deb package or a url in which to download the image. Append 
+    #sha256=<digest> to verify the image contents. By default, the
     flexswitch image bundled within the docker image will be deployed.
     """
     upgradeHelp = """
@@ -50,11 +127,74 @@ def get_args():
     All containers will be upgraded to the flexswitch image provided by the
     --image option
     """
+    scaleHelp = """
+    Large topology mode.  Allows up to %s devices and any valid interface 
+    name within topology.json, verifies host capacity (pid, network 
+    namespace, and inotify limits), and increases the number of concurrent
+    container, link, and readiness operations.  Devices without a port in
+    topology.json are allocated a host port automatically in either mode
+    """ % MAX_SCALE_DEVICE_COUNT
+    upgradeWaveHelp = """
+    Number of devices upgraded per wave with --upgrade.  Each wave must be
+    ready before the next wave starts.  Default 4
+    """
     doptHelp = """
     There may be additionally docker arguments that need to be passed to all
     containers.  The --dopt option is a string of additional options to be
     applied to the container when it is created.
     """
+    cacheHelp = """
+    Start from the highest cached stage of the lab if available and, after
+    the last stage completes, commit all containers to cached images (in
+    parallel) so later --stage runs of the same lab start directly from it.
+    Note, only the requested stage is recorded (not each intermediate 
+    stage) so a single commit of every container is paid per run
+    """
+    cacheClearHelp = """
+    Remove all cached stages recorded with --cache (or only those of the lab
+    provided with --lab)
+    """
+    poolHelp = """
+    Number of pre-started containers to keep warm for each docker image used
+    by the lab.  When starting a lab, each device claims a matching pooled
+    container (renamed to the device with its port published on the host)
+    instead of creating and booting a new one.  The pool is replenished in
+    the background after the lab starts and a container only joins the pool
+    once flexswitch is ready.  Note, only with --pool, ports of claimed 
+    containers are published with iptables DNAT rules and 
+    net.ipv4.conf.all.route_localnet is enabled on the host until the lab is
+    removed with --cleanup (or --pool-clear once no claimed containers 
+    remain), after which the previous value is restored
+    """
+    traceHelp = """
+    Record the time spent by each device in each phase (image pull, docker
+    run, pid discovery, links, readiness, and stages) and write the spans in
+    chrome trace-event format to the provided file (default 
+    <lab>/.generated/trace.json).  Open with chrome://tracing or 
+    ui.perfetto.dev.  The critical path is logged on exit
+    """
+    metricsHelp = """
+    Log count, total time, p50/p95/max latency, and failure rate of the
+    external commands (docker, ip, curl, dpkg, ...) and docker api requests
+    executed, grouped by command class, on exit.  If FILE is provided the
+    metrics are also written to it in json format
+    """
+    instanceHelp = """
+    Run an isolated copy of the lab identified by INSTANCE so multiple
+    copies can run on the same host.  Containers are named
+    <instance>-<device>, host ports are allocated from a pool shared by all
+    instances (topology.json ports are remapped within the stage scripts),
+    and netns handles and generated files (<lab>/.generated/instances/
+    <instance>) are kept per instance.  --cleanup, --repair, --reconcile,
+    --watch, and --upgrade only act on the containers of the instance
+    """
+    dockerHelp = """
+    Method used to communicate with docker. 'api' talks directly to the
+    docker engine API over the docker unix socket (DOCKER_HOST if set to a
+    unix:// socket), 'cli' executes the docker command line client, and
+    'auto' uses the api when the socket is reachable and otherwise falls
+    back to the cli
+    """
      
     parser = argparse.ArgumentParser(description=desc,
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -69,12 +209,47 @@ def get_args():
         help=imageHelp, type=str)
     parser.add_argument("--upgrade", action="store", dest="upgrade",
         default=[], help=upgradeHelp, type=str, nargs="+")
+    parser.add_argument("--upgrade-wave", action="store", 
+        dest="upgrade_wave", default=4, type=int, help=upgradeWaveHelp)
+    parser.add_argument("--upgrade-parallel", action="store", 
+        dest="upgrade_parallel", default=4, type=int, 
+        help="maximum number of devices upgrading concurrently. Default 4")
     parser.add_argument("--cleanup", action="store_true", dest="cleanup",
         help="clean/delete all containers referenced within lab topology")
     parser.add_argument("--repair", action="store_true", dest="repair",
         help=repairHelp)
+    parser.add_argument("--reconcile", action="store_true", dest="reconcile",
+        help=reconcileHelp)
+    parser.add_argument("--watch", action="store_true", dest="watch",
+        help=watchHelp)
     parser.add_argument("--dopt", action="store", dest="dopt", default=None,
         help=doptHelp)
+    parser.add_argument("--scale", action="store_true", dest="scale",
+        help=scaleHelp)
+    parser.add_argument("--no-capacity-check", action="store_false",
+        dest="capacity_check", help="do not verify host limits of large "\
+        "topologies before creating containers")
+    parser.add_argument("--cache", action="store_true", dest="cache",
+        help=cacheHelp)
+    parser.add_argument("--cache-clear", action="store_true", 
+        dest="cache_clear", help=cacheClearHelp)
+    parser.add_argument("--cache-size", action="store", dest="cache_size",
+        default=stage_cache_max_bytes/1024.0/1024/1024, type=float,
+        help="maximum size in GB of stage checkpoint cache (default 10)")
+    parser.add_argument("--pool", action="store", dest="pool", default=0,
+        type=int, help=poolHelp)
+    parser.add_argument("--pool-clear", action="store_true", 
+        dest="pool_clear", help="remove all unclaimed pooled containers")
+    parser.add_argument("--pool-fill", action="store", dest="pool_fill",
+        default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--instance", action="store", dest="instance",
+        default=None, help=instanceHelp)
+    parser.add_argument("--docker", action="store", dest="docker",
+        default="auto", choices=["auto","api","cli"], help=dockerHelp)
+    parser.add_argument("--trace", action="store", dest="trace", default=None,
+        nargs="?", const="", metavar="FILE", help=traceHelp)
+    parser.add_argument("--metrics", action="store", dest="metrics", 
+        default=None, nargs="?", const="", metavar="FILE", help=metricsHelp)
     parser.add_argument("--debug", action="store", dest="debug",
         default="info", choices=["debug","warn","info","error"])
 
@@ -121,15 +296,250 @@ def setup_logger(logger, args, quiet=False):
     logger.addHandler(logger_handler)
     return logger
 
-def exec_cmd(cmd, ignore_exception=False):
-    """ execute command and return stdout output - None on error """
+class Tracer(object):
+    """ record (phase, device) spans of lab operations.  Spans are exported
+        in chrome trace-event format (chrome://tracing, ui.perfetto.dev) 
+        with one row per device, overlapping spans of a device are placed on
+        additional rows.  The critical path of each task graph executed by
+        the Scheduler is kept for the summary
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.spans = []
+        self.critical = []
+
+    def add(self, phase, device, start, end, success=True, cat="call"):
+        with self.lock:
+            self.spans.append({"phase": phase, "device": "%s" % device,
+                "start": start, "end": end, "success": success, "cat": cat})
+
+    def add_graph(self, tasks, times):
+        """ add span for each executed task and record the critical path:
+            starting from the task that finished last, repeatedly follow the
+            dependency that finished last
+        """
+        for (name, (start, end)) in times.items():
+            (phase, device) = (name.split(":", 1) + ["*"])[:2]
+            self.add(phase, device, start, end, cat="task")
+        if len(times) == 0: return
+        name = max(times, key=lambda n: times[n][1])
+        path = [name]
+        while True:
+            deps = [d for d in tasks[name]["deps"] if d in times]
+            if len(deps) == 0: break
+            name = max(deps, key=lambda d: times[d][1])
+            path.append(name)
+        with self.lock:
+            self.critical.append([(n, times[n][0], times[n][1]) for n in 
+                reversed(path)])
+
+    def lanes(self):
+        """ return list of (row name, span) with each span on the first row
+            of its device where it nests within the open spans
+        """
+        rows = []
+        open_spans = {}
+        for s in sorted(self.spans, key=lambda s: (s["start"], -s["end"])):
+            lanes = open_spans.setdefault(s["device"], [])
+            for (i, stack) in enumerate(lanes + [[]]):
+                while len(stack) > 0 and stack[-1]["end"] <= s["start"]:
+                    stack.pop()
+                if len(stack) == 0 or stack[-1]["end"] >= s["end"]: break
+            if i == len(lanes): lanes.append(stack)
+            stack.append(s)
+            rows.append((s["device"] if i == 0 else "%s (%s)" % (
+                s["device"], i+1), s))
+        return rows
+
+    def write(self, path):
+        """ write chrome trace-event json to path """
+        events, tids = ([], {})
+        for (row, s) in self.lanes():
+            if row not in tids:
+                tids[row] = len(tids)+1
+            events.append({"name": s["phase"], "cat": s["cat"], "ph": "X",
+                "pid": 1, "tid": tids[row], 
+                "ts": int((s["start"] - self.start)*1e6),
+                "dur": int((s["end"] - s["start"])*1e6),
+                "args": {"device": s["device"], "success": s["success"]}})
+        for (row, tid) in tids.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, 
+                "tid": tid, "args": {"name": row}})
+        events.append({"name": "process_name", "ph": "M", "pid": 1,
+            "args": {"name": "labtool"}})
+        if not os.path.exists(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+        with open(path, "w") as f: 
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self):
+        """ return critical path summary table as a list of lines """
+        lines = []
+        for path in self.critical:
+            total = path[-1][2] - path[0][1]
+            lines.append("critical path (%.2f seconds):" % total)
+            lines.append("  %-32s %9s %9s %9s" % ("task", "start", "wait", 
+                "duration"))
+            (phases, prev) = ({}, path[0][1])
+            for (name, start, end) in path:
+                lines.append("  %-32s %9.2f %9.2f %9.2f" % (name, 
+                    start - self.start, max(0, start - prev), end - start))
+                phase = name.split(":")[0]
+                phases[phase] = phases.get(phase, 0) + end - start
+                prev = end
+            for (phase, t) in sorted(phases.items(), key=lambda p: -p[1]):
+                lines.append("  %-32s %9s %9s %9.2f (%.0f%%)" % (phase, "", "",
+                    t, 100.0*t/total if total > 0 else 0))
+        return lines
+
+def traced(phase, device_arg=None):
+    """ decorator adding a span to the tracer for each call when tracing is
+        enabled.  device_arg is the index of the positional argument naming
+        the device (or image) the call operates on
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if tracer is None: return func(*args, **kwargs)
+            device = "*"
+            if device_arg is not None and len(args) > device_arg:
+                device = args[device_arg]
+            (start, success) = (time.time(), False)
+            try:
+                result = func(*args, **kwargs)
+                success = result is not False
+                return result
+            finally: tracer.add(phase, device, start, time.time(), success)
+        return wrapper
+    return decorator
+
+class CommandInterrupted(KeyboardInterrupt):
+    """ raised when an external command is killed by a signal (ctrl+c).  As
+        a KeyboardInterrupt it passes through 'except Exception' handlers of
+        per-device work and stops the run
+    """
+
+class WorkerInterrupted(Exception):
+    """ carries CommandInterrupted out of a ThreadPool worker """
+
+class ThreadPool(multiprocessing.pool.ThreadPool):
+    """ ThreadPool re-raising CommandInterrupted of a worker within map.  The
+        stock pool only reports Exception subclasses, any other exception 
+        ends the worker thread and map never returns
+    """
+    def map(self, func, iterable, chunksize=None):
+        def run(arg):
+            try: return func(arg)
+            except CommandInterrupted as e: raise WorkerInterrupted(e)
+        try: 
+            return multiprocessing.pool.ThreadPool.map(self, run, iterable,
+                chunksize)
+        except WorkerInterrupted as e: raise e.args[0]
+
+class ExecStats(object):
+    """ count, latency, and failures of external commands per command class
+        (see exec_class_regs).  Every command executed through exec_cmd and
+        exec_batch is recorded along with docker api requests and native
+        stage/readiness REST requests (which replace curl)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.classes = {}
+        self.regs = [(c, re.compile(r)) for (c, r) in exec_class_regs]
+
+    def classify(self, cmd):
+        """ return command class of provided command string """
+        for (c, r) in self.regs:
+            if r.search(cmd): return c
+        return cmd.split(" ")[0] or "other"
+
+    def record(self, cmd, elapsed, success=True, cmd_class=None):
+        if cmd_class is None: cmd_class = self.classify(cmd)
+        with self.lock:
+            s = self.classes.setdefault(cmd_class, {"count": 0, "failed": 0,
+                "times": []})
+            s["count"]+= 1
+            s["times"].append(elapsed)
+            if not success: s["failed"]+= 1
+
+    def metrics(self):
+        """ return dict of command class to count, total, p50, p95, max 
+            (seconds), and failure rate
+        """
+        def percentile(times, p):
+            return times[min(len(times)-1, int(len(times)*p/100.0))]
+        result = {}
+        with self.lock:
+            for (c, s) in self.classes.items():
+                times = sorted(s["times"])
+                result[c] = {"count": s["count"], "total": sum(times),
+                    "p50": percentile(times, 50), 
+                    "p95": percentile(times, 95), "max": times[-1],
+                    "failure_rate": float(s["failed"])/s["count"]}
+        return result
+
+    def summary(self):
+        """ return summary table as a list of lines, longest total first """
+        metrics = self.metrics()
+        lines = ["%-20s %7s %9s %8s %8s %8s %6s" % ("command", "count", 
+            "total", "p50", "p95", "max", "fail")]
+        for c in sorted(metrics, key=lambda c: -metrics[c]["total"]):
+            m = metrics[c]
+            lines.append("%-20s %7s %9.2f %8.3f %8.3f %8.3f %5.1f%%" % (c,
+                m["count"], m["total"], m["p50"], m["p95"], m["max"], 
+                100*m["failure_rate"]))
+        return lines
+
+exec_stats = ExecStats()
+
+def write_metrics(path=None):
+    """ log command summary and write metrics json to path if provided """
+    logger.info("external command summary (seconds):")
+    for l in exec_stats.summary(): logger.info("  %s" % l)
+    if path is None: return
+    try:
+        with open(path, "w") as f:
+            f.write(pretty_print({"version": 1, "time": time.time(),
+                "commands": exec_stats.metrics()}))
+    except IOError as e:
+        logger.error("failed to write metrics %s: %s" % (path, e))
+
+def write_trace(path):
+    """ write trace to path and log critical path summary """
+    if tracer is None: return
+    try: tracer.write(path)
+    except (IOError, OSError) as e:
+        logger.error("failed to write trace %s: %s" % (path, e))
+        return
+    for l in tracer.summary(): logger.info(l)
+    logger.info("trace written to %s" % path)
+
+def exec_cmd(cmd, ignore_exception=False, stdin=None):
+    """ execute command and return stdout output - None on error.  If stdin
+        is provided it is written to the standard input of the command
+    """
+    start = time.time()
     try:
         logger.debug("executing command: %s" % cmd)
-        out = subprocess.check_output(cmd,shell=True,stderr=subprocess.STDOUT)
+        if stdin is None:
+            out = subprocess.check_output(cmd, shell=True,
+                stderr=subprocess.STDOUT)
+        else:
+            p = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            out = p.communicate(stdin)[0]
+            if p.returncode != 0:
+                raise subprocess.CalledProcessError(p.returncode, cmd, 
+                    output=out)
+        exec_stats.record(cmd, time.time() - start)
         return out
     except subprocess.CalledProcessError as e:
+        exec_stats.record(cmd, time.time() - start, False)
         # exit code -2 seen on ctrl+c interrupt
-        if e.returncode < 0: sys.exit("\nExiting...\n")
+        if e.returncode < 0: 
+            raise CommandInterrupted("cmd interrupted by signal %s: %s" % (
+                -e.returncode, cmd))
         if ignore_exception: 
             logger.debug("error executing cmd: %s" % e)
             logger.debug("stderr: %s" % e.output)
@@ -138,140 +548,1087 @@ def exec_cmd(cmd, ignore_exception=False):
         logger.warn("%s" % e.output)
         raise e
 
-def get_topology(topology_file = None):
-    """ read in topology file, verify connections, and return new topology 
-        dict in the following 
-        format:
-            "devices":{
-                "device_name":{
-                    "port":"",  # docker exposed port
-                    "pid":"",   # docker pid once created
-                    "connections": [
-                        {"local-port":"","remote-device":"","remote-port":""}
-                    ],
-                    "interfaces": [] # list of interface names
-                }
+class DockerBackend(object):
+    """ interface for all container operations performed by labtool.  Each
+        method raises an Exception on failure unless otherwise noted
+    """
+    def ping(self):
+        """ return True if docker daemon is reachable """
+        raise NotImplementedError()
+
+    def images(self):
+        """ return set of local images in 'repository:tag' format """
+        raise NotImplementedError()
+
+    def pull(self, image, progress=None):
+        """ pull image from registry.  If provided, progress(image, event) is
+            called for each docker pull progress event
+        """
+        raise NotImplementedError()
+
+    def containers(self, names=None):
+        """ return list of container records (see container_record) for all
+            containers, or only those with exact name in names if provided
+        """
+        raise NotImplementedError()
+
+    def inspect(self, name):
+        """ return inspect dict for container or None if it does not exist """
+        raise NotImplementedError()
+
+    def run(self, name, image, port, port_internal, fs_image=None, dopt=None,
+            labels=None):
+        """ create and start container, port is not published if None """
+        raise NotImplementedError()
+
+    def rename(self, name, new_name):
+        """ rename container """
+        raise NotImplementedError()
+
+    def remove(self, name):
+        """ force remove container """
+        raise NotImplementedError()
+
+    def remove_many(self, names):
+        """ force remove all provided containers.  Containers are removed 
+            concurrently, failures are logged
+        """
+        def remove(name):
+            try: self.remove(name)
+            except Exception as e:
+                logger.debug("failed to remove %s: %s" % (name, e))
+        if len(names) == 0: return
+        pool = ThreadPool(min(MAX_THREADS, len(names)))
+        try: pool.map(remove, names)
+        finally: pool.close()
+
+    def execute(self, name, cmd):
+        """ execute cmd (list) within container and return output, None on
+            non-zero exit code
+        """
+        raise NotImplementedError()
+
+    def copy(self, name, src, dst_dir):
+        """ copy local file src into dst_dir within container """
+        raise NotImplementedError()
+
+    def put_archive(self, name, data, dst_dir):
+        """ extract tar archive data (string) into dst_dir within container """
+        raise NotImplementedError()
+
+    def image_info(self, image):
+        """ return inspect dict for image or None if it does not exist """
+        raise NotImplementedError()
+
+    def commit(self, name, image, labels=None):
+        """ commit container filesystem to image 'repository:tag' with the
+            provided dict of image labels
+        """
+        raise NotImplementedError()
+
+    def remove_image(self, image):
+        """ force remove image """
+        raise NotImplementedError()
+
+    def prune_images(self, label):
+        """ remove dangling (untagged) images with the provided label """
+        raise NotImplementedError()
+
+    def events(self, actions=("start", "die")):
+        """ yield event record (see event_record) for each container event
+            with one of the provided actions as it occurs.  Blocks until 
+            the next event, returns when the event stream is closed
+        """
+        raise NotImplementedError()
+
+class DockerCLI(DockerBackend):
+    """ docker backend using the docker command line client """
+
+    def ping(self):
+        return exec_cmd("docker ps", ignore_exception=True) is not None
+
+    def images(self):
+        out = exec_cmd("docker images --format '{{.Repository}}:{{.Tag}}'")
+        return set([l.strip() for l in out.split("\n") if len(l.strip())>0])
+
+    def pull(self, image, progress=None):
+        exec_cmd("docker pull %s" % image)
+
+    def containers(self, names=None):
+        ids = exec_cmd("docker ps -aq --no-trunc").split()
+        if len(ids) == 0: return []
+        js = json.loads(exec_cmd("docker inspect %s" % " ".join(ids), 
+            ignore_exception=True) or "[]")
+        records = [container_record(c) for c in js]
+        if names is None: return records
+        return [r for r in records if r["name"] in names]
+
+    def inspect(self, name):
+        out = exec_cmd("docker inspect %s" % name, ignore_exception=True)
+        if out is None: return None
+        js = json.loads(out)
+        if len(js) == 0: return None
+        return js[0]
+
+    def run(self, name, image, port, port_internal, fs_image=None, dopt=None,
+            labels=None):
+        cmd = "docker run -dt --privileged --cap-add ALL "
+        if fs_image is not None:
+            cmd+= "--volume %s:%s:ro " % (fs_image, gen_flex_path)
+        if os.path.isdir(fs_image_dir):
+            cmd+= "--volume %s:%s:ro " % (os.path.abspath(fs_image_dir),
+                upgrade_mount)
+        for (k, v) in sorted((labels or {}).items()):
+            cmd+= "--label %s=%s " % (k, v)
+        if port is not None: cmd+= "-p %s:%s " % (port, port_internal)
+        if dopt is not None: cmd+= "%s " % dopt
+        # hostname is the logical device name regardless of instance
+        cmd+= "--hostname=%s --name %s %s" % (container_device(name) or name,
+            name, image)
+        exec_cmd(cmd)
+
+    def rename(self, name, new_name):
+        exec_cmd("docker rename %s %s" % (name, new_name))
+
+    def remove(self, name):
+        exec_cmd("docker rm -f %s" % name)
+
+    def remove_many(self, names):
+        # single process, docker kills and removes containers concurrently
+        if len(names) == 0: return
+        exec_cmd("docker rm -f %s" % " ".join(names), ignore_exception=True)
+
+    def execute(self, name, cmd):
+        return exec_cmd("docker exec %s %s" % (name, " ".join(
+            [pipes.quote(c) for c in cmd])), ignore_exception=True)
+
+    def copy(self, name, src, dst_dir):
+        exec_cmd("docker cp %s %s:%s" % (src, name, dst_dir))
+
+    def put_archive(self, name, data, dst_dir):
+        exec_cmd("docker cp - %s:%s" % (name, dst_dir), stdin=data)
+
+    def image_info(self, image):
+        out = exec_cmd("docker inspect --type=image %s" % image, 
+            ignore_exception=True)
+        if out is None: return None
+        js = json.loads(out)
+        if len(js) == 0: return None
+        return js[0]
+
+    def commit(self, name, image, labels=None):
+        changes = "".join([" --change %s" % pipes.quote("LABEL %s=%s" % (k, 
+            v)) for (k, v) in sorted((labels or {}).items())])
+        exec_cmd("docker commit%s %s %s" % (changes, name, image))
+
+    def remove_image(self, image):
+        exec_cmd("docker rmi -f %s" % image)
+
+    def prune_images(self, label):
+        exec_cmd("docker image prune -f --filter label=%s" % label)
+
+    def events(self, actions=("start", "die")):
+        cmd = ["docker", "events", "--format", "{{json .}}", "--filter",
+            "type=container"]
+        for a in actions: cmd+= ["--filter", "event=%s" % a]
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, close_fds=True)
+        try:
+            for l in iter(p.stdout.readline, ""):
+                try: yield event_record(json.loads(l))
+                except ValueError as e: continue
+        finally:
+            if p.poll() is None: p.kill()
+            p.wait()
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """ HTTPConnection over unix domain socket """
+    def __init__(self, path, timeout=None):
+        httplib.HTTPConnection.__init__(self, "localhost")
+        self.path = path
+        self.sock_timeout = timeout
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.sock_timeout is not None: sock.settimeout(self.sock_timeout)
+        sock.connect(self.path)
+        self.sock = sock
+
+def response_lines(resp):
+    """ yield each line of httplib response body as it arrives.  httplib 
+        only decodes chunked transfer encoding on read() which waits for the
+        full amount requested, so chunks are decoded here
+    """
+    if not resp.chunked:
+        for l in iter(resp.fp.readline, ""): yield l
+        return
+    buf = ""
+    while True:
+        size = resp.fp.readline()
+        try: size = int(size.split(";")[0].strip(), 16)
+        except ValueError as e: break
+        if size == 0: break
+        buf+= resp.fp.read(size)
+        resp.fp.readline()
+        while "\n" in buf:
+            (l, buf) = buf.split("\n", 1)
+            yield "%s\n" % l
+    if len(buf) > 0: yield buf
+
+def api_route(url):
+    """ return route template of docker api url used as its command class, 
+        for example /v1.24/containers/<id>/json returns 
+        '/containers/{id}/json' and /images/<repo>/<name>:<tag>/json returns
+        '/images/{name}/json'
+    """
+    parts = [p for p in url.split("?")[0].split("/") if len(p) > 0]
+    if len(parts) > 0 and re.search("^v[0-9.]+$", parts[0]): parts = parts[1:]
+    if len(parts) < 2 or parts[1] in api_collection_routes:
+        return "/%s" % "/".join(parts)
+    if parts[0] == "images":
+        # image names may contain '/' so only a trailing action is kept
+        action = []
+        if len(parts) > 2 and parts[-1] in api_image_actions: 
+            action = parts[-1:]
+        return "/".join(["", "images", "{name}"] + action)
+    return "/".join(["", parts[0], "{id}"] + parts[2:])
+
+class DockerAPI(DockerBackend):
+    """ docker backend talking to the docker engine API over the docker unix
+        socket.  Connections are kept alive and pooled between requests so
+        each operation costs a single HTTP round-trip.  Operations that 
+        cannot be expressed through the API (custom --dopt arguments) fall
+        back to the cli backend
+    """
+    def __init__(self, path=None, timeout=60):
+        if path is None: path = docker_socket
+        self.path = path
+        self.timeout = timeout
+        self.pool = Queue.LifoQueue()
+        self.cli = DockerCLI()
+
+    def request(self, method, url, body=None, params=None, stream=False,
+                headers=None):
+        """ perform request and return (status, parsed json or raw body).
+            A pooled connection that has been closed by the daemon is
+            retried once on a new connection
+        """
+        if params is not None: url+= "?%s" % urllib.urlencode(params)
+        hdrs = {"Content-Type": "application/json"}
+        if headers is not None: hdrs.update(headers)
+        if body is not None and not isinstance(body, basestring):
+            body = json.dumps(body)
+        logger.debug("docker api: %s %s" % (method, url))
+        start = time.time()
+        for attempt in (0, 1):
+            conn = None
+            if attempt == 0:
+                try: conn = self.pool.get_nowait()
+                except Queue.Empty: pass
+            fresh = conn is None
+            if fresh: conn = UnixHTTPConnection(self.path, timeout=self.timeout)
+            try:
+                conn.request(method, url, body, hdrs)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                if not fresh: continue
+                exec_stats.record(url, time.time() - start, False,
+                    "docker api %s %s" % (method, api_route(url)))
+                raise
+            if resp.getheader("connection", "").lower() == "close":
+                conn.close()
+            else: self.pool.put(conn)
+            break
+        exec_stats.record(url, time.time() - start, resp.status < 400,
+            "docker api %s %s" % (method, api_route(url)))
+        if stream or resp.getheader("content-type","").find("json")<0:
+            return (resp.status, data)
+        try: return (resp.status, json.loads(data) if len(data)>0 else None)
+        except ValueError as e: return (resp.status, data)
+
+    def stream(self, method, url, params=None, timeout=-1):
+        """ perform request on a dedicated connection and yield each json 
+            line of the response as it arrives.  HTTP/1.0 is requested so the 
+            daemon streams the body without chunked encoding, a chunked 
+            response is still decoded.  timeout defaults to the backend 
+            timeout, None waits forever
+        """
+        if params is not None: url+= "?%s" % urllib.urlencode(params)
+        if timeout == -1: timeout = self.timeout
+        logger.debug("docker api stream: %s %s" % (method, url))
+        conn = UnixHTTPConnection(self.path, timeout=timeout)
+        conn._http_vsn, conn._http_vsn_str = (10, "HTTP/1.0")
+        try:
+            conn.request(method, url, None, 
+                {"Content-Type": "application/json"})
+            resp = conn.getresponse()
+            if resp.status != 200:
+                data = resp.read()
+                try: data = json.loads(data)
+                except ValueError as e: pass
+                self.check(resp.status, data, url, ok=(200,))
+            for l in response_lines(resp):
+                try: yield json.loads(l)
+                except ValueError as e: continue
+        finally: conn.close()
+
+    def check(self, status, data, url, ok=(200, 201, 204)):
+        """ raise exception for unexpected response status """
+        if status not in ok:
+            msg = data.get("message", data) if type(data) is dict else data
+            raise Exception("docker api %s returned %s: %s" % (url, status, 
+                ("%s" % msg).strip()))
+
+    def ping(self):
+        try: return self.request("GET", "/_ping")[0] == 200
+        except (httplib.HTTPException, socket.error) as e:
+            logger.debug("docker api ping failed: %s" % e)
+            return False
+
+    def images(self):
+        (status, js) = self.request("GET", "/images/json")
+        self.check(status, js, "/images/json")
+        images = set()
+        for img in js:
+            for tag in img.get("RepoTags") or []: images.add(tag)
+        return images
+
+    def pull(self, image, progress=None):
+        repo, tag = split_image_name(image)
+        # errors during pull are reported within the progress stream
+        for js in self.stream("POST", "/images/create", 
+            params={"fromImage": repo, "tag": tag}):
+            if "error" in js:
+                raise Exception("failed to pull %s: %s"% (image, js["error"]))
+            if progress is not None: progress(image, js)
+
+    def containers(self, names=None):
+        """ records are built from the single container list request.  The
+            pid is only available through inspect, so running containers
+            are inspected (concurrently) only when names are provided, 
+            otherwise their pid is ""
+        """
+        (status, js) = self.request("GET", "/containers/json", 
+            params={"all": 1})
+        self.check(status, js, "/containers/json")
+        records = []
+        for c in js:
+            name = (c.get("Names") or ["/"])[0].lstrip("/")
+            if names is not None and name not in names: continue
+            running = c.get("State") == "running" or \
+                ("%s" % c.get("Status","")).startswith("Up")
+            networks = (c.get("NetworkSettings") or {}).get("Networks") or {}
+            ips = [n.get("IPAddress") for (k, n) in sorted(networks.items())
+                if n.get("IPAddress")]
+            records.append({"id": c["Id"], "name": name, "running": running,
+                "state": c.get("State", ""), "pid": "" if running else "0",
+                "mounts": c.get("Mounts") or [], "image": c.get("Image", ""),
+                "labels": c.get("Labels") or {}, 
+                "ip": ips[0] if len(ips) > 0 else ""})
+        pending = [r for r in records if r["running"]]
+        if names is None or len(pending) == 0: return records
+        def set_pid(r):
+            info = self.inspect(r["id"])
+            if info is None: (r["running"], r["pid"]) = (False, "0")
+            else: r["pid"] = container_record(info)["pid"]
+        workers = ThreadPool(min(MAX_THREADS, len(pending)))
+        try: workers.map(set_pid, pending)
+        finally: workers.close()
+        return records
+
+    def inspect(self, name):
+        url = "/containers/%s/json" % name
+        (status, js) = self.request("GET", url)
+        if status == 404: return None
+        self.check(status, js, url)
+        return js
+
+    def run(self, name, image, port, port_internal, fs_image=None, dopt=None,
+            labels=None):
+        # custom docker options are only understood by the cli
+        if dopt is not None:
+            return self.cli.run(name, image, port, port_internal, fs_image, 
+                dopt, labels)
+        intf = "%s/tcp" % port_internal
+        config = {
+            "Image": image, "Hostname": container_device(name) or name, 
+            "Tty": True,
+            "Labels": labels or {},
+            "ExposedPorts": {intf: {}},
+            "HostConfig": {
+                "Privileged": True, "CapAdd": ["ALL"],
+                "PortBindings": {},
+                "Binds": []
             }
-        Note, the device with the lower name will record the connection so
-        it's possible to have devices created with no connections
-        (as 'remote' connection is in connection list of a different device)
+        }
+        if port is not None:
+            config["HostConfig"]["PortBindings"][intf] = [
+                {"HostPort": "%s" % port}]
+        if fs_image is not None:
+            config["HostConfig"]["Binds"].append("%s:%s:ro" % (fs_image,
+                gen_flex_path))
+        if os.path.isdir(fs_image_dir):
+            config["HostConfig"]["Binds"].append("%s:%s:ro" % (
+                os.path.abspath(fs_image_dir), upgrade_mount))
+        url = "/containers/create"
+        (status, js) = self.request("POST", url, body=config, 
+            params={"name": name})
+        self.check(status, js, url)
+        url = "/containers/%s/start" % js["Id"]
+        (status, js) = self.request("POST", url)
+        self.check(status, js, url)
+
+    def rename(self, name, new_name):
+        url = "/containers/%s/rename" % name
+        (status, js) = self.request("POST", url, params={"name": new_name})
+        self.check(status, js, url)
+
+    def remove(self, name):
+        url = "/containers/%s" % name
+        (status, js) = self.request("DELETE", url, params={"force": 1})
+        self.check(status, js, url, ok=(200, 204, 404))
+
+    def execute(self, name, cmd):
+        url = "/containers/%s/exec" % name
+        (status, js) = self.request("POST", url, body={"Cmd": cmd,
+            "AttachStdout": True, "AttachStderr": True})
+        self.check(status, js, url)
+        exec_id = js["Id"]
+        url = "/exec/%s/start" % exec_id
+        (status, data) = self.request("POST", url, stream=True, 
+            body={"Detach": False, "Tty": False})
+        self.check(status, data, url)
+        # demultiplex stdout/stderr stream (8 byte header per frame)
+        out = []
+        while len(data) >= 8:
+            size = struct.unpack(">I", data[4:8])[0]
+            out.append(data[8:8+size])
+            data = data[8+size:]
+        out = "".join(out)
+        url = "/exec/%s/json" % exec_id
+        (status, js) = self.request("GET", url)
+        self.check(status, js, url)
+        if js.get("ExitCode", 0) != 0:
+            logger.debug("exec %s on %s failed: %s" % (cmd, name, out))
+            return None
+        return out
+
+    def copy(self, name, src, dst_dir):
+        # archive endpoint expects a tar stream of the file
+        self.put_archive(name, tar_file(src), dst_dir)
+
+    def put_archive(self, name, data, dst_dir):
+        url = "/containers/%s/archive" % name
+        (status, js) = self.request("PUT", url, body=data,
+            params={"path": dst_dir}, 
+            headers={"Content-Type": "application/x-tar"})
+        self.check(status, js, url)
+
+    def image_info(self, image):
+        url = "/images/%s/json" % image
+        (status, js) = self.request("GET", url)
+        if status == 404: return None
+        self.check(status, js, url)
+        return js
+
+    def commit(self, name, image, labels=None):
+        repo, tag = split_image_name(image)
+        url = "/commit"
+        params = {"container": name, "repo": repo, "tag": tag}
+        if labels: 
+            params["changes"] = "\n".join(["LABEL %s=%s" % (k, v) for (k, v)
+                in sorted(labels.items())])
+        (status, js) = self.request("POST", url, params=params)
+        self.check(status, js, url)
+
+    def remove_image(self, image):
+        url = "/images/%s" % image
+        (status, js) = self.request("DELETE", url, params={"force": 1})
+        self.check(status, js, url, ok=(200, 404))
+
+    def prune_images(self, label):
+        url = "/images/prune"
+        (status, js) = self.request("POST", url, params={"filters": 
+            json.dumps({"label": [label], "dangling": ["true"]})})
+        self.check(status, js, url)
+
+    def events(self, actions=("start", "die")):
+        filters = json.dumps({"type": ["container"], "event": list(actions)})
+        for js in self.stream("GET", "/events", params={"filters": filters},
+            timeout=None):
+            yield event_record(js)
+
+def container_record(js):
+    """ convert docker inspect dict to container record:
+            {"id":"", "name":"", "running":bool, "state":"", "pid":"", 
+             "mounts":[], "image":"", "labels":{}, "ip":""}
+    """
+    state = js.get("State") or {}
+    return {
+        "id": js.get("Id", ""),
+        "name": js.get("Name", "").lstrip("/"),
+        "running": bool(state.get("Running", False)),
+        "state": state.get("Status", ""),
+        "pid": "%s" % state.get("Pid", 0),
+        "mounts": js.get("Mounts") or [],
+        "image": (js.get("Config") or {}).get("Image", ""),
+        "labels": (js.get("Config") or {}).get("Labels") or {},
+        "ip": (js.get("NetworkSettings") or {}).get("IPAddress", "")
+    }
+
+def event_record(js):
+    """ convert docker event dict to event record:
+            {"action":"", "id":"", "name":"", "time":0}
+    """
+    actor = js.get("Actor") or {}
+    return {
+        "action": js.get("Action", js.get("status", "")),
+        "id": actor.get("ID", js.get("id", "")),
+        "name": (actor.get("Attributes") or {}).get("name", ""),
+        "time": js.get("timeNano", js.get("time", 0))
+    }
+
+def container_name(device_name):
+    """ return container name of device within the current instance """
+    if instance is None: return device_name
+    return "%s-%s" % (instance, device_name)
+
+def container_device(name):
+    """ return device name of container within the current instance or None
+        if the container belongs to another instance
+    """
+    if instance is None: return name
+    prefix = "%s-" % instance
+    if not name.startswith(prefix): return None
+    return name[len(prefix):]
+
+def get_container_snapshot(names=None):
+    """ return dict of container records for the provided device names
+        indexed by device name (see container_name), or for all containers 
+        indexed by exact container name, using one bulk docker query
+    """
+    snapshot = {}
+    if names is None:
+        for r in get_docker().containers(): snapshot[r["name"]] = r
+        return snapshot
+    devices = dict([(container_name(n), n) for n in names])
+    for r in get_docker().containers(names=devices.keys()):
+        if r["name"] in devices: snapshot[devices[r["name"]]] = r
+    return snapshot
+
+def tar_file(src):
+    """ return tar archive (string) containing the single file src """
+    buf = StringIO.StringIO()
+    tar = tarfile.open(fileobj=buf, mode="w")
+    tar.add(src, arcname=os.path.basename(src))
+    tar.close()
+    return buf.getvalue()
+
+def split_image_name(image):
+    """ return (repository, tag) for docker image name, tag defaults to 
+        latest.  Registry port within the repository is not a tag
+    """
+    if ":" in image and "/" not in image.split(":")[-1]:
+        return tuple(image.rsplit(":", 1))
+    return (image, "latest")
+
+def get_docker(backend=None):
+    """ return docker backend, on first call select backend based on provided
+        preference: 'api', 'cli', or 'auto' (api when the docker socket is
+        reachable, otherwise cli)
+    """
+    global docker
+    if docker is not None and backend is None: return docker
+    if backend is None: backend = "auto"
+    if backend in ("api", "auto"):
+        api = DockerAPI()
+        if backend == "api" or (os.path.exists(api.path) and api.ping()):
+            logger.debug("using docker api backend: %s" % api.path)
+            docker = api
+            return docker
+    logger.debug("using docker cli backend")
+    docker = DockerCLI()
+    return docker
+
+def get_listening_ports():
+    """ return set of tcp ports currently listening on the host """
+    ports = set()
+    for fname in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(fname, "r") as f: lines = f.read().split("\n")[1:]
+        except IOError as e: continue
+        for l in lines:
+            fields = l.split()
+            # state 0A is TCP_LISTEN
+            if len(fields) > 3 and fields[3] == "0A":
+                ports.add(int(fields[1].split(":")[-1], 16))
+    return ports
+
+def allocate_host_ports(devices, previous=None, base=None, reserved=None):
+    """ assign host port to each device without a port (None).  Ports 
+        previously allocated to a device (previous dict of device name to 
+        port) are kept, others are allocated from base skipping ports used 
+        within the topology, reserved, or currently listening on the host
+    """
+    if previous is None: previous = {}
+    if base is None: base = host_port_base
+    used = set(reserved or [])
+    used|= set([d.port for d in devices.values() if d.port is not None])
+    pending = [n for n in sorted(devices) if devices[n].port is None]
+    for n in pending:
+        if previous.get(n) is not None and previous[n] not in used:
+            devices[n].port = previous[n]
+            used.add(previous[n])
+    pending = [n for n in pending if devices[n].port is None]
+    if len(pending) == 0: return devices
+    used|= get_listening_ports()
+    port = base
+    for n in pending:
+        while port in used: port+= 1
+        if port >= 0xffff: raise Exception("no free host ports available")
+        devices[n].port = port
+        used.add(port)
+    logger.debug("allocated host ports for %s devices" % len(pending))
+    return devices
+
+def allocate_instance_ports(devices, path):
+    """ allocate host ports for all devices of the current instance of lab 
+        path.  Ports are leased per instance within instance_index_path so
+        concurrent labtool invocations never allocate the same port and an 
+        instance keeps its ports until released by cleanup:
+            {"version": 1, "instances": {
+                "<instance>": {"path": "", "ports": {"<device>": 0}}
+            }}
+    """
+    default = {"version": 1, "instances": {}}
+    with locked_index(instance_index_path, default) as index:
+        leases = index["instances"]
+        lease = leases.get(instance, {"path": path, "ports": {}})
+        if lease["path"] != path:
+            raise Exception("instance %s already used by %s" % (instance,
+                lease["path"]))
+        reserved = set()
+        for (name, l) in leases.items():
+            if name != instance: reserved|= set(l["ports"].values())
+        for d in devices.values(): d.port = None
+        allocate_host_ports(devices, lease["ports"], reserved=reserved)
+        lease["ports"] = dict([(n, devices[n].port) for n in devices])
+        leases[instance] = lease
+    return devices
+
+def leased_instance_ports():
+    """ return set of host ports leased by all instances """
+    if not os.path.isfile(instance_index_path): return set()
+    default = {"version": 1, "instances": {}}
+    with locked_index(instance_index_path, default) as index:
+        ports = set()
+        for l in index["instances"].values(): ports|= set(l["ports"].values())
+    return ports
+
+def release_instance_ports():
+    """ release host ports leased by the current instance """
+    default = {"version": 1, "instances": {}}
+    with locked_index(instance_index_path, default) as index:
+        if index["instances"].pop(instance, None) is not None:
+            logger.debug("released host ports of instance %s" % instance)
+
+def check_host_capacity(device_count):
+    """ verify host kernel limits (pid, network namespace, and inotify) can
+        support the provided number of devices.  All exceeded limits are
+        reported.  return boolean success
+    """
+    def read_int(path):
+        try:
+            with open(path, "r") as f: return int(f.read().strip())
+        except (IOError, ValueError) as e: return None
+    errors = []
+    tasks = len([p for p in os.listdir("/proc") if p.isdigit()])
+    for (path, need) in (
+        ("/proc/sys/kernel/pid_max", tasks+device_count*SCALE_PIDS_PER_DEVICE),
+        ("/proc/sys/kernel/threads-max", 
+            tasks+device_count*SCALE_PIDS_PER_DEVICE),
+        ("/proc/sys/user/max_net_namespaces", device_count+1),
+        ("/proc/sys/fs/inotify/max_user_instances", 
+            device_count*SCALE_INOTIFY_PER_DEVICE),
+        ("/proc/sys/fs/inotify/max_user_watches", 
+            device_count*SCALE_WATCHES_PER_DEVICE)):
+        limit = read_int(path)
+        if limit is not None and limit < need:
+            errors.append("%s is %s, %s devices require at least %s (sysctl "\
+                "-w %s=%s)" % (path, limit, device_count, need, 
+                path[len("/proc/sys/"):].replace("/", "."), need))
+    # linux bridge supports at most 1024 ports (docker0)
+    if device_count >= 1024:
+        errors.append("docker bridge supports at most 1023 containers")
+    for e in errors: logger.error("insufficient host capacity: %s" % e)
+    return len(errors) == 0
+
+def fabric_connections(names, pairs):
+    """ return connection list for list of (device, device) pairs using the
+        next free fpPort on each device
+    """
+    next_port = dict([(n, 1) for n in names])
+    connections = []
+    for (a, b) in pairs:
+        connections.append({a: "fpPort%s" % next_port[a], 
+            b: "fpPort%s" % next_port[b]})
+        next_port[a]+= 1
+        next_port[b]+= 1
+    return connections
+
+def leaf_spine_fabric(spines=2, leaves=4):
+    """ every leaf connected to every spine.  Leaf port n connects to spine
+        n and spine port n connects to leaf n
+    """
+    spine = ["spine%s" % (i+1) for i in xrange(spines)]
+    leaf = ["leaf%s" % (i+1) for i in xrange(leaves)]
+    return (spine + leaf, [(l, s) for l in leaf for s in spine])
+
+def fat_tree_fabric(k=4):
+    """ k-ary fat-tree: k pods of k/2 edge and k/2 aggregation switches with
+        (k/2)^2 core switches
+    """
+    if k < 2 or k % 2 != 0: raise ValueError("k must be an even number >= 2")
+    half = k/2
+    core = ["core%s" % (i+1) for i in xrange(half*half)]
+    agg, edge, pairs = ([], [], [])
+    for p in xrange(k):
+        pod_agg = ["agg%s" % (p*half+i+1) for i in xrange(half)]
+        pod_edge = ["edge%s" % (p*half+i+1) for i in xrange(half)]
+        pairs+= [(e, a) for e in pod_edge for a in pod_agg]
+        for (i, a) in enumerate(pod_agg):
+            pairs+= [(a, core[i*half+j]) for j in xrange(half)]
+        agg+= pod_agg
+        edge+= pod_edge
+    return (core + agg + edge, pairs)
+
+def ring_fabric(devices=4, prefix="node"):
+    """ each device connected to the next with the last connected to the
+        first
+    """
+    names = ["%s%s" % (prefix, i+1) for i in xrange(devices)]
+    if devices < 3: raise ValueError("ring requires at least 3 devices")
+    return (names, [(names[i], names[(i+1)%devices]) for i in xrange(devices)])
+
+def full_mesh_fabric(devices=4, prefix="node"):
+    """ every device connected to every other device """
+    names = ["%s%s" % (prefix, i+1) for i in xrange(devices)]
+    return (names, [(names[i], names[j]) for i in xrange(devices) 
+        for j in xrange(i+1, devices)])
+
+fabric_generators = {
+    "leaf-spine": leaf_spine_fabric,
+    "fat-tree": fat_tree_fabric,
+    "ring": ring_fabric,
+    "full-mesh": full_mesh_fabric,
+}
+
+def generate_fabric(spec):
+    """ return tuple (devices, connections) in topology.json format for a
+        fabric spec of the form:
+            {"type": "leaf-spine", "spines": 2, "leaves": 4,
+             "device": {<attributes applied to every device>}}
+        see fabric_generators for supported types and their parameters.
+        Generated devices have no port so host ports are allocated 
+        automatically.  Raises ValueError on invalid spec
+    """
+    if type(spec) is not dict or spec.get("type") not in fabric_generators:
+        raise ValueError("fabric type must be one of: %s" % ", ".join(
+            sorted(fabric_generators)))
+    if type(spec.get("device", {})) is not dict:
+        raise ValueError("fabric device attributes must be an object")
+    params = dict([(str(k), v) for (k, v) in spec.items() 
+        if k not in ("type", "device")])
+    try: (names, pairs) = fabric_generators[spec["type"]](**params)
+    except TypeError as e:
+        raise ValueError("invalid %s fabric parameters: %s" % (spec["type"],
+            ", ".join(sorted(params))))
+    devices = []
+    for n in names:
+        d = dict(spec.get("device", {}))
+        d["name"] = n
+        devices.append(d)
+    return (devices, fabric_connections(names, pairs))
+
+class Port(object):
+    """ device interface, link is the Link using the interface """
+    __slots__ = ("device", "name", "link")
+    def __init__(self, device, name):
+        (self.device, self.name, self.link) = (device, name, None)
+
+    def peer(self):
+        """ return Port on the other end of the link """
+        return self.link.b if self.link.a is self else self.link.a
+
+class Link(object):
+    """ connection between two ports.  Port a always belongs to the device
+        with the lower name
+    """
+    __slots__ = ("a", "b")
+    def __init__(self, a, b):
+        if a.device.key > b.device.key: (a, b) = (b, a)
+        (self.a, self.b) = (a, b)
+        a.link = self
+        b.link = self
+
+    def key(self):
+        """ return tuple (device, port, remote-device, remote-port) """
+        return (self.a.device.key, self.a.name, self.b.device.key, 
+            self.b.name)
+
+    def label(self):
+        return "%s:%s - %s:%s" % (self.a.device.key, self.a.name,
+            self.b.device.name, self.b.name)
+
+class Device(object):
+    """ topology device.  pid is set once the container is running and ports
+        is the dict of interface name to Port.  lab_port is the host port 
+        within topology.json, port differs when allocated to an instance
+    """
+    __slots__ = ("key", "name", "port", "lab_port", "port_internal", "schema",
+        "username", "password", "dockerimage", "flexswitch", "pid", "ports")
+    def __init__(self, name, port=None, port_internal=8080, schema="http",
+        username="admin", password="snaproute", dockerimage=None,
+        flexswitch="_image_default_"):
+        self.key = name.lower()
+        self.name = name
+        self.port = port
+        self.lab_port = port
+        self.port_internal = port_internal
+        self.schema = schema
+        self.username = username
+        self.password = password
+        self.dockerimage = dockerimage or docker_image
+        self.flexswitch = flexswitch
+        self.pid = ""
+        self.ports = {}
+
+    def links(self):
+        """ return list of links connected to this device """
+        return [p.link for p in self.ports.values() if p.link is not None]
+
+    def running(self):
+        return self.pid != "" and self.pid != "0"
+
+    def has_flexswitch(self):
+        return self.flexswitch.upper() != "NA"
+
+class Topology(object):
+    """ devices indexed by lower case name with the links between them.
+        Every Port references its Link so the neighbors of a device are
+        found without walking the topology.  Iteration, len, in, and []
+        operate on device names the same as a dict
+    """
+    __slots__ = ("devices", "links")
+    def __init__(self):
+        self.devices = {}
+        self.links = []
+
+    def __iter__(self): return iter(self.devices)
+    def __len__(self): return len(self.devices)
+    def __contains__(self, key): return key in self.devices
+    def __getitem__(self, key): return self.devices[key]
+    def keys(self): return self.devices.keys()
+    def values(self): return self.devices.values()
+    def items(self): return self.devices.items()
+
+    def add_device(self, device):
+        self.devices[device.key] = device
+        return device
+
+    def connect(self, d1, p1, d2, p2):
+        """ add and return link between interface p1 of device d1 and 
+            interface p2 of device d2
+        """
+        ports = []
+        for (d, p) in ((d1, p1), (d2, p2)):
+            device = self.devices[d]
+            if p not in device.ports: device.ports[p] = Port(device, p)
+            ports.append(device.ports[p])
+        link = Link(ports[0], ports[1])
+        self.links.append(link)
+        return link
+
+    def device_links(self, names):
+        """ return list of links connected to any of the provided devices """
+        links = {}
+        for n in names:
+            for l in self.devices[n].links(): links[id(l)] = l
+        return links.values()
+
+    def link_keys(self):
+        """ return set of (device, port, remote-device, remote-port) tuples
+            for all links
+        """
+        return set([l.key() for l in self.links])
+
+def validate_topology(js, scale=False):
+    """ validate topology json object and return tuple (devices, errors)
+        where devices is the Topology and errors the list of all problems 
+        found.  Validation is a single pass over the devices and connections
+        using dict and set indexes
+    """
+    devices, errors = (Topology(), [])
+    for attr in ["devices", "connections"]:
+        if type(js.get(attr)) is not list or len(js[attr]) == 0:
+            em = "invalid topology file. Expect '%s' attribute " % attr
+            em+= "with type 'list' and length>0"
+            errors.append(em)
+    if len(errors) > 0: return (devices, errors)
+    name_reg = re.compile(device_name_reg)
+    link_reg = re.compile(scale_link_name_reg if scale else link_name_reg)
+
+    # build device list first
+    ports = {}
+    for d in js["devices"]:
+        if type(d) is not dict or "name" not in d or \
+            not isinstance(d["name"], basestring):
+            errors.append("invalid device object: %s" % d)
+            continue
+        name = d["name"]
+        key = name.lower()
+        if not name_reg.search(name):
+            errors.append("invalid device name '%s'" % name)
+            continue
+        if key in devices:
+            errors.append("device %s defined multiple times" % name)
+            continue
+        try:
+            port = d.get("port", "auto")
+            port = None if port == "auto" else int(port)
+            port_internal = int(d.get("port_internal", "8080"))
+        except (ValueError, TypeError) as e:
+            errors.append("invalid port for %s, must be an integer" % name)
+            continue
+        if port is not None:
+            if port >= 0xffff or port < 0x400:
+                errors.append("invalid port %s, must be between %d and %d" % (
+                    port, 0x400, 0xffff))
+                continue
+            if port in ports:
+                errors.append("host port %s used by %s and %s" % (port, 
+                    ports[port], key))
+                continue
+            ports[port] = key
+        devices.add_device(Device(name, port, port_internal,
+            schema=d.get("schema", "http"),
+            username=d.get("username", "admin"),
+            password=d.get("password", "snaproute"),
+            dockerimage=d.get("dockerimage", docker_image),
+            flexswitch=d.get("flexswitch", "_image_default_")))
+
+    # build connections
+    link_names = set()  # interface names already matched link_reg
+    for c in js["connections"]:
+        items = c.items() if type(c) is dict else []
+        if len(items) != 2 or not isinstance(items[0][1], basestring) or \
+            not isinstance(items[1][1], basestring) or \
+            len(items[0][1]) == 0 or len(items[1][1]) == 0:
+            errors.append("invalid connection: %s" % c)
+            continue
+        # verify device name and connection name
+        ((d1, c1), (d2, c2)) = items
+        d1_lower, d2_lower = (d1.lower(), d2.lower())
+        count = len(errors)
+        for dn in (d1_lower, d2_lower):
+            if dn not in devices:
+                errors.append("device %s not in devices list" % dn)
+        for cn in (c1, c2):
+            if cn in link_names: continue
+            if link_reg.search(cn): link_names.add(cn)
+            else: errors.append("invalid connection name '%s'" % cn)
+        if d1_lower == d2_lower:
+            errors.append("unsupported back-to-back connection: %s" % c)
+        elif c1 == "eth0" or c2 == "eth0":
+            errors.append("eth0 is reserved for docker management: %s" % c)
+        if len(errors) > count: continue
+        for (dn, cn) in ((d1_lower, c1), (d2_lower, c2)):
+            if cn in devices[dn].ports:
+                errors.append("device %s interface %s referenced multiple "\
+                    "times" % (dn, cn))
+        if len(errors) > count: continue
+        devices.connect(d1_lower, c1, d2_lower, c2)
+
+    max_count = MAX_SCALE_DEVICE_COUNT if scale else MAX_DEVICE_COUNT
+    if len(devices) > max_count:
+        emsg = "Number of devices (%s) exceeds maximum count %s" % (
+            len(devices), max_count)
+        if not scale: emsg+= ", use --scale for large topologies"
+        errors.append(emsg)
+    return (devices, errors)
+
+def get_topology(topology_file = None, scale=False):
+    """ read in topology file, verify connections, and return new Topology
+        of Device objects indexed by lower case device name.  Each Link is
+        referenced from the Port on both devices so the links of a device
+        are available without walking the full topology:
+            topo["leaf1"].port              # docker exposed port
+            topo["leaf1"].pid               # docker pid once created
+            topo["leaf1"].ports["fpPort1"]  # Port with link to remote Port
+            topo.links                      # list of all links
+        Note, link port 'a' is always on the device with the lower name
     
+        Devices without a port (or port "auto") are allocated a host port
+        (see allocate_host_ports).  In scale mode up to 
+        MAX_SCALE_DEVICE_COUNT devices and any valid linux interface name are
+        allowed.  A "fabric" attribute generates devices and connections
+        (see generate_fabric) in addition to any listed in the file.
+
         a valid topology_file must meet the following requirements:
             * between 2 and max_device_count devices
+            * unique host port per device
             * no duplicate links on any device
             * eth0 cannot be used on any link
             * no 'loopback' connections to the same device
+        All errors are reported before returning None
     """
     try:
         with open(topology_file, "r") as f: js = json.load(f)
-        devices = {}
-        for attr in ["devices", "connections"]:
-            if attr not in js or len(js[attr]) == 0 or \
-                type(js[attr]) is not list:
-                em = "invalid topology file. Expect '%s' attribute " % attr
-                em+= "with type 'list' and length>0"
-                logger.error(em)
-                return None
-        # build device list first
-        for d in js["devices"]:
-            if type(d) is not dict or "name" not in d or "port" not in d:
-                logger.error("invalid device object: %s" % d)
-                return None
-            if not re.search(device_name_reg, d["name"]):
-                logger.error("invalid device name '%s'" % dn)
-                return None
-            try:
-                port = int(d["port"])
-                port_internal = int(d.get("port_internal", "8080"))
-                if port >= 0xffff or port < 0x400:
-                    logger.error("invalid port %s, must be between %d and %d"%(
-                        port, 0x400, 0xffff))
-                    return None
-            except ValueError as e:
-                logger.error("invalid port for %s, must be an integer" % d)
-                return None
-            # everything ok, add to devices
-            devices[d["name"].lower()] = {
-                    "name": d["name"], "port": int(d["port"]), 
-                    "port_internal": port_internal, 
-                    "schema":d.get("schema","http"),
-                    "username":d.get("username", "admin"), 
-                    "password":d.get("password", "snaproute"),
-                    "connections": [], "interfaces":[], "pid":"",
-                    "dockerimage":d.get("dockerimage", docker_image),
-                    "flexswitch":d.get("flexswitch", "_image_default_")
-            }
-
-        # build connections
-        for c in js["connections"]:
-            if type(c) is not dict or len(c.keys())!=2 or \
-                (type(c[c.keys()[0]]) is not str and \
-                type(c[c.keys()[0]]) is not unicode) or \
-                len(c[c.keys()[0]])==0 or \
-                (type(c[c.keys()[1]]) is not str and \
-                type(c[c.keys()[1]]) is not unicode) or \
-                len(c[c.keys()[1]])==0:
-                logger.error("invalid connection: %s" % c)
-                return None
-            # verify device name and connection name
-            d1,c1 = (c.keys()[0], c[c.keys()[0]])
-            d2,c2 = (c.keys()[1], c[c.keys()[1]])
-            d1_lower, d2_lower = (d1.lower(), d2.lower())
-            if d1_lower not in devices:
-                logger.error("device %s not in devices list" % d1_lower)
-                return None
-            if d2_lower not in devices:
-                logger.error("device %s not in devices list" % d2_lower)
-                return None
-            for cn in (c1, c2):
-                if not re.search(link_name_reg, cn):
-                    logger.error("invalid connection name '%s'" % cn)
-                    return None
-            if d1_lower == d2_lower:
-                logger.error("unsupported back-to-back connection: %s" % c)
-                return None
-            if c1 == "eth0" or c2 == "eth0":
-                logger.error("eth0 is reserved for docker management: %s" % c)
-                return None
-            if c1 in devices[d1_lower]["interfaces"]:
-                em = "device %s interface %s referenced multiple times" % (
-                    d1_lower, c1)
-                logger.error(em)
-                return None
-            if c2 in devices[d2_lower]["interfaces"]:
-                em = "device %s interface %s referenced multiple times" % (
-                    d2_lower, c2)
-                logger.error(em)
-                return None
-            devices[d1_lower]["interfaces"].append(c1)
-            devices[d2_lower]["interfaces"].append(c2)
-            if d1_lower <= d2_lower:
-                devices[d1_lower]["connections"].append({
-                    "local-port":c1, "remote-port":c2,
-                    "remote-device":d2_lower
-                })
-            else:
-                devices[d2_lower]["connections"].append({
-                    "local-port":c2, "remote-port":c1,
-                    "remote-device":d1_lower
-                })
+        if type(js) is not dict: raise ValueError("expected json object")
+        if "fabric" in js:
+            for k in ("devices", "connections"):
+                if type(js.get(k, [])) is not list:
+                    raise ValueError("%s must be a list" % k)
+            (devices, connections) = generate_fabric(js["fabric"])
+            js["devices"] = js.get("devices", []) + devices
+            js["connections"] = js.get("connections", []) + connections
     except IOError as e:
         logger.error("failed to open topology json file: %s" % (
             topology_file))
         return None
     except ValueError as e:
-        logger.error("failed to parse topology json file: %s" % (
-            topology_file))
+        logger.error("failed to parse topology json file: %s (%s)" % (
+            topology_file, e))
         logger.debug("error occurred: %s" % traceback.format_exc())
         return None
 
-    if len(devices) > MAX_DEVICE_COUNT:
-        logger.error("Number of devices (%s) exceeds maximum count %s" % (
-            len(devices), MAX_DEVICE_COUNT))
-        return None
-    elif len(devices) == 0:
+    (devices, errors) = validate_topology(js, scale)
+    for e in errors[:MAX_TOPOLOGY_ERRORS]: logger.error(e)
+    if len(errors) > MAX_TOPOLOGY_ERRORS:
+        logger.error("... %s more topology errors" % (
+            len(errors) - MAX_TOPOLOGY_ERRORS))
+    if len(errors) > 0: return None
+    if len(devices) == 0:
         logger.error("No valid devices found in topology file")
         return None
+
+    # allocate host ports, keeping ports of the last applied topology
+    previous = {}
+    applied = read_applied_topology(os.path.dirname(topology_file))
+    if applied is not None:
+        for (n, spec) in applied["devices"].items(): 
+            previous[n] = spec.get("port")
+    try: 
+        if instance is not None: 
+            allocate_instance_ports(devices, os.path.dirname(topology_file))
+        else: 
+            # never allocate ports leased by a running instance
+            allocate_host_ports(devices, previous, 
+                reserved=leased_instance_ports())
+    except Exception as e:
+        logger.error("failed to allocate host ports: %s" % e)
+        return None
     return devices
 
 def check_docker_running():
@@ -279,44 +1636,137 @@ def check_docker_running():
         return boolean success
     """
     logger.info("checking docker state")
-    out = exec_cmd("docker ps", ignore_exception=True)
-    return (out is not None)
+    return get_docker().ping()
+
+class ImageIndex(object):
+    """ index of local docker images built with a single docker query per
+        run and updated as images are pulled
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.images = None
+
+    def has(self, image):
+        """ return true if image is present locally """
+        with self.lock:
+            if self.images is None: self.images = get_docker().images()
+            return "%s:%s" % split_image_name(image) in self.images
+
+    def add(self, image):
+        with self.lock:
+            if self.images is not None: 
+                self.images.add("%s:%s" % split_image_name(image))
+
+    def invalidate(self):
+        with self.lock: self.images = None
+
+image_index = ImageIndex()
+
+class PullProgress(object):
+    """ aggregate docker pull progress events of concurrent pulls into a 
+        single periodic progress message
+    """
+    def __init__(self, interval=PULL_PROGRESS_INTERVAL):
+        self.lock = threading.Lock()
+        self.interval = interval
+        self.images = {}
+        self.last = time.time()
 
-def check_docker_image(image):
+    def start(self, image):
+        with self.lock: self.images[image] = {"layers": {}, "done": False}
+
+    def finish(self, image):
+        with self.lock: 
+            self.images[image]["done"] = True
+            done = len([i for i in self.images if self.images[i]["done"]])
+            logger.info("pulled docker image %s (%s of %s)" % (image, done, 
+                len(self.images)))
+
+    def update(self, image, event):
+        """ progress callback for DockerBackend.pull """
+        layer = event.get("id")
+        status = event.get("status", "")
+        detail = event.get("progressDetail") or {}
+        with self.lock:
+            if layer is None or image not in self.images: return
+            layers = self.images[image]["layers"]
+            (current, total, done) = layers.get(layer, (0, 0, False))
+            if status.startswith("Downloading") and "total" in detail:
+                (current, total) = (detail.get("current", 0), detail["total"])
+            elif status in ("Download complete", "Pull complete", 
+                "Already exists"):
+                (current, done) = (total, True)
+            layers[layer] = (current, total, done)
+            if time.time() - self.last >= self.interval:
+                self.last = time.time()
+                logger.info(self.summary())
+
+    def summary(self):
+        """ return aggregated progress message, caller must hold lock """
+        (layers, done, current, total) = (0, 0, 0, 0)
+        pending = [i for i in self.images if not self.images[i]["done"]]
+        for i in pending:
+            for (c, t, d) in self.images[i]["layers"].values():
+                layers+= 1
+                done+= int(d)
+                current+= c
+                total+= t
+        return "pulling %s docker images: %s/%s layers, %.1f/%.1f MB" % (
+            len(pending), done, layers, current/1048576.0, total/1048576.0)
+
+@traced("image", 0)
+def check_docker_image(image, progress=None):
     """ check if docker_image is present.  If not, print info message and
-        pull it down
-    """
-    img = image.split(":")
-    if len(img) == 2:
-        if len(img[0]) == 0 or len(img[1]) == 0:
-            raise Exception("invalid docker image name: %s" % image)
-        cmd = "docker images | egrep \"^%s \" | egrep \"%s\" | wc -l"%(
-                img[0], img[1])
-    else:
-        cmd = "docker images | egrep \"^%s \" | " % image
-        cmd+= "egrep \"latest\" | wc -l"
+        pull it down.  progress is an optional PullProgress shared between
+        concurrent pulls
+    """
+    repo, tag = split_image_name(image)
+    if len(repo) == 0 or len(tag) == 0:
+        raise Exception("invalid docker image name: %s" % image)
 
-    out = exec_cmd(cmd)
-    if out.strip() == "0":
+    if not image_index.has(image):
         linfo = "Downloading docker image: %s. " % image
         linfo+= "This may take a few minutes..."
         logger.info(linfo)
-        out = exec_cmd("docker pull %s" % image)
+        if progress is None: get_docker().pull(image)
+        else:
+            progress.start(image)
+            get_docker().pull(image, progress=progress.update)
+            progress.finish(image)
+        image_index.add(image)
     else:
         logger.debug("docker_image %s is present" % image)
 
+def pull_docker_images(images):
+    """ concurrently verify/pull all provided docker images. return boolean
+        success
+    """
+    images = sorted(set(images))
+    if len(images) == 0: return True
+    progress = PullProgress()
+    def pull(image):
+        try: 
+            check_docker_image(image, progress)
+            return True
+        except Exception as e:
+            logger.error("Failed to verify/pull docker image %s: %s" % (
+                image, e))
+            return False
+    workers = ThreadPool(min(MAX_THREADS, len(images)))
+    try: return all(workers.map(pull, images))
+    finally: workers.close()
+
 def container_exists(device_name):
     """ return true if a container (running or not running) with provided
         name already exists
     """ 
-    cmd = "docker ps -aqf name=%s" % device_name
-    return len(exec_cmd(cmd)) > 0
+    return get_docker().inspect(container_name(device_name)) is not None
 
 def container_is_running(device_name):
     """ return true if a container with provided name is currently running """
 
-    cmd = "docker ps -qf name=%s" % device_name
-    return len(exec_cmd(cmd)) > 0
+    js = get_docker().inspect(container_name(device_name))
+    return js is not None and container_record(js)["running"]
 
 def remove_flexswitch_container(device_name, device_pid=None, force=False):
     """ check if container exists.  If so, remove it else do nothing """
@@ -326,384 +1776,2074 @@ def remove_flexswitch_container(device_name, device_pid=None, force=False):
         logger.info("removing existing container %s" % device_name)
         # remove soft links for pid
         if device_pid is not None and \
-            os.path.isfile("%s/%s" % (netns_dir, device_pid)):
+            os.path.isfile("%s/%s" % (netns_dir, netns_handle(device_pid))):
             logger.debug("removing netns pid: %s" % device_pid)
-            cmd = "rm %s/%s" % (netns_dir, device_pid)
+            cmd = "rm %s/%s" % (netns_dir, netns_handle(device_pid))
             exec_cmd(cmd, ignore_exception=True)
-        cmd = "docker rm -f %s" % device_name
-        exec_cmd(cmd, ignore_exception=True)
+        try: get_docker().remove(container_name(device_name))
+        except Exception as e:
+            logger.debug("failed to remove %s: %s" % (device_name, e))
+
+def pool_key(image, fs_image=None, dopt=None):
+    """ return key identifying interchangeable pooled containers """
+    return hashlib.sha256("%s|%s|%s" % (image, fs_image, dopt)).hexdigest()[:16]
+
+def get_pool_containers(snapshot=None):
+    """ return dict of pool key to list of unclaimed, running pooled 
+        container names
+    """
+    if snapshot is None: snapshot = get_container_snapshot()
+    pool = {}
+    for name in sorted(snapshot):
+        r = snapshot[name]
+        if r["running"] and pool_label in r["labels"] and \
+            name.startswith(pool_prefix) and \
+            not name.startswith(pool_warming_prefix):
+            pool.setdefault(r["labels"][pool_label], []).append(name)
+    return pool
+
+def publish_ports(entries):
+    """ publish container ports on the host for containers started without
+        a docker port mapping (pooled containers).  Each entry is a tuple of
+        (container_name, container_ip, port, port_internal).  All rules are
+        installed with a single iptables-restore and tagged with the 
+        container name so they can be removed by unpublish_ports.  The 
+        previous route_localnet value is saved in route_localnet_saved and
+        restored once the last rule is removed
+    """
+    if len(entries) == 0: return
+    # allow DNAT of connections to localhost (same as docker without proxy)
+    if not os.path.exists(route_localnet_saved):
+        if not os.path.isdir(os.path.dirname(route_localnet_saved)):
+            os.makedirs(os.path.dirname(route_localnet_saved))
+        with open(route_localnet_path, "r") as f: value = f.read().strip()
+        with open(route_localnet_saved, "w") as f: f.write(value)
+    with open(route_localnet_path, "w") as f: f.write("1")
+    nat, flt = (["*nat"], ["*filter"])
+    for (name, ip, port, port_internal) in entries:
+        tag = "-m comment --comment %s%s" % (port_rule_tag, name)
+        dnat = "-p tcp -m addrtype --dst-type LOCAL --dport %s %s " % (
+            port, tag)
+        dnat+= "-j DNAT --to-destination %s:%s" % (ip, port_internal)
+        nat.append("-I PREROUTING %s" % dnat)
+        nat.append("-I OUTPUT %s" % dnat)
+        nat.append("-I POSTROUTING -p tcp -s 127.0.0.0/8 -d %s " % ip +
+            "--dport %s %s -j MASQUERADE" % (port_internal, tag))
+        flt.append("-I FORWARD -p tcp -d %s --dport %s %s -j ACCEPT" % (ip,
+            port_internal, tag))
+    rules = nat + ["COMMIT"] + flt + ["COMMIT"]
+    exec_cmd("iptables-restore --noflush", stdin="%s\n" % "\n".join(rules))
+
+def published_ports():
+    """ return set of container names with host port rules installed by
+        publish_ports or None if iptables rules cannot be read
+    """
+    out = exec_cmd("iptables-save", ignore_exception=True)
+    if out is None: return None
+    return set([r1.group("name") for r1 in [re.search(port_rule_reg, l) for
+        l in out.split("\n") if l.startswith("-A ")] if r1 is not None])
+
+def unpublish_ports(names=None):
+    """ remove host port rules installed by publish_ports for containers, or
+        all rules if names is None.  route_localnet is restored once no
+        rules remain
+    """
+    out = exec_cmd("iptables-save", ignore_exception=True)
+    if out is None: return
+    rules, table, found, remaining = ([], None, False, 0)
+    for l in out.split("\n"):
+        if l.startswith("*"): 
+            table = l
+            rules.append(l)
+        elif l.startswith("COMMIT"): rules.append(l)
+        elif l.startswith("-A "):
+            r1 = re.search(port_rule_reg, l)
+            if r1 is None: continue
+            if names is None or r1.group("name") in names:
+                rules.append("-D %s" % l[3:])
+                found = True
+            else: remaining+= 1
+    if found: 
+        exec_cmd("iptables-restore --noflush", stdin="%s\n"%"\n".join(rules),
+            ignore_exception=True)
+    if remaining == 0: restore_route_localnet()
+
+def restore_route_localnet():
+    """ restore route_localnet value saved by publish_ports, if any """
+    if not os.path.exists(route_localnet_saved): return
+    with open(route_localnet_saved, "r") as f: value = f.read().strip()
+    logger.info("restoring net.ipv4.conf.all.route_localnet to %s" % value)
+    with open(route_localnet_path, "w") as f: f.write(value)
+    os.remove(route_localnet_saved)
+
+def unpublish_stale_ports():
+    """ remove host port rules of containers that no longer exist (left
+        behind by an interrupted run)
+    """
+    names = published_ports()
+    if names is None: return
+    if len(names) > 0: names-= set(get_container_snapshot().keys())
+    # an empty list still restores route_localnet if no rules remain
+    unpublish_ports(names)
+
+def claim_pool_containers(assignments):
+    """ claim pooled containers for devices.  Each assignment is a tuple of
+        (pool_name, device_name, port, port_internal).  The container is
+        renamed to the device container name, its hostname updated, and port
+        published.  Pooled containers are already ready so flexswitch is not
+        restarted and keeps running through the claim.  return set of 
+        successfully claimed device names
+    """
+    def claim(a):
+        (pool_name, device_name, port, port_internal) = a
+        name = container_name(device_name)
+        try:
+            logger.info("claiming pooled container %s for %s" % (pool_name,
+                device_name))
+            get_docker().rename(pool_name, name)
+            get_docker().execute(name, ["sh", "-c", 
+                "hostname %s && echo %s > /etc/hostname" % (device_name,
+                device_name)])
+            ip = container_record(get_docker().inspect(name))["ip"]
+            return (device_name, ip, port, port_internal)
+        except Exception as e:
+            logger.warn("failed to claim %s: %s" % (pool_name, e))
+            return None
+    if len(assignments) == 0: return set()
+    workers = ThreadPool(min(MAX_THREADS, len(assignments)))
+    try: claimed = [c for c in workers.map(claim, assignments) if c]
+    finally: workers.close()
+    try: publish_ports([(container_name(c[0]),) + c[1:] for c in claimed])
+    except Exception as e:
+        logger.error("failed to publish ports for pooled containers: %s" % e)
+        for c in claimed: remove_flexswitch_container(c[0], force=True)
+        return set()
+    return set([c[0] for c in claimed])
+
+def fill_pool(spec):
+    """ start pooled containers until the pool holds the requested number of
+        warm containers for each image.  spec is a dict:
+            {"images": {"<dockerimage>": count}, "fs_image":"", "dopt":"",
+             "flexswitch": {"<dockerimage>": port_internal}}
+        Containers are started with pool_warming_prefix and only renamed 
+        into the pool once flexswitch is ready on port_internal of the 
+        container address (images not within "flexswitch" are pooled once
+        running).  Containers that do not become ready are removed.  Only 
+        one fill runs at a time, concurrent calls return immediately
+    """
+    if not os.path.isdir(os.path.dirname(pool_lock)): 
+        os.makedirs(os.path.dirname(pool_lock))
+    with open(pool_lock, "a") as lock:
+        try: fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            logger.debug("pool fill already in progress")
+            return
+        # warming containers left behind by an interrupted fill
+        for name in sorted(get_container_snapshot()):
+            if not name.startswith(pool_warming_prefix): continue
+            try: get_docker().remove(name)
+            except Exception as e:
+                logger.debug("failed to remove %s: %s" % (name, e))
+        pool = get_pool_containers()
+        runs = []
+        for (image, count) in sorted(spec["images"].items()):
+            key = pool_key(image, spec.get("fs_image"), spec.get("dopt"))
+            for i in xrange(len(pool.get(key, [])), count):
+                name = "%s-%s" % (key[:8], binascii.hexlify(os.urandom(3)))
+                runs.append((name, image, key))
+        def run(r):
+            (name, image, key) = r
+            warming = "%s%s" % (pool_warming_prefix, name)
+            logger.info("starting pooled container %s using %s" % (warming,
+                image))
+            try: 
+                get_docker().run(warming, image, None, None, 
+                    fs_image=spec.get("fs_image"), dopt=spec.get("dopt"),
+                    labels={pool_label: key})
+                return (name, image)
+            except Exception as e:
+                logger.error("failed to start %s: %s" % (warming, e))
+                return None
+        if len(runs) == 0: return
+        workers = ThreadPool(min(MAX_THREADS, len(runs)))
+        try: started = [r for r in workers.map(run, runs) if r is not None]
+        finally: workers.close()
+
+        # containers only join the pool once flexswitch is ready
+        flexswitch = spec.get("flexswitch", {})
+        devices, hosts = ({}, {})
+        snapshot = get_container_snapshot(["%s%s" % (pool_warming_prefix, n)
+            for (n, image) in started])
+        for (name, image) in started:
+            if image not in flexswitch: continue
+            warming = "%s%s" % (pool_warming_prefix, name)
+            devices[warming] = Device(warming, port_internal=int(
+                flexswitch[image]), dockerimage=image)
+            hosts[warming] = snapshot.get(warming, {}).get("ip", "")
+        ready = set()
+        if len(devices) > 0:
+            verify_flexswitch_running(devices, hosts=hosts, 
+                on_ready=ready.add)
+        for (name, image) in started:
+            warming = "%s%s" % (pool_warming_prefix, name)
+            if warming in devices and warming not in ready:
+                logger.error("pooled container %s not ready" % warming)
+            else:
+                try: 
+                    get_docker().rename(warming, "%s%s"%(pool_prefix, name))
+                    continue
+                except Exception as e: 
+                    logger.error("failed to pool %s: %s" % (warming, e))
+            try: get_docker().remove(warming)
+            except Exception as e:
+                logger.debug("failed to remove %s: %s" % (warming, e))
 
+def spawn_pool_fill(spec, backend="auto"):
+    """ replenish container pool in a detached background labtool process """
+    cmd = [sys.executable, os.path.realpath(__file__), "--docker", backend,
+        "--pool-fill", json.dumps(spec)]
+    logger.debug("spawning pool fill: %s" % cmd)
+    with open(os.devnull, "w") as devnull:
+        subprocess.Popen(cmd, stdin=devnull, stdout=devnull, stderr=devnull,
+            close_fds=True, preexec_fn=os.setsid)
+
+def clear_pool():
+    """ remove all unclaimed pooled containers and host port rules of 
+        containers that no longer exist.  route_localnet is restored once no
+        claimed containers remain published
+    """
+    for name in sorted(get_container_snapshot()):
+        if not name.startswith(pool_prefix): continue
+        logger.info("removing pooled container %s" % name)
+        try: get_docker().remove(name)
+        except Exception as e:
+            logger.debug("failed to remove %s: %s" % (name, e))
+    try: unpublish_stale_ports()
+    except Exception as e:
+        logger.debug("failed to remove stale port rules: %s" % e)
+    names = published_ports()
+    if names is None: return
+    if len(names) > 0:
+        logger.warn("net.ipv4.conf.all.route_localnet remains enabled for "\
+            "claimed containers: %s" % ", ".join(sorted(names)))
+    else: restore_route_localnet()
+
+@traced("pid", 0)
 def get_container_pid(device_name):
     """ based on container name, return corresponding docker pid """
 
-    cmd = "docker inspect -f '{{.State.Pid}}' %s" % device_name
-    pid = exec_cmd(cmd, ignore_exception=True)
-    if pid is None:
+    js = None
+    try: js = get_docker().inspect(container_name(device_name))
+    except Exception as e: logger.debug("inspect %s: %s" % (device_name, e))
+    if js is None:
         logger.error("failed to determine pid of %s, is it running?"%(
             device_name))
         return None
-    return pid.strip()
+    return "%s" % js.get("State", {}).get("Pid", "")
 
+@traced("run", 0)
 def create_flexswitch_container(device_name, device_port, device_port_internal,
-                                fs_image=None, dopt=None, dockerimage=None):
+                                fs_image=None, dopt=None, dockerimage=None,
+                                exists=None):
     """ create flexswitch container with provided device_name. Calling
         function must call get_container_pid to reliably determine if 
         container was successfully started.
         Note, this function will first remove container if it currently exists
+        (exists can be provided by caller if already known)
     """
     if dockerimage == None: dockerimage=docker_image
     # remove container if currently exists
-    remove_flexswitch_container(device_name)
+    if exists is None: remove_flexswitch_container(device_name)
+    elif exists: remove_flexswitch_container(device_name, force=True)
 
     # kickoff requested container
-    logger.info("creating container %s using %s" % (device_name, dockerimage))
-    cmd = "docker run -dt --privileged --cap-add ALL "
-    if fs_image is not None:
-        cmd+= "--volume %s:%s:ro " % (fs_image, gen_flex_path)
-    if dopt is not None: cmd+= "%s " % dopt
-    cmd+= "--hostname=%s --name %s -p %s:%s %s" % (
-        device_name, device_name, device_port,device_port_internal,dockerimage)
-    out = exec_cmd(cmd, ignore_exception=True)
-    if out is None:
+    logger.info("creating container %s using %s" % (
+        container_name(device_name), dockerimage))
+    try:
+        get_docker().run(container_name(device_name), dockerimage, device_port,
+            device_port_internal, fs_image=fs_image, dopt=dopt)
+    except Exception as e:
+        logger.debug("docker run %s: %s" % (device_name, e))
         logger.error("failed to create docker container: %s, %s" % (
             device_name, device_port))
         return None
     return
 
-def upgrade_flexswitch_container(device_name, fs_image):
+class UpgradePackage(object):
+    """ flexswitch image staged once for upgrading many containers.  The 
+        image is placed within the flexswitch image cache which containers
+        started by labtool mount read-only at upgrade_mount, so those 
+        containers install it directly without transferring it.  Other 
+        containers receive a tar archive of the image that is built only 
+        once
+    """
+    def __init__(self, fs_image):
+        self.name = fs_image.split("/")[-1]
+        root = os.path.abspath(fs_image_dir)
+        if not os.path.abspath(fs_image).startswith("%s/" % root):
+            # stage a copy of the image within the cache
+            partial = "%s/.partial" % root
+            if not os.path.isdir(partial): os.makedirs(partial)
+            tmp = "%s/%s.tmp" % (partial, binascii.hexlify(os.urandom(6)))
+            shutil.copy(fs_image, tmp)
+            fs_image = FlexswitchImageCache().add(tmp, self.name)
+        self.path = os.path.abspath(fs_image)
+        self.shared_path = "%s/%s" % (upgrade_mount, 
+            os.path.relpath(self.path, root))
+        self.lock = threading.Lock()
+        self.archive = None
+
+    def get_archive(self):
+        """ return tar archive of image, built on first call """
+        with self.lock:
+            if self.archive is None: self.archive = tar_file(self.path)
+            return self.archive
+
+@traced("upgrade", 0)
+def upgrade_flexswitch_container(device_name, fs_image, package=None, 
+                                 timing=None):
     """ upgrade flexswitch image to provided fs_image using dpkg -i command
-        since this is done live, no need to repair links on upgrade
+        since this is done live, no need to repair links on upgrade.
+        package is an optional UpgradePackage shared between devices and
+        timing an optional dict updated with the duration of each step
         return boolean success
     """
-    img_name = fs_image.split("/")[-1]
+    if package is None: package = UpgradePackage(fs_image)
+    if timing is None: timing = {}
+    img_name = package.name
     logger.info("upgrading %s image to %s" % (device_name, img_name))
 
     # first verify container exists and is currently running
-    if not container_is_running(device_name):
+    name = container_name(device_name)
+    js = get_docker().inspect(name)
+    if js is None or not container_record(js)["running"]:
         logger.error("'%s' is not currently running" % device_name)
         return False
 
     # determine if a file is already mounted at gen_flex_path
     # if so, alert the user that upgrade will not be persistent across
-    # container reset
+    # container reset.  Also determine if the image cache is mounted
     flex_image_mounted = False
-    cmd = "docker inspect -f '{{json .Mounts}}' %s" % device_name
-    js = exec_cmd(cmd)
-    try:
-        js = json.loads(js)
-        for mount in js:
-            logger.debug("mount: %s" % pretty_print(mount))
-            if "Destination" in mount and mount["Destination"]==gen_flex_path:
-                flex_image_mounted = True
-                break
-    except ValueError as e:
-        logger.debug("failed to parse mount string: %s, assume mounted"%js)
-        flex_image_mounted = True
+    shared = False
+    for mount in js.get("Mounts") or []:
+        logger.debug("mount: %s" % pretty_print(mount))
+        if mount.get("Destination") == gen_flex_path:
+            flex_image_mounted = True
+        if mount.get("Destination") == upgrade_mount:
+            shared = True
+
+    start = time.time()
+    if shared: src = package.shared_path
+    else:
+        src = "/%s" % img_name
+        try: get_docker().put_archive(name, package.get_archive(), "/")
+        except Exception as e:
+            logger.error("failed to copy %s to %s: %s" % (img_name, 
+                device_name, e))
+            return False
+    timing["copy"] = time.time() - start
 
-    cmds = []
-    cmds.append("docker cp %s %s:/%s" % (fs_image,device_name, img_name))
-    cmds.append("docker exec -it %s dpkg -i /%s" % (device_name, img_name))
     if not flex_image_mounted:  
-        cmds.append("docker exec -it %s mv /%s %s" % (
-            device_name, img_name, gen_flex_path))
+        # image within the shared cache is copied as cache entries may be
+        # evicted while the container still references them
+        if shared: mv = ["cp", src, gen_flex_path]
+        else: mv = ["mv", src, gen_flex_path]
     else: 
+        mv = None
         imsg = "mounted directory already exists at %s. " % gen_flex_path
         imsg+= "Upgrade will not be persistent across '%s' restart." % (
             device_name)
         logger.info(imsg)
-    for c in cmds:
-        out = exec_cmd(c, ignore_exception=True)
+    start = time.time()
+    try: out = get_docker().execute(name, ["dpkg","-i",src])
+    except Exception as e: out = None
+    timing["install"] = time.time() - start
+    if out is None:
+        logger.error("failed to upgrade %s" % device_name)
+        return False
+    if mv is not None:
+        try: out = get_docker().execute(name, mv)
+        except Exception as e: out = None
         if out is None:
-            # only 'fail' if dpkg returned error, other errors are ok
-            if not re.search(" dpkg -i ", c): continue
-            logger.error("failed to upgrade %s" % device_name)
+            logger.error("failed to persist %s on %s" % (img_name, 
+                device_name))
             return False
     return True
 
-def repair_connections(topo):
+def upgrade_devices(devices, fs_image, topo=None, wave_size=4, parallel=4):
+    """ upgrade devices to provided fs_image in waves of wave_size devices
+        with at most parallel devices upgrading at the same time.  When the
+        topology is provided, all devices within a wave must report ready
+        through SystemStatus before the next wave starts.  Remaining waves 
+        are skipped if a wave fails.  return boolean success
+    """
+    try: package = UpgradePackage(fs_image)
+    except (IOError, OSError) as e:
+        logger.error("failed to stage %s: %s" % (fs_image, e))
+        return False
+    wave_size = max(1, wave_size)
+    waves = [devices[i:i+wave_size] for i in xrange(0,len(devices),wave_size)]
+    timing = dict([(d, {}) for d in devices])
+    success = True
+    for (i, wave) in enumerate(waves):
+        logger.info("upgrade wave %s of %s: %s" % (i+1, len(waves), 
+            ", ".join(wave)))
+        start = time.time()
+        def upgrade(device_name):
+            return upgrade_flexswitch_container(device_name, fs_image, 
+                package, timing[device_name])
+        pool = ThreadPool(max(1, min(parallel, len(wave))))
+        try: results = pool.map(upgrade, wave)
+        finally: pool.close()
+        upgraded = [d for (d, ok) in zip(wave, results) if ok]
+        success = len(upgraded) == len(wave)
+        # gate next wave on readiness of all upgraded devices
+        if topo is not None and len(upgraded) > 0:
+            def on_ready(d): timing[d]["ready"] = time.time() - start
+            ready = dict([(d, topo[d]) for d in upgraded if d in topo])
+            success = verify_flexswitch_running(ready, on_ready=on_ready) \
+                and success
+        for d in wave: timing[d]["total"] = time.time() - start
+        if not success:
+            if i+1 < len(waves):
+                logger.error("upgrade wave %s failed, skipping remaining "\
+                    "%s devices" % (i+1, sum([len(w) for w in waves[i+1:]])))
+            break
+    if topo is None: logger.info("readiness not verified without --lab")
+
+    # per-device timing summary
+    logger.info("upgrade timing (seconds):")
+    for d in devices:
+        t = timing[d]
+        if len(t) == 0: continue
+        logger.info("  %-24s copy:%6.1f  install:%6.1f  ready:%6s  total:%6.1f"
+            % (d, t.get("copy", 0), t.get("install", 0), "%.1f" % t["ready"] 
+            if "ready" in t else "-", t.get("total", 0)))
+    return success
+
+def repair_connections(topo, path=None):
     """ builds device to pid mapping and then executes 
-        create_topology_connections to rebuild all connections
+        create_topology_connections to rebuild all connections.  If the lab
+        path is provided, pids of devices with a valid runtime state are
+        used without querying docker and the runtime state is updated
     """
     # map pids for each device within topology
-    for device_name in topo:
-        pid = None
-        try: pid = get_container_pid(device_name)
+    valid = set()
+    if path is not None: valid = load_runtime_state(path, topo)
+    missing = [n for n in topo if n not in valid]
+    snapshot = {}
+    if len(missing) > 0:
+        try: snapshot = get_container_snapshot(missing)
         except Exception as e:
             logger.error("Error occurred: %s" % traceback.format_exc())
+    for device_name in missing:
+        pid = snapshot.get(device_name, {}).get("pid")
         if pid is not None and pid != "0" and pid!= "":
-            topo[device_name]["pid"] = pid
+            topo[device_name].pid = pid
+
+    success = create_topology_connections(topo)
+    if path is not None: write_runtime_state(path, topo)
+    return success
+
+def remove_netns_handle(pid):
+    """ remove softlink in netns_dir of the provided pid if present """
+    handle = "%s/%s" % (netns_dir, netns_handle(pid))
+    if os.path.islink(handle):
+        logger.debug("removing netns softlink: %s" % handle)
+        os.remove(handle)
+
+def device_stopped(topo, device_name):
+    """ forget pid of stopped device.  The veth peers of its links are 
+        removed along with the namespace so the peer namespaces are re-read
+        on next use
+    """
+    device = topo[device_name]
+    if not device.running(): return
+    remove_netns_handle(device.pid)
+    inventory.invalidate(device.pid)
+    for p in device.ports.values():
+        if p.link is not None and p.peer().device.running():
+            inventory.invalidate(p.peer().device.pid)
+    device.pid = ""
+
+def rewire_device(path, topo, device_name, pid):
+    """ set new pid of restarted device and recreate only its links to
+        running peers.  return boolean success
+    """
+    device_stopped(topo, device_name)
+    topo[device_name].pid = pid
+    inventory.invalidate(pid)
+    success = wire_device_links(topo, device_name, {"lock": threading.Lock(),
+        "links": set()})
+    generate_environment_variables(path, topo)
+    write_runtime_state(path, topo)
+    return success
+
+def watch_topology(path, topo, stop=None):
+    """ repair all connections and then rewire the links of each device as
+        soon as its container restarts, driven by the docker events stream.
+        Events of containers outside of the topology or instance are 
+        ignored.  When the stream is interrupted all connections are repaired
+        again after reconnecting as events may have been missed.  Runs until
+        the stop event is set (checked between events) or interrupted
+    """
+    while stop is None or not stop.is_set():
+        repair_connections(topo, path)
+        generate_environment_variables(path, topo)
+        logger.info("watching %s devices for container restarts" % len(topo))
+        try:
+            for e in get_docker().events():
+                if stop is not None and stop.is_set(): return
+                name = container_device(e["name"])
+                if name is None or name not in topo: continue
+                start = time.time()
+                if e["action"] == "die":
+                    logger.info("'%s' stopped" % name)
+                    device_stopped(topo, name)
+                    write_runtime_state(path, topo)
+                    continue
+                pid = get_container_pid(name)
+                if pid is None or pid == "0" or pid == "":
+                    logger.error("'%s' started without pid" % name)
+                    continue
+                if rewire_device(path, topo, name, pid):
+                    logger.info("'%s' restarted, links rewired in %.1f ms" % (
+                        name, (time.time() - start)*1000))
+                else: 
+                    logger.error("'%s' restarted, failed to rewire links" % (
+                        name))
+            logger.error("docker event stream closed")
+        except Exception as e:
+            logger.error("docker event stream failed: %s" % e)
+            logger.debug("Error occurred: %s" % traceback.format_exc())
+        if stop is not None: stop.wait(READY_BACKOFF_MAX)
+        else: time.sleep(READY_BACKOFF_MAX)
+
+def generated_dir(path):
+    """ return directory of generated files of lab path, each instance has
+        its own directory within <path>/.generated/instances
+    """
+    if instance is None: return "%s/.generated" % path
+    return "%s/.generated/instances/%s" % (path, instance)
+
+def device_spec(device, fs_image=None, dopt=None):
+    """ return attributes of a topology device that require the container 
+        to be recreated when changed
+    """
+    return {"port": device.port, "port_internal": device.port_internal,
+        "dockerimage": device.dockerimage, "fs_image": fs_image, 
+        "dopt": dopt}
 
-    return create_topology_connections(topo)        
+def write_applied_topology(path, topo, fs_image=None, dopt=None):
+    """ record topology applied to running containers in
+        <path>/.generated/applied.json for later reconciliation
+    """
+    applied_path = "%s/applied.json" % generated_dir(path)
+    if not os.path.exists(os.path.dirname(applied_path)):
+        os.makedirs(os.path.dirname(applied_path))
+    js = {"devices": {}, "links": sorted([list(l) for l in 
+        topo.link_keys()])}
+    for device_name in topo:
+        js["devices"][device_name] = device_spec(topo[device_name], fs_image,
+            dopt)
+    try:
+        with open(applied_path, "w") as f: f.write(pretty_print(js))
+    except IOError as e:
+        logger.error("failed to write %s: %s" % (applied_path, e))
 
+def read_applied_topology(path):
+    """ return applied topology dict written by write_applied_topology or
+        None if not available
+    """
+    applied_path = "%s/applied.json" % generated_dir(path)
+    try:
+        with open(applied_path, "r") as f: js = json.load(f)
+        js["links"] = set([tuple(l) for l in js["links"]])
+        return js
+    except (IOError, ValueError, KeyError) as e:
+        logger.debug("no applied topology in %s: %s" % (applied_path, e))
+        return None
+
+def proc_start_time(pid):
+    """ return start time (clock ticks after boot) of process pid or None if
+        the process does not exist
+    """
+    try:
+        with open("/proc/%s/stat" % pid, "r") as f: stat = f.read()
+        return stat.rsplit(")", 1)[1].split()[19]
+    except (IOError, IndexError) as e: return None
+
+def runtime_state_path(path):
+    """ return path of runtime state file of lab path """
+    return "%s/runtime.json" % generated_dir(path)
+
+def read_runtime_state(path):
+    """ return runtime state dict written by write_runtime_state or None if
+        not available or of a different version
+    """
+    state_path = runtime_state_path(path)
+    try:
+        with open(state_path, "r") as f: js = json.load(f)
+        if js.get("version") == 1: return js
+    except (IOError, ValueError) as e:
+        logger.debug("no runtime state in %s: %s" % (state_path, e))
+    return None
+
+def write_runtime_state(path, topo, ready=None):
+    """ record runtime facts of running lab devices in 
+        <path>/.generated/runtime.json for use by later invocations and
+        stage scripts:
+            {"version": 1, "updated": 0, 
+             "devices": {"<name>": {"id": "", "pid": "", "started": "", 
+                "image": "", "port": 0, "port_internal": 0, "schema": "",
+                "username": "", "password": "", "ready": false, 
+                "pooled": false}},
+             "links": [["<device1>", "<port1>", "<device2>", "<port2>"]]}
+        ready is a set of devices verified ready.  Devices whose pid is
+        unchanged keep their previously recorded container and readiness,
+        only devices with a new pid are queried through docker
+    """
+    if ready is None: ready = set()
+    prev = read_runtime_state(path) or {"devices": {}}
+    devices = {}
+    unknown = []
+    for device_name in sorted(topo):
+        d = topo[device_name]
+        if not d.running(): continue
+        started = proc_start_time(d.pid)
+        rec = prev["devices"].get(device_name, {})
+        if rec.get("pid") != d.pid or rec.get("started") != started:
+            rec = {"id": "", "image": "", "ready": False, "pooled": False}
+            unknown.append(device_name)
+        rec.update({"pid": d.pid, "started": started, "port": d.port,
+            "port_internal": d.port_internal, "schema": d.schema,
+            "username": d.username, "password": d.password})
+        if device_name in ready: rec["ready"] = True
+        devices[device_name] = rec
+    if len(unknown) > 0:
+        snapshot = {}
+        try: snapshot = get_container_snapshot(unknown)
+        except Exception as e:
+            logger.debug("failed to list containers: %s" % e)
+        for device_name in unknown:
+            r = snapshot.get(device_name, {})
+            devices[device_name].update({"id": r.get("id", ""), 
+                "image": r.get("image", ""), 
+                "pooled": pool_label in r.get("labels", {})})
+    links = [list(k) for k in sorted(topo.link_keys()) if k[0] in devices
+        and k[2] in devices]
+    js = {"version": 1, "updated": time.time(), "devices": devices,
+        "links": links}
+    state_path = runtime_state_path(path)
+    try:
+        if not os.path.exists(os.path.dirname(state_path)):
+            os.makedirs(os.path.dirname(state_path))
+        tmp = "%s.tmp" % state_path
+        with open(tmp, "w") as f: f.write(pretty_print(js))
+        os.rename(tmp, state_path)
+    except (IOError, OSError) as e:
+        logger.error("failed to write %s: %s" % (state_path, e))
+
+def runtime_record_valid(rec):
+    """ return True if the container process of a runtime state record is
+        still running: the pid exists with the recorded start time and, if
+        the container id is visible within its cgroup, belongs to the 
+        recorded container
+    """
+    if rec.get("pid") in (None, "", "0"): return False
+    if rec.get("started") is None or \
+        proc_start_time(rec["pid"]) != rec["started"]:
+        return False
+    try:
+        with open("/proc/%s/cgroup" % rec["pid"], "r") as f:
+            ids = re.findall("[0-9a-f]{64}", f.read())
+    except IOError as e: return False
+    return len(ids) == 0 or rec.get("id") in ids
+
+def load_runtime_state(path, topo):
+    """ set pid of topology devices from valid runtime state records and 
+        return set of device names that were set
+    """
+    valid = set()
+    state = read_runtime_state(path)
+    if state is None: return valid
+    for (device_name, rec) in state["devices"].items():
+        if device_name in topo and runtime_record_valid(rec):
+            topo[device_name].pid = rec["pid"]
+            valid.add(device_name)
+    return valid
+
+def reconcile_topology(path, topo, fs_image=None, dopt=None):
+    """ converge running containers and links to the provided topology by
+        only removing/creating devices and connections that changed since
+        the last applied topology. Unchanged running devices are left 
+        untouched with their configuration.
+        returns boolean success
+    """
+    applied = read_applied_topology(path)
+    if applied is None: applied = {"devices": {}, "links": set()}
+    names = set(topo.keys()) | set(applied["devices"].keys())
+    snapshot = get_container_snapshot(list(names))
+
+    # determine removed, changed, and unchanged devices
+    removed = sorted(set(applied["devices"].keys()) - set(topo.keys()))
+    create = []
+    for device_name in sorted(topo):
+        r = snapshot.get(device_name)
+        spec = device_spec(topo[device_name], fs_image, dopt)
+        prev = applied["devices"].get(device_name)
+        if r is None or not r["running"] or (prev is not None and prev!=spec):
+            create.append(device_name)
+        else: topo[device_name].pid = r["pid"]
+    logger.info("reconcile: %s removed, %s created, %s unchanged" % (
+        len(removed), len(create), len(topo) - len(create)))
+
+    for device_name in removed:
+        pid = snapshot.get(device_name, {}).get("pid")
+        remove_flexswitch_container(device_name, pid, force=True)
+
+    # remove links no longer in the topology between unchanged devices.
+    # Deleting one end of a veth pair removes both ends
+    cmds = {}
+    for (d1, p1, d2, p2) in applied["links"] - topo.link_keys():
+        for (d, intf) in ((d1, p1), (d2, p2)):
+            if d in topo and d not in create:
+                logger.info("removing connection %s:%s - %s:%s" % (d1, p1,
+                    d2, p2))
+                cmds.setdefault(topo[d].pid, []).append(
+                    "link delete %s" % intf)
+                break
+    for pid in sorted(cmds):
+        ensure_netns_handle(pid)
+        exec_batch(cmds[pid], netns=pid)
+        inventory.invalidate(pid)
+
+    # create new/changed devices
+    funcs = []
+    for device_name in create:
+        funcs.append(functools.partial(create_flexswitch_container,
+            device_name, topo[device_name].port, 
+            topo[device_name].port_internal, fs_image, dopt,
+            topo[device_name].dockerimage, device_name in snapshot))
+    execute_threads(funcs)
+    if len(create) > 0:
+        snapshot = get_container_snapshot(create)
+        for device_name in create:
+            pid = snapshot.get(device_name, {}).get("pid", "0")
+            if pid == "0" or pid == "":
+                logger.error("'%s' failed to start" % device_name)
+                return False
+            topo[device_name].pid = pid
+
+    # add missing connections, existing connections are skipped
+    if not create_topology_connections(topo): return False
+    ready = set()
+    if verify_flexswitch_running(dict([(d, topo[d]) for d in create])):
+        ready = set(create)
+    write_applied_topology(path, topo, fs_image, dopt)
+    write_runtime_state(path, topo, ready)
+    return True
+
+@traced("links")
 def create_topology_connections(topo):
     """ try to create all required topology connections. This operation
         does not stop on failure, it will try to create all connections
-        in provided topology dictionary
+        in provided topology
         returns boolean - all connections successful
     """
     # first cleanup any stale connections
     try: clear_stale_connections()
     except Exception as e: pass
 
-    all_connections_success = True
-    for device_name in topo:
-        pid1 = topo[device_name]["pid"]
-        if pid1=="" or pid1=="0":
-            logger.debug("skipping connections for non-operational device: %s"%(
-                device_name))
-            continue
-        for c in topo[device_name]["connections"]:
-            try:
-                if c["remote-device"] not in topo:
-                    logger.error("failed to map %s" % c)
-                    logger.debug("topology: %s" % pretty_print(topo))
-                    all_connections_success = False
-                    continue
-                pid2 = topo[c["remote-device"]]["pid"]
-                if pid2 == "" or pid2 =="0": continue
-                if connection_exists(pid1, pid2, c["local-port"],
-                    c["remote-port"]):
-                    logger.debug("skipping existing connection %s:%s - %s:%s"%(
-                        device_name, c["local-port"], 
-                        topo[c["remote-device"]]["name"], c["remote-port"]))
-                    continue
-                logger.info("creating connection  %s:%s - %s:%s" % (
-                    device_name, c["local-port"], 
-                    topo[c["remote-device"]]["name"], c["remote-port"]))
-                create_connection(pid1, pid2, c["local-port"],c["remote-port"])
-            except Exception as e:
-                logger.error("Error occurred: %s" % traceback.format_exc())
+    all_connections_success = True
+    links = []
+    for l in topo.links:
+        try:
+            if not l.a.device.running() or not l.b.device.running(): continue
+            (pid1, pid2) = (l.a.device.pid, l.b.device.pid)
+            if connection_exists(pid1, pid2, l.a.name, l.b.name):
+                logger.debug("skipping existing connection %s" % l.label())
+                continue
+            logger.info("creating connection  %s" % l.label())
+            links.append({"pid1": pid1, "pid2": pid2, "label": l.label(),
+                "link1": l.a.name, "link2": l.b.name})
+        except Exception as e:
+            logger.error("Error occurred: %s" % traceback.format_exc())
+            all_connections_success = False
+
+    # build all required links within a single pass of the link engine
+    try:
+        for (link, success, err) in build_links(links):
+            if not success:
+                logger.error("failed to create connection %s: %s" % (
+                    link["label"], err))
                 all_connections_success = False
+    except Exception as e:
+        logger.error("Error occurred: %s" % traceback.format_exc())
+        all_connections_success = False
 
     return all_connections_success
 
+class NetnsInventory(object):
+    """ per-run cache of the interface names within each container network
+        namespace.  Each namespace is read once, indexed as a set, and then
+        kept up to date as links are created
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.interfaces = {}
+
+    def snapshot(self, pid):
+        """ read and return set of interface names within pid namespace """
+        intfs = set()
+        try:
+            # /proc/<pid>/net/dev reflects the namespace of the process
+            with open("/proc/%s/net/dev" % pid, "r") as f:
+                for l in f.readlines()[2:]:
+                    if ":" in l: intfs.add(l.split(":")[0].strip())
+            return intfs
+        except IOError as e:
+            logger.debug("unable to read /proc/%s/net/dev: %s" % (pid, e))
+        out = exec_cmd("ip netns exec %s ip -o link" % netns_handle(pid), 
+            ignore_exception=True)
+        if out is not None:
+            for l in out.split("\n"):
+                r1 = re.search(link_state_reg, l.strip())
+                if r1 is not None: intfs.add(r1.group("intf"))
+        return intfs
+
+    def get(self, pid):
+        """ return set of interface names within pid namespace """
+        pid = "%s" % pid
+        with self.lock:
+            if pid in self.interfaces: return self.interfaces[pid]
+        intfs = self.snapshot(pid)
+        with self.lock: return self.interfaces.setdefault(pid, intfs)
+
+    def has(self, pid, intf):
+        """ return True if interface exists within pid namespace """
+        return intf in self.get(pid)
+
+    def add(self, pid, intf):
+        """ record newly created interface within pid namespace """
+        self.get(pid)
+        with self.lock: self.interfaces["%s" % pid].add(intf)
+
+    def invalidate(self, pid=None):
+        """ drop cached namespace (or all namespaces if pid is None) """
+        with self.lock:
+            if pid is None: self.interfaces = {}
+            else: self.interfaces.pop("%s" % pid, None)
+
+inventory = NetnsInventory()
+
 def connection_exists(pid1, pid2, link1, link2):
     """ returns True if connection already exists """
+    return inventory.has(pid1, link1) and inventory.has(pid2, link2)
 
-    link1_exists = False
-    link2_exists = False
-    out = exec_cmd("ip netns exec %s ip -o link" % pid1, ignore_exception=True)
-    if out is not None:
-        for l in out.split("\n"):
-            r1 = re.search(link_state_reg, l.strip())
-            if r1 is not None:
-                if r1.group("intf") == link1: 
-                    link1_exists = True
-                    break
-    out = exec_cmd("ip netns exec %s ip -o link" % pid2, ignore_exception=True)
-    if out is not None:
-        for l in out.split("\n"):
-            r1 = re.search(link_state_reg, l.strip())
-            if r1 is not None:
-                if r1.group("intf") == link2: 
-                    link2_exists = True
-                    break
-    return link1_exists and link2_exists
-   
+@traced("link")
 def create_connection(pid1, pid2, link1, link2):
     """ create connection between two docker containers """
 
-    # verify pids and links
-    if pid1 is None or pid2 is None or link1 is None or link2 is None or \
-        len(pid1)==0 or len(pid2)==0 or len(link1)==0 or len(link2)==0:
-        raise Exception("invalid connection arguments: %s, %s, %s, %s" % (
-            pid1, pid2, link1, link2))
-
-    # delete existing ethS/ethD in main namespace (ignore errors)
-    exec_cmd("ip link delete ethS type veth", ignore_exception=True)
-    exec_cmd("ip link delete ethD type veth", ignore_exception=True)
-
-    # list of commands to execute
-    cmds = ["mkdir -p %s" % netns_dir]
-
-    # check if soft link exists, if not then create it
-    if not os.path.isfile("%s/%s"%(netns_dir, pid1)):
-        cmds.append("ln -s /proc/%s/ns/net %s/%s"%(
-            pid1, netns_dir, pid1))
-    if not os.path.isfile("%s/%s"%(netns_dir,pid2)):
-        cmds.append("ln -s /proc/%s/ns/net %s/%s"%(
-            pid2, netns_dir, pid2))
-
-    # create connections
-    cmds.append("ip link add ethS type veth peer name ethD")
-    cmds.append("ip link set ethS netns %s" % pid1)
-    cmds.append("ip link set ethD netns %s" % pid2)
-    cmds.append("ip netns exec %s ip link set ethS name %s" % (pid1, link1))
-    cmds.append("ip netns exec %s ip link set ethD name %s" % (pid2, link2))
-    cmds.append("ip netns exec %s ip link set %s up" % (pid1, link1))
-    cmds.append("ip netns exec %s ip link set %s up" % (pid2, link2))
-
-    # execute commands
-    for c in cmds: exec_cmd(c)
+    link = {"pid1": pid1, "pid2": pid2, "link1": link1, "link2": link2,
+        "label": "%s:%s - %s:%s" % (pid1, link1, pid2, link2)}
+    for (link, success, err) in build_links([link]):
+        if not success:
+            raise Exception("failed to create connection %s: %s" % (
+                link["label"], err))
+
+def netns_handle(pid):
+    """ return name of netns handle of the provided pid, handles of an
+        instance are prefixed with the instance name
+    """
+    if instance is None: return "%s" % pid
+    return "%s-%s" % (instance, pid)
+
+def ensure_netns_handle(pid):
+    """ create softlink in netns_dir to the network namespace of the provided
+        pid so it can be referenced by 'ip -netns <handle>'
+    """
+    if not os.path.isdir(netns_dir): os.makedirs(netns_dir)
+    handle = "%s/%s" % (netns_dir, netns_handle(pid))
+    if not os.path.isfile(handle):
+        if os.path.islink(handle): os.remove(handle)
+        logger.debug("creating netns softlink: %s" % handle)
+        os.symlink("/proc/%s/ns/net" % pid, handle)
+
+def exec_batch(cmds, netns=None):
+    """ execute list of ip commands within a single 'ip -batch' process,
+        optionally within the network namespace of the provided pid (see
+        netns_handle).  The batch is run with -force so all commands are 
+        attempted even if some fail.
+        return dict of failed command index (starting at 0) to error string
+    """
+    if len(cmds) == 0: return {}
+    cmd = ["ip"]
+    if netns is not None: cmd+= ["-netns", netns_handle(netns)]
+    cmd+= ["-force", "-batch", "-"]
+    logger.debug("executing batch (%s commands): %s" % (len(cmds), 
+        " ".join(cmd)))
+    start = time.time()
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+    out = p.communicate("%s\n" % "\n".join(cmds))[0]
+    exec_stats.record(" ".join(cmd), time.time() - start, p.returncode == 0)
+    # exit code -2 seen on ctrl+c interrupt
+    if p.returncode < 0: 
+        raise CommandInterrupted("batch interrupted by signal %s: %s" % (
+            -p.returncode, " ".join(cmd)))
+    failed = {}
+    if p.returncode == 0: return failed
+    # ip prints error message(s) followed by 'Command failed -:<line>'
+    msg = []
+    for l in out.split("\n"):
+        r1 = re.search(batch_error_reg, l.strip())
+        if r1 is not None:
+            failed[int(r1.group("line"))-1] = " ".join(msg).strip()
+            msg = []
+        elif len(l.strip())>0: msg.append(l.strip())
+    if len(failed) == 0:
+        # batch failed without per-command detail, treat all as failed
+        for i in xrange(0, len(cmds)): failed[i] = out.strip()
+    logger.debug("batch failures: %s" % failed)
+    return failed
+
+def tmp_link_name(pid, intf):
+    """ return collision-free temporary interface name for the provided
+        namespace pid and final interface name.  The name is used while the
+        interface lives in the root namespace and is limited to 15 chars
+    """
+    return "lt%s" % hashlib.md5("%s:%s" % (pid, intf)).hexdigest()[:13]
+
+def build_links(links):
+    """ create, move, rename and bring up all provided veth pairs.  Links are
+        split into chunks that are wired concurrently, each chunk with one
+        'ip -batch' process for the root namespace and one per container
+        namespace.  Each link is a dict containing:
+            {"pid1":"", "pid2":"", "link1":"", "link2":"", "label":""}
+        returns list of (link, success, error) tuples in the provided order
+    """
+    results = [[l, True, ""] for l in links]
+    for r in results:
+        l = r[0]
+        for attr in ("pid1", "pid2", "link1", "link2"):
+            if l.get(attr) is None or len("%s" % l[attr])==0:
+                r[1:] = [False, "invalid connection arguments: %s" % l]
+                break
+    # temporary names are derived from the endpoints so each endpoint may
+    # only be referenced once per call
+    endpoints = set()
+    for r in results:
+        if not r[1]: continue
+        l = r[0]
+        ends = [(l["pid1"], l["link1"]), (l["pid2"], l["link2"])]
+        if ends[0] in endpoints or ends[1] in endpoints or ends[0]==ends[1]:
+            r[1:] = [False, "duplicate link endpoint: %s" % l]
+            continue
+        endpoints.update(ends)
+    pending = [i for i in xrange(0, len(results)) if results[i][1]]
+
+    # ensure netns handles exist for each namespace before starting workers
+    ns_locks = {}
+    for i in pending:
+        for attr in ("pid1", "pid2"):
+            try: 
+                ensure_netns_handle(links[i][attr])
+                ns_locks.setdefault(links[i][attr], threading.Lock())
+            except OSError as e:
+                results[i][1:] = [False, "netns handle for %s: %s" % (
+                    links[i][attr], e)]
+    pending = [i for i in pending if results[i][1]]
+    if len(pending) == 0: return [tuple(r) for r in results]
+
+    # split links into one chunk per worker, bounded by available cores
+    workers = min(MAX_THREADS, multiprocessing.cpu_count(),
+        (len(pending)+MIN_LINK_BATCH-1)/MIN_LINK_BATCH)
+    chunks = [pending[w::workers] for w in xrange(0, workers)]
+    logger.debug("wiring %s links with %s workers" % (len(pending), workers))
+    if workers == 1:
+        build_link_chunk(links, chunks[0], results, ns_locks)
+    else:
+        pool = ThreadPool(workers)
+        try:
+            pool.map(lambda c: build_link_chunk(links, c, results, ns_locks),
+                chunks)
+        finally: pool.close()
+    return [tuple(r) for r in results]
+
+def build_link_chunk(links, pending, results, ns_locks):
+    """ wire the links at the provided indexes and record the outcome of
+        each within results.  Batches within a single namespace are
+        serialized through ns_locks
+    """
+    # create each pair in the root namespace under a temporary name and
+    # move both ends into the target namespaces.  Stale temporary
+    # interfaces from interrupted runs are removed first, errors ignored.
+    cmds, owners = [], []
+    for i in pending:
+        l = links[i]
+        src = tmp_link_name(l["pid1"], l["link1"])
+        dst = tmp_link_name(l["pid2"], l["link2"])
+        for (c, required) in (
+            ("link delete %s" % src, False),
+            ("link delete %s" % dst, False),
+            ("link add %s type veth peer name %s" % (src, dst), True),
+            ("link set %s netns %s" % (src, l["pid1"]), True),
+            ("link set %s netns %s" % (dst, l["pid2"]), True)):
+            cmds.append(c)
+            owners.append((i, required))
+    for (index, err) in exec_batch(cmds).items():
+        i, required = owners[index]
+        if required and results[i][1]:
+            results[i][1:] = [False, "%s: %s" % (cmds[index], err)]
+    cleanup_cmds = []
+    for i in pending:
+        if results[i][1]: continue
+        l = links[i]
+        cleanup_cmds+= ["link delete %s" % tmp_link_name(l["pid1"],l["link1"]),
+            "link delete %s" % tmp_link_name(l["pid2"], l["link2"])]
+    exec_batch(cleanup_cmds)
+    pending = [i for i in pending if results[i][1]]
+
+    # rename and bring up interfaces with one batch per namespace
+    ns_cmds = {}
+    for i in pending:
+        l = links[i]
+        for (pid, intf) in ((l["pid1"], l["link1"]), (l["pid2"], l["link2"])):
+            ns = ns_cmds.setdefault(pid, {"cmds": [], "owners": []})
+            ns["cmds"]+= ["link set %s name %s" % (tmp_link_name(pid, intf),
+                intf), "link set %s up" % intf]
+            ns["owners"]+= [i, i]
+    for pid in sorted(ns_cmds):
+        ns = ns_cmds[pid]
+        with ns_locks[pid]: failed = exec_batch(ns["cmds"], netns=pid)
+        for (index, err) in failed.items():
+            i = ns["owners"][index]
+            if results[i][1]:
+                results[i][1:] = [False, "%s: %s" % (ns["cmds"][index], err)]
+
+    # remove partially wired pairs.  At least one end still carries its
+    # temporary name and deleting either end of a veth removes the pair
+    cleanup_cmds = {}
+    for i in pending:
+        if results[i][1]: continue
+        l = links[i]
+        for (pid, intf) in ((l["pid1"], l["link1"]), (l["pid2"], l["link2"])):
+            cleanup_cmds.setdefault(pid, []).append("link delete %s" % (
+                tmp_link_name(pid, intf)))
+    for pid in sorted(cleanup_cmds):
+        with ns_locks[pid]: exec_batch(cleanup_cmds[pid], netns=pid)
+
+    # update interface inventory with successfully wired links
+    for i in pending:
+        if not results[i][1]: continue
+        inventory.add(links[i]["pid1"], links[i]["link1"])
+        inventory.add(links[i]["pid2"], links[i]["link2"])
 
 def clear_stale_connections():
-    """ remove stale connection links in netns directory """
+    """ remove stale connection links of the current instance in netns
+        directory
+    """
     logger.debug("cleaning up netns directory: %s" % netns_dir)
     for f in os.listdir(netns_dir):
+        pid = f.rsplit("-", 1)[-1]
+        if not pid.isdigit() or netns_handle(pid) != f: continue
         if not os.path.isfile("%s/%s" % (netns_dir, f)):
             logger.debug("removing stale softlink: %s/%s" % (netns_dir,f))
             os.remove("%s/%s" % (netns_dir, f))
 
-def cleanup(topo):
-    """ cleanup topology by deleting containers and removing links """
-   
-    threads = []
-    for device_name in sorted(topo.keys()):
-        t = threading.Thread(target=remove_flexswitch_container,
-                args=(device_name, topo[device_name]["pid"], True))
-        threads.append(t)
-    execute_threads(threads)
+def remove_containers(names, timeout=None):
+    """ bulk remove containers of provided devices within timeout seconds.
+        Containers still present after the timeout have their init process
+        killed directly before a final removal attempt.  returns list of 
+        devices whose container could not be removed
+    """
+    if timeout is None: timeout = cleanup_timeout
+    pending = sorted(names)
+    for escalate in (False, True):
+        if len(pending) == 0: break
+        if escalate:
+            logger.warn("removal of %s containers timed out, killing %s" % (
+                len(pending), ", ".join(pending)))
+            for (n, r) in snapshot.items():
+                if not r["running"] or r["pid"] in ("", "0"): continue
+                try: os.kill(int(r["pid"]), signal.SIGKILL)
+                except OSError as e: 
+                    logger.debug("failed to kill %s: %s" % (n, e))
+        # docker may block on hung containers, bound the wait
+        t = threading.Thread(target=get_docker().remove_many, args=(
+            [container_name(n) for n in pending],))
+        t.daemon = True
+        t.start()
+        t.join(timeout)
+        snapshot = get_container_snapshot(pending)
+        pending = sorted(snapshot)
+    return pending
 
+def cleanup(topo, path=None):
+    """ cleanup topology by deleting containers and removing links.  All
+        existing containers are removed in bulk followed by a single sweep
+        of the netns directory.  If the lab path is provided and a runtime
+        state is available, all topology containers are removed without 
+        first listing them through docker.  return boolean success
+    """
+    state = None
+    if path is not None: state = read_runtime_state(path)
+    if state is not None:
+        names = sorted(topo.keys())
+        pooled = [n for (n, r) in state["devices"].items() if r["pooled"]]
+    else:
+        try: snapshot = get_container_snapshot(topo.keys())
+        except Exception as e:
+            logger.error("failed to list containers: %s" % e)
+            return False
+        names = sorted(snapshot.keys())
+        pooled = [n for n in snapshot if pool_label in snapshot[n]["labels"]]
+
+    # remove host port rules of claimed pooled containers
+    try:
+        if len(pooled) > 0: 
+            unpublish_ports([container_name(n) for n in pooled])
+    except Exception as e:
+        logger.debug("failed to unpublish pooled ports: %s" % e)
+
+    if len(names) > 0:
+        logger.info("removing %s containers" % len(names))
+    remaining = remove_containers(names)
+    for n in remaining: logger.error("failed to remove container %s" % n)
+
+    # handles of removed containers no longer reference a namespace
     try: clear_stale_connections()
     except Exception as e: pass
+    try: unpublish_stale_ports()
+    except Exception as e:
+        logger.debug("failed to remove stale port rules: %s" % e)
+    for n in topo: topo[n].pid = ""
+    if path is not None and os.path.exists(runtime_state_path(path)):
+        os.remove(runtime_state_path(path))
+    if instance is not None and len(remaining) == 0: release_instance_ports()
+    return len(remaining) == 0
 
-def generate_environment_variables(path):
+def environment_variables(devices):
+    """ return list of (name, value) environment variables for devices """
+    env = []
+    for device, d in sorted(devices.items()):
+        for attr in ("name", "password", "pid", "port", "schema", "username"):
+            value = getattr(d, attr)
+            if attr == "name" and instance is not None: 
+                value = container_name(device)
+            env.append(("%s_%s" % (device.upper(), attr.upper()), value))
+    return env
+
+def generate_environment_variables(path, devices):
     """ create/update environment variables file for use by stage files
     """
-    env_path = "%s/.generated/source.env" % path
+    env_path = "%s/source.env" % generated_dir(path)
     logger.debug("generating environment variables in %s " % env_path)
     if not os.path.exists(os.path.dirname(env_path)):
         os.makedirs(os.path.dirname(env_path))
     try:
         with open(env_path, "w") as f:
-            for device, attrs in sorted(topo.iteritems()):
-                for attr, value in sorted(attrs.iteritems()):
-                    if attr.upper() in ['PID','PORT','NAME','SCHEMA',
-                        'USERNAME','PASSWORD']:
-                        f.write("%s_%s=%s\n" %(device.upper(), attr.upper(), 
-                            value))
+            for (name, value) in environment_variables(devices):
+                f.write("%s=%s\n" % (name, value))
     except IOError as e:
         logger.error("failed to open %s: %s" % (env_path,e))
 
-def execute_stages(path, stage=0):
-    """ execute commands within all stage scripts from 0 to provided stage.
-        Ensure only 'safe' curl commands are executed
+def file_sha256(path):
+    """ return sha256 hex digest of file contents """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024*1024), ""): h.update(chunk)
+    return h.hexdigest()
+
+def verify_file_sha256(path, digest):
+    """ return true if sha256 of file contents matches provided digest """
+    actual = file_sha256(path)
+    if actual != digest.lower():
+        logger.error("sha256 mismatch for %s: expected %s, found %s" % (path,
+            digest, actual))
+        return False
+    return True
+
+@contextlib.contextmanager
+def locked_index(index_path, default):
+    """ hold exclusive lock on json index file and yield its contents (or 
+        default if it does not exist), saving it on exit.  The lock is held
+        on a .lock file within the index directory so concurrent labtool
+        invocations can share the index
+    """
+    path = os.path.dirname(index_path)
+    if not os.path.isdir(path): os.makedirs(path)
+    with open("%s/.lock" % path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            index = default
+            try:
+                with open(index_path, "r") as f: index = json.load(f)
+            except (IOError, ValueError) as e:
+                logger.debug("creating index %s: %s" % (index_path, e))
+            yield index
+            tmp = "%s.tmp" % index_path
+            with open(tmp, "w") as f: f.write(pretty_print(index))
+            os.rename(tmp, index_path)
+        finally: fcntl.flock(lock, fcntl.LOCK_UN)
+
+def stage_cache_keys(path, topo, stage, fs_image=None, dopt=None):
+    """ return dict of stage (1 to stage) to content hash identifying the 
+        state of all lab devices at the end of that stage.  Covers 
+        topology.json, docker image ids, flexswitch image, docker options, 
+        and stage scripts 1 to stage.  Image ids and the flexswitch image
+        hash are computed once and shared by the keys of all stages
     """
+    h = hashlib.sha256()
+    with open("%s/topology.json" % path, "rb") as f: h.update(f.read())
+    for image in sorted(set([topo[d].dockerimage for d in topo])):
+        info = get_docker().image_info(image) or {}
+        h.update("%s=%s\n" % (image, info.get("Id", "")))
+    if fs_image is not None: h.update(file_sha256(fs_image))
+    h.update("%s" % dopt)
+    keys = {}
     for s in xrange(1, stage+1):
-        fname = "%s/stage%s.sh" % (path,s)
+        with open("%s/stage%s.sh" % (path, s), "rb") as f: h.update(f.read())
+        keys[s] = h.copy().hexdigest()
+    return keys
+
+class StageCache(object):
+    """ index of committed device images at the end of each lab stage.  The
+        index is stored in stage_cache_dir/index.json in the format:
+            {"version": 1, "entries": {
+                "<key>": {"lab":"", "stage":0, "size":0, "last_used":0,
+                    "images": {"device_name": "image:tag"}}
+            }}
+        Total size is bounded by max_bytes with least-recently-used entries
+        evicted first.  All index operations hold an exclusive file lock so
+        concurrent labtool invocations can share the cache
+    """
+    def __init__(self, path=None, max_bytes=None):
+        if path is None: path = stage_cache_dir
+        if max_bytes is None: max_bytes = stage_cache_max_bytes
+        self.path = path
+        self.max_bytes = max_bytes
+        self.index_path = "%s/index.json" % path
+
+    def locked(self):
+        """ hold exclusive lock and yield index, saving it on exit """
+        return locked_index(self.index_path, {"version": 1, "entries": {}})
+
+    def lookup(self, key):
+        """ return cache entry for key if all of its images still exist """
+        with self.locked() as index:
+            entry = index["entries"].get(key)
+            if entry is None: return None
+            for image in entry["images"].values():
+                if get_docker().image_info(image) is None:
+                    logger.debug("stage cache image %s missing" % image)
+                    self.remove_entry(index, key)
+                    return None
+            entry["last_used"] = time.time()
+            return entry
+
+    def record(self, key, lab_id, stage, topo):
+        """ commit all devices within topology concurrently and add cache 
+            entry
+        """
+        images = dict([(n, "%s:%s-%s" % (stage_cache_repo, key[:16], n)) 
+            for n in topo])
+        def commit(device_name):
+            image = images[device_name]
+            try:
+                get_docker().commit(container_name(device_name), image, 
+                    {stage_cache_label: key[:16]})
+                # only account for the committed layer on top of base image
+                info = get_docker().image_info(image) or {}
+                base = get_docker().image_info(topo[device_name].dockerimage)
+                return max(0, info.get("Size",0) - (base or {}).get("Size",0))
+            except Exception as e:
+                logger.warn("failed to record stage %s cache of %s: %s" % (
+                    stage, device_name, e))
+                return None
+        logger.info("recording stage %s cache" % stage)
+        workers = ThreadPool(min(MAX_THREADS, len(images)))
+        try: sizes = workers.map(commit, sorted(images))
+        finally: workers.close()
+        if None in sizes:
+            for image in images.values():
+                try: get_docker().remove_image(image)
+                except Exception as e: pass
+            return
+        size = sum(sizes)
+        with self.locked() as index:
+            index["entries"][key] = {"lab": lab_id, "stage": stage, 
+                "size": size, "last_used": time.time(), "images": images}
+            self.evict(index)
+        logger.debug("recorded stage %s cache %s (%s bytes)"%(stage,key,size))
+
+    def evict(self, index, max_bytes=None):
+        """ remove least recently used entries until within max_bytes """
+        if max_bytes is None: max_bytes = self.max_bytes
+        entries = index["entries"]
+        total = sum([e["size"] for e in entries.values()])
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= max_bytes: break
+            total-= entries[key]["size"]
+            logger.debug("evicting stage cache %s" % key)
+            self.remove_entry(index, key)
+
+    def remove_entry(self, index, key):
+        """ remove entry and all of its images.  Images still used by a 
+            container are only untagged, these and earlier untagged cache
+            images are pruned once no longer used
+        """
+        entry = index["entries"].pop(key, None)
+        if entry is None: return
+        for image in entry["images"].values():
+            try: get_docker().remove_image(image)
+            except Exception as e: 
+                logger.debug("failed to remove %s: %s" % (image, e))
+        try: get_docker().prune_images(stage_cache_label)
+        except Exception as e:
+            logger.debug("failed to prune stage cache images: %s" % e)
+
+    def clear(self, lab_id=None):
+        """ invalidate all entries or only entries of provided lab """
+        with self.locked() as index:
+            for key in index["entries"].keys():
+                if lab_id is None or index["entries"][key]["lab"] == lab_id:
+                    self.remove_entry(index, key)
+
+@traced("stage")
+def execute_stages(path, stage=0, start=1):
+    """ execute commands within all stage scripts from start to provided 
+        stage. Ensure only 'safe' curl commands are executed.  Stage scripts
+        that only contain curl requests against localhost are executed 
+        natively (see parse_stage_script), all others are executed through
+        bash.  Consecutive native stages are queued per device so each 
+        device applies its requests in order while devices run concurrently.
+        Remaining stages are still applied after a stage fails (as lab 
+        scripts were written against).  return boolean success of all stages
+    """
+    env = read_environment_variables(path)
+    # bash stages can read the runtime state of the lab devices
+    os.environ["LABTOOL_RUNTIME_STATE"] = os.path.abspath(
+        runtime_state_path(path))
+    queued = []
+    success = True
+    for s in xrange(start, stage+1):
+        fname = stage_script_path(path, s)
         logger.info("applying stage %s configuration" % s)
         logger.debug("opening stage commands in %s" % fname)
         try:
-            logger.debug(exec_cmd("/bin/bash -c %s" % fname, 
-                ignore_exception=True))
+            requests = parse_stage_script(fname, env)
+            if requests is not None:
+                queued+= requests
+                continue
+            # preceding native stages must complete before bash stage
+            success = execute_stage_requests(queued) and success
+            queued = []
+            out = exec_cmd("/bin/bash -c %s" % fname, ignore_exception=True)
+            if out is None:
+                logger.error("stage %s failed: %s" % (s, fname))
+                success = False
+                continue
+            logger.debug(out)
         except IOError as e:
             logger.error("failed to open %s: %s" % (fname,e)) 
             continue
+    return execute_stage_requests(queued) and success
+
+def plan_stage_requests(path, stage, start=1, env=None):
+    """ return ordered list of native requests for stages start to stage or
+        None if any stage must be executed through bash
+    """
+    if env is None: env = read_environment_variables(path)
+    requests = []
+    for s in xrange(start, stage+1):
+        try: r = parse_stage_script(stage_script_path(path, s), env)
+        except IOError as e: r = None
+        if r is None: return None
+        requests+= r
+    return requests
+
+def stage_script_path(path, stage):
+    """ return path of stage script of lab path.  Stage scripts of an 
+        instance are read from the copy within the instance generated 
+        directory (see write_instance_stages)
+    """
+    if instance is None: return "%s/stage%s.sh" % (path, stage)
+    return "%s/stage%s.sh" % (generated_dir(path), stage)
+
+def write_instance_stages(path, topo, stage):
+    """ copy stage scripts 1 to stage of lab path into the instance generated
+        directory with each localhost reference to a topology.json port 
+        replaced by the port allocated to the instance device
+    """
+    ports = dict([("%s" % d.lab_port, "%s" % d.port) for d in topo.values()
+        if d.lab_port is not None])
+    def remap(m):
+        return "%s:%s" % (m.group("host"), ports.get(m.group("port"), 
+            m.group("port")))
+    if not os.path.isdir(generated_dir(path)): os.makedirs(generated_dir(path))
+    for s in xrange(1, stage+1):
+        src = "%s/stage%s.sh" % (path, s)
+        try:
+            with open(src, "r") as f: script = f.read()
+            with open(stage_script_path(path, s), "w") as f:
+                f.write(re.sub(stage_port_reg, remap, script))
+            shutil.copymode(src, stage_script_path(path, s))
+        except (IOError, OSError) as e:
+            logger.error("failed to copy %s: %s" % (src, e))
+
+def read_environment_variables(path):
+    """ return dict of variables within generated source.env for lab path
+        merged over the current process environment
+    """
+    env = dict(os.environ)
+    env_path = "%s/source.env" % generated_dir(path)
+    try:
+        with open(env_path, "r") as f:
+            for l in f:
+                if "=" in l and not l.strip().startswith("#"):
+                    k, v = l.strip().split("=", 1)
+                    env[k.strip()] = v.strip()
+    except IOError as e:
+        logger.debug("failed to read %s: %s" % (env_path, e))
+    return env
+
+def expand_shell_variables(line, env):
+    """ expand $VAR and ${VAR} references outside of single quotes (a single
+        quote within double quotes is literal).  return None if the line
+        requires bash: command substitution, unquoted control operators or
+        redirection, any other parameter expansion, or a reference to a 
+        variable not within env
+    """
+    out, quote, i = ([], None, 0)
+    while i < len(line):
+        c = line[i]
+        if quote == "'":
+            if c == "'": quote = None
+        elif c == "\\" and i+1 < len(line):
+            out.append(line[i:i+2])
+            i+= 2
+            continue
+        elif c == "'" and quote is None: quote = "'"
+        elif c == '"': quote = None if quote == '"' else '"'
+        elif c == "`" or (quote is None and c in ";|&<>()"): return None
+        elif c == "$" and i+1 < len(line) and not line[i+1].isspace() and \
+            line[i+1] not in "'\"":
+            r1 = re.match(shell_var_reg, line[i:])
+            if r1 is None: return None
+            name = r1.group("a") or r1.group("b")
+            if name not in env: return None
+            out.append(env[name])
+            i+= len(r1.group(0))
+            continue
+        out.append(c)
+        i+= 1
+    return "".join(out)
+
+def parse_curl_command(args):
+    """ parse curl argument list (excluding 'curl') into request dict:
+            {"method":"", "url":"", "body":"", "username":"", "password":""}
+        return None if any option is not supported
+    """
+    req = {"method": None, "url": None, "body": None, "username": None,
+        "password": None}
+    flag_opts = ("s", "k", "S")
+    value_opts = {"X": "method", "d": "body", "u": "user"}
+    long_opts = {"--insecure": None, "--silent": None, "--request": "method",
+        "--data": "body", "--user": "user"}
+    i = 0
+    while i < len(args):
+        a = args[i]
+        key = None
+        if a in long_opts:
+            key = long_opts[a]
+            if key is not None:
+                if i+1 >= len(args): return None
+                i+= 1
+                req[key] = args[i]
+        elif a.startswith("-") and len(a)>1:
+            # combined short options, last may take a value (-sX POST)
+            for j in xrange(1, len(a)):
+                if a[j] in flag_opts: continue
+                if a[j] not in value_opts: return None
+                value = a[j+1:]
+                if len(value) == 0:
+                    if i+1 >= len(args): return None
+                    i+= 1
+                    value = args[i]
+                req[value_opts[a[j]]] = value
+                break
+        elif req["url"] is None: req["url"] = a
+        else: return None
+        i+= 1
+    if req["url"] is None: return None
+    if "user" in req:
+        user = req.pop("user").split(":", 1)
+        req["username"], req["password"] = (user[0], 
+            user[1] if len(user)>1 else "")
+    if req["method"] is None:
+        req["method"] = "POST" if req["body"] is not None else "GET"
+    url = urlparse.urlparse(req["url"])
+    try: port = url.port
+    except ValueError as e: return None
+    if url.scheme not in ("http", "https") or port is None or \
+        url.hostname not in ("localhost", "127.0.0.1"):
+        return None
+    req["schema"], req["port"] = (url.scheme, port)
+    req["path"] = url.path + ("?%s" % url.query if len(url.query)>0 else "")
+    return req
+
+def parse_stage_script(fname, env):
+    """ parse stage script into ordered list of curl request dicts.  Only
+        comments, echo, source of the generated source.env (its variables
+        are already within env), and curl commands against localhost are 
+        supported.  Return None if script must be executed through bash
+    """
+    requests = []
+    with open(fname, "r") as f: lines = f.read().split("\n")
+    for (lineno, l) in enumerate(lines):
+        l = l.strip()
+        if len(l) == 0 or l.startswith("#"): continue
+        req = None
+        try:
+            expanded = expand_shell_variables(l, env)
+            args = shlex.split(expanded) if expanded is not None else []
+        except ValueError as e: args = []
+        if len(args) > 0 and args[0] == "echo": continue
+        if len(args) == 2 and args[0] in ("source", ".") and \
+            os.path.basename(args[1]) == "source.env": continue
+        if len(args) > 0 and args[0] == "curl":
+            req = parse_curl_command(args[1:])
+        if req is None:
+            logger.debug("%s:%s requires bash: %s" % (fname, lineno+1, l))
+            return None
+        req["source"] = "%s:%s" % (fname, lineno+1)
+        requests.append(req)
+    return requests
+
+def execute_device_requests(requests):
+    """ execute ordered list of requests for a single device over one
+        keep-alive session.  Each failed request is logged.  return boolean
+        success
+    """
+    failed = 0
+    r = requests[0]
+    session = RestSession(r["schema"], r["port"], r["username"], 
+        r["password"])
+    try:
+        for r in requests:
+            try:
+                (status, out) = session.request(r["method"], r["path"], 
+                    r["body"])
+                logger.debug("%s %s %s: %s %s" % (r["source"], r["method"],
+                    r["url"], status, out))
+                if status >= 400:
+                    logger.warn("%s %s %s failed: %s %s" % (r["source"], 
+                        r["method"], r["url"], status, out))
+                    failed+= 1
+            except Exception as e:
+                logger.warn("%s %s %s failed: %s" % (r["source"], 
+                    r["method"], r["url"], e))
+                failed+= 1
+    finally: session.close()
+    if failed > 0:
+        logger.error("%s of %s stage requests to port %s failed" % (failed,
+            len(requests), r["port"]))
+    return failed == 0
+
+def execute_stage_requests(requests):
+    """ execute stage requests with one ordered queue per device port and
+        all devices executing concurrently.  return boolean success
+    """
+    if len(requests) == 0: return True
+    queues = {}
+    for r in requests: 
+        queues.setdefault((r["schema"], r["port"]), []).append(r)
+    logger.debug("executing %s requests across %s devices" % (len(requests),
+        len(queues)))
+    pool = ThreadPool(min(MAX_THREADS, len(queues)))
+    try: results = pool.map(execute_device_requests, queues.values())
+    finally: pool.close()
+    return all(results)
+
+class RestSession(object):
+    """ keep-alive http(s) session to a single device REST api on localhost.
+        A session is not thread-safe, callers must only issue one request at
+        a time per session
+    """
+    def __init__(self, schema, port, username, password, host="localhost",
+                timeout=10):
+        self.schema = schema
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self.conn = None
+        self.headers = {"Content-Type": "application/json"}
+        if username is not None:
+            self.headers["Authorization"] = "Basic %s" % base64.b64encode(
+                "%s:%s" % (username, password))
+
+    def connect(self):
+        if self.schema == "https":
+            kwargs = {}
+            # skip certificate verification (equivalent of curl --insecure)
+            if hasattr(ssl, "_create_unverified_context"):
+                kwargs["context"] = ssl._create_unverified_context()
+            return httplib.HTTPSConnection(self.host, self.port, 
+                timeout=self.timeout, **kwargs)
+        return httplib.HTTPConnection(self.host, self.port, 
+            timeout=self.timeout)
+
+    def close(self):
+        if self.conn is not None: self.conn.close()
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        """ perform request and return (status, body).  A kept-alive 
+            connection closed by the device is retried once
+        """
+        start = time.time()
+        for attempt in (0, 1):
+            fresh = self.conn is None
+            if fresh: self.conn = self.connect()
+            try:
+                self.conn.request(method, path, body, self.headers)
+                resp = self.conn.getresponse()
+                data = resp.read()
+            except (httplib.HTTPException, socket.error, ssl.SSLError) as e:
+                self.close()
+                if not fresh: continue
+                exec_stats.record(path, time.time() - start, False, 
+                    "rest %s" % method)
+                raise
+            if resp.getheader("connection", "").lower() == "close":
+                self.close()
+            exec_stats.record(path, time.time() - start, resp.status < 400,
+                "rest %s" % method)
+            return (resp.status, data)
+
+def device_session(device):
+    """ return RestSession for the provided topology device """
+    return RestSession(device.schema, device.port, device.username,
+        device.password)
 
+def flexswitch_uptime_ready(js, uptime_threshold=10):
+    """ parse SystemStatus response and return tuple (ready, uptime). Device
+        is not considered ready until uptime is above uptime_threshold
+    """
+    if "Object" not in js or "UpTime" not in js["Object"] or \
+        "Ready" not in js["Object"]:
+        return (False, 0)
+    uptime = js["Object"]["UpTime"]
+    ready = bool(js["Object"]["Ready"])
+    # overwrite ready attribute if uptime is less than threshold
+    if "ms" in uptime: ready = False
+    elif "h" in uptime or "m" in uptime: pass
+    else:
+        ut = float(re.sub("s","", uptime))
+        if ut < uptime_threshold: ready = False
+    return (ready, uptime)
+
+def check_flexswitch_ready(state, uptime_threshold=10):
+    """ poll SystemStatus of a single device, restarting flexswitch if the
+        device deadline has expired.  The device is marked failed once its
+        deadline expires after max_restarts restarts.  Updates and returns 
+        device state
+    """
+    d = state["name"]
+    try:
+        (status, out) = state["session"].request("GET",
+            "/public/v1/state/SystemStatus")
+        (ready, uptime) = flexswitch_uptime_ready(json.loads(out), 
+            uptime_threshold)
+        logger.debug("uptime for %s: %s, ready:%r" % (d, uptime, ready))
+        state["ready"], state["uptime"] = (ready, uptime)
+    except Exception as e:
+        logger.debug("%s not ready: %s" % (d, e))
+        state["ready"], state["uptime"] = (False, 0)
+    if state["ready"]: return state
+    if time.time() >= state["deadline"]:
+        if state["restarts"] >= state["max_restarts"]:
+            logger.error("flexswitch not ready on %s after %s restarts" % (
+                d, state["restarts"]))
+            state["failed"] = True
+            state["session"].close()
+            return state
+        state["restarts"]+= 1
+        logger.info("timeout expired, restarting flexswitch on %s" % d)
+        try: get_docker().execute(container_name(d), ["service", 
+            "flexswitch", "start"])
+        except CommandInterrupted as e: 
+            # re-raised by the poller, pool callbacks only receive results
+            state["interrupted"] = e
+            return state
+        except Exception as e: logger.debug("restart %s failed: %s" % (d, e))
+        state["deadline"] = time.time() + state["timeout"]
+        state["backoff"] = READY_BACKOFF_MIN
+        state["session"].close()
+        return state
+    state["backoff"] = min(state["backoff"]*2, READY_BACKOFF_MAX,
+        max(0, state["deadline"] - time.time()))
+    return state
+
+@traced("ready")
 def verify_flexswitch_running(devices, timeout=flexswitch_timeout, 
-                            uptime_threshold=10):
+                uptime_threshold=10, on_ready=None, stop=None, admit=None,
+                max_restarts=READY_MAX_RESTARTS, deadline=READY_DEADLINE,
+                hosts=None):
     """ for provided devices dictionary, wait for flexswitch to start
-        if it has not started within the timeout manually start the process
+        if it has not started within the timeout manually start the process.
+        A device fails once it is still not ready after max_restarts 
+        restarts, and all devices not ready within deadline seconds of the
+        start of polling fail.  Each device is polled independently over a
+        keep-alive session with exponential backoff and on_ready(device_name)
+        is called as soon as that device is ready.  If the optional admit
+        queue is provided, a device is only polled once (device_name, started)
+        is received from it, and a device that was not started is never 
+        ready.  Polling is abandoned if the optional stop event is set.
+        returns True if all devices are ready.  hosts is an optional dict of
+        device name to address polled on the device port_internal instead of
+        the published host port (pooled containers)
     """
     logger.info("waiting for flexswitch to start...")
+    expires = time.time() + deadline
+    flex = sorted([d for d in devices if devices[d].has_flexswitch()])
     device_state = {}
-    for d in devices: 
-        if devices[d].get("flexswitch", "_image_default_").upper() == "NA":
-            continue
+    # schedule of (next poll timestamp, device) served by a bounded pool
+    schedule = []
+    def add_device(d):
+        now = time.time()
         device_state[d] = {"name":d, "uptime":0, "ready":False,
-            "port":devices[d]["port"]}
-    start_ts = time.time()
-    while start_ts + timeout > time.time():
-        # loop through all devices and check if system is ready
-        waiting = False
-        for d in device_state:
-            cmd ="curl --insecure -u %s:%s -s %s://localhost:%s/"%(
-                devices[d]["username"], devices[d]["password"], 
-                devices[d]["schema"], device_state[d]["port"])
-            cmd+= "public/v1/state/SystemStatus"
-            out = exec_cmd(cmd, ignore_exception=True)
-            if out is not None:
-                try:
-                    js = json.loads(out)
-                    if "Object" in js and "UpTime" in js["Object"] and \
-                        "Ready" in js["Object"]:
-                        uptime = js["Object"]["UpTime"]
-                        ready = bool(js["Object"]["Ready"])
-                        logger.debug("uptime for %s: %s, ready:%r" % (d, 
-                            uptime, ready))
-                        device_state[d]["uptime"] = uptime
-                        # overwrite ready attribute if uptime is less than
-                        # threshold
-                        if "ms" in uptime: ready = False
-                        elif "h" in uptime or "m" in uptime: pass
-                        else:
-                            ut = float(re.sub("s","", uptime))
-                            if ut < uptime_threshold: ready = False
-                        logger.debug("overwriting ready to: %r" % ready)
-                        device_state[d]["ready"] = ready
-                        if ready: continue
-                               
-                except ValueError as e:
-                    logger.debug("failed to parse: %s" % e)
-                    device_state[d]["ready"] = False
-                    device_state[d]["uptime"] = 0
-            # only if all conditions match do we skip reset of waiting flag
-            waiting = True
-        if waiting: time.sleep(1)
-        else: break
-    
-    # check if any devices need to have flexswitch manually started
-    manually_started = False
-    for d in device_state:
-        if not device_state[d]["ready"]:
-            manually_started = True
-            logger.info("timeout expired, restarting flexswitch on %s"%d)
-            exec_cmd("docker exec -it %s service flexswitch start" % d)
-
-    # best to go through process again to ensure service actually starts
-    if manually_started:
-        return verify_flexswitch_running(devices, timeout, uptime_threshold)
+            "timeout": timeout, "deadline": now + timeout,
+            "backoff": READY_BACKOFF_MIN, "start": now, "restarts": 0,
+            "max_restarts": max_restarts, "failed": False,
+            "session": None}
+        if hosts is not None and d in hosts:
+            device_state[d]["session"] = RestSession(devices[d].schema,
+                devices[d].port_internal, devices[d].username, 
+                devices[d].password, host=hosts[d])
+        else: device_state[d]["session"] = device_session(devices[d])
+        heapq.heappush(schedule, (now, d))
+    pending = set()
+    if admit is None: 
+        for d in flex: add_device(d)
+    else: pending = set(flex)
+
+    completed = Queue.Queue()
+    pool = None
+    if len(flex) > 0: pool = ThreadPool(min(MAX_THREADS, len(flex)))
+    success = True
+    try:
+        in_flight = 0
+        while len(schedule) > 0 or in_flight > 0 or len(pending) > 0:
+            if stop is not None and stop.is_set(): 
+                logger.debug("flexswitch readiness polling stopped")
+                return False
+            while len(pending) > 0:
+                try: (d, started) = admit.get_nowait()
+                except Queue.Empty: break
+                if d not in pending: continue
+                pending.discard(d)
+                if started: add_device(d)
+                else: success = False
+            now = time.time()
+            if now >= expires:
+                waiting = sorted(pending | set([d for d in device_state if
+                    not device_state[d]["ready"]]))
+                logger.error("flexswitch not ready within %s seconds on: %s"%(
+                    deadline, ", ".join(waiting)))
+                return False
+            while len(schedule) > 0 and schedule[0][0] <= now:
+                d = heapq.heappop(schedule)[1]
+                pool.apply_async(check_flexswitch_ready, 
+                    (device_state[d], uptime_threshold), 
+                    callback=completed.put)
+                in_flight+= 1
+            wait = None
+            if len(schedule) > 0: wait = max(0, schedule[0][0] - now)
+            if len(pending) > 0:
+                # check for newly admitted devices at the minimum backoff
+                wait = READY_BACKOFF_MIN if wait is None else min(wait,
+                    READY_BACKOFF_MIN)
+            if wait is not None: wait = min(wait, max(0, expires - now))
+            if in_flight == 0: 
+                if wait is not None: time.sleep(wait)
+                continue
+            if wait is None: wait = max(0, expires - now)
+            try: state = completed.get(timeout=wait)
+            except Queue.Empty: continue
+            in_flight-= 1
+            if "interrupted" in state: raise state["interrupted"]
+            if state["ready"]:
+                logger.debug("flexswitch ready on %s" % state["name"])
+                state["session"].close()
+                if tracer is not None:
+                    tracer.add("ready", state["name"], state["start"],
+                        time.time())
+                if on_ready is not None: on_ready(state["name"])
+            elif state["failed"]: success = False
+            else:
+                heapq.heappush(schedule, (time.time() + state["backoff"],
+                    state["name"]))
+    finally:
+        if pool is not None: pool.close()
+
+    if not success: return False
     # success
     logger.info("flexswitch is running on all containers")
+    return True
+
+class FlexswitchImageCache(object):
+    """ content-addressed cache of flexswitch images.  Each image is stored
+        as fs_image_dir/<sha256>/<image name> and indexed in 
+        fs_image_dir/index.json in the format:
+            {"version": 1, 
+             "entries": {"<sha256>": {"name":"", "size":0, "mtime":0, 
+                "last_used":0}},
+             "urls": {"<url>": "<sha256>"}}
+        Downloads are written to fs_image_dir/.partial/ and resumed with http
+        range requests.  Concurrent downloads of the same url are serialized
+        by a per-url file lock.  Total size is bounded by max_bytes with 
+        least-recently-used images evicted first
+    """
+    def __init__(self, path=None, max_bytes=None):
+        if path is None: path = fs_image_dir
+        if max_bytes is None: max_bytes = fs_image_max_bytes
+        self.path = path
+        self.max_bytes = max_bytes
+        self.index_path = "%s/index.json" % path
+
+    def locked(self):
+        """ hold exclusive lock and yield index, saving it on exit """
+        return locked_index(self.index_path, {"version": 1, "entries": {}, 
+            "urls": {}})
+
+    def image_path(self, digest, entry):
+        return "%s/%s/%s" % (self.path, digest, entry["name"])
+
+    def verify(self, digest, entry):
+        """ return true if cached image is intact.  File contents are only
+            re-hashed if size or mtime changed since the image was cached
+        """
+        path = self.image_path(digest, entry)
+        if not os.path.isfile(path): return False
+        st = os.stat(path)
+        if st.st_size == entry["size"] and st.st_mtime == entry["mtime"]:
+            return True
+        if not verify_file_sha256(path, digest): return False
+        (entry["size"], entry["mtime"]) = (st.st_size, st.st_mtime)
+        return True
+
+    def lookup(self, index, digest):
+        """ return full path of verified image, removing corrupt entries """
+        entry = index["entries"].get(digest)
+        if entry is None: return None
+        if not self.verify(digest, entry):
+            logger.debug("removing invalid cached image %s" % digest)
+            self.remove_entry(index, digest)
+            return None
+        entry["last_used"] = time.time()
+        return os.path.abspath(self.image_path(digest, entry))
+
+    def lookup_url(self, url, digest=None):
+        """ return path of image previously downloaded from url """
+        with self.locked() as index:
+            d = index["urls"].get(url)
+            if d is None or (digest is not None and d != digest): return None
+            return self.lookup(index, d)
+
+    def lookup_name(self, name, digest=None):
+        """ return path of most recently used cached image with provided 
+            name.  Images cached by previous versions of labtool directly 
+            within fs_image_dir are imported into the cache
+        """
+        legacy = "%s/%s" % (self.path, name)
+        if os.path.isfile(legacy) and os.stat(legacy).st_size >= 1024*1024:
+            logger.debug("importing cached image %s" % legacy)
+            self.add(legacy, name)
+        with self.locked() as index:
+            entries = index["entries"]
+            for d in sorted(entries, key=lambda d: entries[d]["last_used"],
+                reverse=True):
+                if entries[d]["name"] != name: continue
+                if digest is not None and d != digest: continue
+                path = self.lookup(index, d)
+                if path is not None: return path
+        return None
+
+    def add(self, src, name, url=None, digest=None):
+        """ move file src into cache and return its full path """
+        if digest is None: digest = file_sha256(src)
+        with self.locked() as index:
+            entry = index["entries"].get(digest, {"name": name})
+            dst = self.image_path(digest, entry)
+            if not os.path.isdir(os.path.dirname(dst)): 
+                os.makedirs(os.path.dirname(dst))
+            if not os.path.isfile(dst): os.rename(src, dst)
+            elif os.path.abspath(src) != os.path.abspath(dst): os.remove(src)
+            st = os.stat(dst)
+            entry.update({"size": st.st_size, "mtime": st.st_mtime, 
+                "last_used": time.time()})
+            index["entries"][digest] = entry
+            if url is not None: index["urls"][url] = digest
+            self.evict(index, keep=digest, in_use=self.mounted())
+        return os.path.abspath(dst)
+
+    def download(self, url, name, digest=None):
+        """ download url into cache, resuming a previously interrupted 
+            download.  return full path or None on error
+        """
+        partial = "%s/.partial" % self.path
+        if not os.path.isdir(partial): os.makedirs(partial)
+        part = "%s/%s.part" % (partial, hashlib.md5(url).hexdigest())
+        with open("%s.lock" % part, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # another labtool instance may have completed the download
+                path = self.lookup_url(url, digest)
+                if path is not None: return path
+                for attempt in (0, 1):
+                    try: 
+                        (ok, actual) = self.fetch(url, part)
+                        break
+                    except urllib2.HTTPError as e:
+                        # partial file no longer matches remote file 
+                        if e.code != 416 or attempt > 0: raise
+                        os.remove(part)
+                if not ok: return None
+                if digest is not None and actual != digest:
+                    logger.error("sha256 mismatch for %s: expected %s, "\
+                        "found %s" % (url, digest, actual))
+                    os.remove(part)
+                    return None
+                return self.add(part, name, url=url, digest=actual)
+            except (urllib2.URLError, httplib.HTTPException, socket.error, 
+                IOError) as e:
+                logger.error("failed to download %s: %s" % (url, e))
+                return None
+            finally: fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def fetch(self, url, part):
+        """ download url to part file, resuming from current size of part.
+            return tuple (complete, sha256 of part file)
+        """
+        h = hashlib.sha256()
+        offset = 0
+        if os.path.isfile(part):
+            offset = os.stat(part).st_size
+            with open(part, "rb") as f:
+                for chunk in iter(lambda: f.read(1024*1024), ""): 
+                    h.update(chunk)
+        req = urllib2.Request(url)
+        if offset > 0: 
+            logger.info("resuming download at %s bytes" % offset)
+            req.add_header("Range", "bytes=%s-" % offset)
+        resp = urllib2.urlopen(req, timeout=60)
+        if offset > 0 and resp.getcode() != 206:
+            logger.debug("server does not support range requests")
+            (offset, h) = (0, hashlib.sha256())
+        length = resp.info().getheader("Content-Length")
+        written = 0
+        with open(part, "ab" if offset > 0 else "wb") as f:
+            for chunk in iter(lambda: resp.read(1024*1024), ""):
+                f.write(chunk)
+                h.update(chunk)
+                written+= len(chunk)
+        if length is not None and written < int(length):
+            logger.error("incomplete download of %s, rerun to resume" % url)
+            return (False, None)
+        return (True, h.hexdigest())
+
+    def mounted(self):
+        """ return set of digests of cached images mounted by existing
+            containers (gen_flex_path) or None if containers are unknown
+        """
+        try: snapshot = get_container_snapshot()
+        except Exception as e:
+            logger.debug("failed to read containers: %s" % e)
+            return None
+        root = os.path.realpath(self.path)
+        digests = set()
+        for r in snapshot.values():
+            for m in r.get("mounts", []):
+                if m.get("Destination") != gen_flex_path: continue
+                src = os.path.realpath(m.get("Source", ""))
+                if os.path.dirname(os.path.dirname(src)) == root:
+                    digests.add(os.path.basename(os.path.dirname(src)))
+        return digests
+
+    def evict(self, index, max_bytes=None, keep=None, in_use=()):
+        """ remove least recently used images until within max_bytes.  
+            Images with digest within in_use (see mounted) are kept, nothing
+            is evicted if in_use is None
+        """
+        if max_bytes is None: max_bytes = self.max_bytes
+        if in_use is None:
+            logger.debug("skipping image cache eviction")
+            return
+        entries = index["entries"]
+        total = sum([e["size"] for e in entries.values()])
+        for d in sorted(entries, key=lambda d: entries[d]["last_used"]):
+            if total <= max_bytes: break
+            if d == keep or d in in_use: continue
+            total-= entries[d]["size"]
+            logger.debug("evicting cached image %s" % d)
+            self.remove_entry(index, d)
+
+    def remove_entry(self, index, digest):
+        """ remove image from cache """
+        entry = index["entries"].pop(digest, None)
+        for url in [u for u in index["urls"] if index["urls"][u] == digest]:
+            index["urls"].pop(url)
+        if entry is None: return
+        try: shutil.rmtree("%s/%s" % (self.path, digest))
+        except OSError as e: logger.debug("failed to remove %s: %s" % (
+            digest, e))
 
 def check_flexswitch_image(img=None):
     """ if image is a url, download the image and save to images/ cache 
         check that flexswitch image is formatted as docker deb package
             flexswitch_docker-(.*).deb
+        The image may be pinned to a sha256 digest by appending 
+        #sha256=<digest> in which case the image contents are verified.
         return None if invalid else returns full image path
     """
     if img is None: return None
     img_reg = "(?i)^flexswitch_docker[a-z0-9\_\-\.]+\.deb$"
-    # download image first if url is provided
-    if re.search("^http", img) is not None:
-        img_name = img.split("/")[-1]
-        # validate img name (this will be repeated later again after download
-        # but best if we skip the download if the image is not valid name)
-        if not re.search(img_reg, img_name):
-            logger.error("'%s' is not a valid flexswitch docker image"%img_name)
-            return None
-        # check if image is already available in fs_image_dir
-        if not os.path.isfile("%s/%s" % (fs_image_dir, img_name)):
-            logger.info("downloading image from %s" % img)
-            ret = exec_cmd("wget -O %s/%s %s" % (fs_image_dir, img_name, img),
-                ignore_exception=True)
-            if ret is None:
-                logger.error("failed to download image")
-                try:
-                    # wget -O creates file with zero size even on failed 
-                    # download, need to delete it to prevent picking it up as 
-                    # a cached copy
-                    if os.path.isfile("%s/%s" % (fs_image_dir, img_name)):
-                        logger.debug("deleting file: %s/%s" % (fs_image_dir, 
-                            img_name))
-                        os.remove("%s/%s" % (fs_image_dir, img_name))
-                except IOError as e: pass
-                return None
-            # rename img to local file
-            img = "%s/%s" % (fs_image_dir, img_name)
+    digest = None
+    r1 = re.search("#sha256=(?P<digest>[a-fA-F0-9]{64})$", img)
+    if r1 is not None:
+        digest = r1.group("digest").lower()
+        img = img[:r1.start()]
+    cache = FlexswitchImageCache()
 
-    # extract filename from path and ensure valid img name
+    # extract filename from path/url and ensure valid img name before any
+    # download is attempted
     img_name = img.split("/")[-1]
     if not re.search(img_reg, img_name):
         logger.error("'%s' is not a valid flexswitch docker image" % img_name)
         return None
-    if not os.path.isfile(img):
-        # if file is not file, check the img_name against the cache directory
-        # as last resort
-        if not os.path.isfile("%s/%s" % (fs_image_dir, img_name)):
+    if re.search("^http", img) is not None:
+        # download image unless already within cache
+        path = cache.lookup_url(img, digest)
+        if path is None:
+            logger.info("downloading image from %s" % img)
+            path = cache.download(img, img_name, digest)
+            if path is None:
+                logger.error("failed to download image")
+                return None
+        img = path
+    elif not os.path.isfile(img):
+        # if file is not file, check the img_name against the cache as last
+        # resort
+        path = cache.lookup_name(img_name, digest)
+        if path is None:
             logger.error("unable to access flexswitch image: %s" % img)
             return None
-        else: img = "%s/%s" % (fs_image_dir, img_name)
+        img = path
+    elif digest is not None and not verify_file_sha256(img, digest):
+        return None
 
     # verify size is not zero (1MB)
     if os.stat(img).st_size < 1024*1024*1:
@@ -714,50 +3854,129 @@ def check_flexswitch_image(img=None):
     # everything looks ok, return full path
     return os.path.abspath(img)
 
-def get_labs():
-    """ use package docstring to determine lab id, name, and description 
-        return dictionary containing {
-            "lab_id": {
-                "id": <lab_id>,
-                "name": <lab_name>,
-                "description": <lab_description>,
-                "path": <full path to lab module>,
-                "stage_max": <integer maximum number of stages for lab>
-            }
+def lab_stamp(path):
+    """ return list of mtimes of lab directory and its package and topology
+        files used to detect changes to a cataloged lab
+    """
+    stamp = []
+    for f in (path, "%s/__init__.py" % path, "%s/topology.json" % path):
+        try: stamp.append(os.stat(f).st_mtime)
+        except OSError as e: stamp.append(0)
+    return stamp
+
+def catalog_lab(path):
+    """ import lab package at path and return its catalog entry {
+            "id": <lab_id>,
+            "name": <lab_name>,
+            "description": <lab_description>,
+            "path": <full path to lab module>,
+            "stage_max": <integer maximum number of stages for lab>,
+            "topology": <sha256 of topology.json>,
+            "stamp": <lab_stamp of path>
         }
+        invalid labs are cataloged with only "error", "path", and "stamp"
     """
-    from labs import labs
+    import labs
+    entry = {"path": path, "stamp": lab_stamp(path)}
+    l = labs.load(os.path.basename(path))
+    if l is None:
+        entry["error"] = "failed to import lab: %s" % path
+        return entry
+    r1 = re.search(lab_doc_reg, l.__doc__, re.DOTALL)
+    if r1 is None:
+        entry["error"] = "failed to parse docstring for lab: %s" % l.__file__
+        return entry
+    # ensure all stages from 1 to max are present (zero never present)
+    stages = []
+    stage_max = 0
+    for f in os.listdir(path):
+        r2 = re.search("^stage(?P<stage>[0-9]+)\.sh$", f)
+        if r2 is not None: 
+            s = int(r2.group("stage"))
+            if s > stage_max: stage_max = s
+            stages.append(s)
+    for s in xrange(1, stage_max+1):
+        if s not in stages:
+            entry["error"] = "missing stage %s in lab '%s'" % (
+                s, r1.group("name"))
+            return entry
+    topology = ""
+    if os.path.isfile("%s/topology.json" % path):
+        topology = file_sha256("%s/topology.json" % path)
+    entry.update({
+        "id": re.sub(" ","_", r1.group("id").lower().strip()),
+        "name": r1.group("name").strip(),
+        "description": r1.group("desc"),
+        "stage_max": stage_max,
+        "topology": topology
+    })
+    return entry
+
+def read_lab_catalog(labs_dir):
+    """ return lab catalog for labs_dir from lab_catalog_path or None if not
+        available.  The catalog is stored in the format:
+            {"version": 1, "labs_dir": "", "mtime": 0, "labs": {
+                "<directory name>": <catalog_lab entry>
+            }}
+    """
+    try:
+        with open(lab_catalog_path, "r") as f: catalog = json.load(f)
+        if catalog.get("version") == 1 and \
+            catalog.get("labs_dir") == labs_dir:
+            return catalog
+    except (IOError, ValueError) as e:
+        logger.debug("no lab catalog %s: %s" % (lab_catalog_path, e))
+    return None
+
+def write_lab_catalog(catalog):
+    """ atomically save lab catalog to lab_catalog_path """
+    try:
+        path = os.path.dirname(lab_catalog_path)
+        if not os.path.isdir(path): os.makedirs(path)
+        tmp = "%s.%s" % (lab_catalog_path, os.getpid())
+        with open(tmp, "w") as f: f.write(pretty_print(catalog))
+        os.rename(tmp, lab_catalog_path)
+    except (IOError, OSError) as e:
+        logger.debug("failed to write lab catalog %s: %s" % (
+            lab_catalog_path, e))
+
+def get_labs(lab_id=None):
+    """ return dictionary of catalog entries (see catalog_lab) of all valid
+        labs indexed by lab id.  Entries are served from the lab catalog and
+        only labs whose directory changed since they were cataloged are 
+        imported.  If lab_id is provided and its cataloged entry is current,
+        only that lab is returned without checking any other lab
+    """
+    import labs
+    catalog = read_lab_catalog(labs.ldir)
+    if catalog is not None and lab_id is not None:
+        for entry in catalog["labs"].values():
+            if entry.get("id") == lab_id and \
+                entry["stamp"] == lab_stamp(entry["path"]):
+                return {lab_id: entry}
+
+    # labs are only added or removed when the labs directory changes
+    mtime = os.stat(labs.ldir).st_mtime
+    if catalog is None: catalog = {"labs": {}}
+    if catalog.get("mtime") == mtime: dirs = sorted(catalog["labs"].keys())
+    else: dirs = labs.lab_dirs()
+    entries = {}
+    changed = catalog.get("mtime") != mtime
+    for d in dirs:
+        path = "%s/%s" % (labs.ldir, d)
+        entry = catalog["labs"].get(d)
+        if entry is None or entry["stamp"] != lab_stamp(path):
+            entry = catalog_lab(path)
+            changed = True
+        entries[d] = entry
+    if changed:
+        write_lab_catalog({"version": 1, "labs_dir": labs.ldir, 
+            "mtime": mtime, "labs": entries})
+
     all_labs = {}
-    for l in labs:
-        r1 = re.search(lab_doc_reg, l.__doc__, re.DOTALL)
-        if r1 is not None:
-            # ensure all stages from 1 to max are present (zero never present)
-            stages = []
-            valid_stages = True
-            stage_max = 0
-            for f in os.listdir(l.__path__[0]):
-                r2 = re.search("^stage(?P<stage>[0-9]+)\.sh$", f)
-                if r2 is not None: 
-                    s = int(r2.group("stage"))
-                    if s > stage_max: stage_max = s
-                    stages.append(s)
-            for s in xrange(1, stage_max+1):
-                if s not in stages:
-                    logger.error("missing stage %s in lab '%s'" % (
-                        s, r1.group("name")))
-                    valid_stages = False
-                    break
-            if not valid_stages: continue
-            lab_id = re.sub(" ","_", r1.group("id").lower().strip())
-            all_labs[lab_id] = {
-                "id": lab_id,
-                "name": r1.group("name").strip(),
-                "description": r1.group("desc"),
-                "path": l.__path__[0],
-                "stage_max": stage_max
-            }
-        else:
-            logger.error("failed to parse docstring for lab: %s"%l.__file__)
+    for d in sorted(entries):
+        if "error" in entries[d]: logger.error(entries[d]["error"])
+        else: all_labs[entries[d]["id"]] = entries[d]
     return all_labs
 
 def describe_lab(lab):
@@ -771,15 +3990,14 @@ def prompt_for_container_delete(topo):
     """ check if any container with device_name already exists, if so notify
         user that they will be deleted in order to continue with script.
         If user does not confirm, exist script
+        returns container snapshot for the topology devices
     """
-    existing_containers = []
-    for device_name in sorted(topo.keys()):
-        if container_exists(device_name): 
-            existing_containers.append(device_name)
+    snapshot = get_container_snapshot(topo.keys())
+    existing_containers = sorted(snapshot.keys())
 
     if len(existing_containers) > 0:
         print "\nThe following containers already exist:"
-        for c in existing_containers: print "\t%s" % c
+        for c in existing_containers: print "\t%s" % container_name(c)
         msg = "You can see more details on each container by issuing "
         msg+= "'docker ps -a'"
         print msg
@@ -801,29 +4019,293 @@ def prompt_for_container_delete(topo):
             msg+= "Please manually delete appropriate containers and then "
             msg+= "rerun this script\n"
             sys.exit(msg)
+    return snapshot
+
+def set_device_pid(topo, device_name, stop):
+    """ determine pid of running device container, sets stop event on
+        failure.  return boolean success
+    """
+    pid = get_container_pid(device_name)
+    if pid is None or pid == "0" or pid == "":
+        logger.error("'%s' failed to start" % device_name)
+        stop.set()
+        return False
+    topo[device_name].pid = pid
+    return True
+
+@traced("links", 1)
+def wire_device_links(topo, device_name, wired):
+    """ create all links of device to peers that already have a pid.  Links
+        towards peers without a pid are created by the peer's own task once
+        its pid is known.  wired is a dict {"lock": Lock, "links": set()}
+        shared by all tasks so each link is created exactly once
+    """
+    links = []
+    with wired["lock"]:
+        for l in topo[device_name].links():
+            key = l.key()
+            if key in wired["links"] or not l.a.device.running() or \
+                not l.b.device.running():
+                continue
+            wired["links"].add(key)
+            (pid1, pid2) = (l.a.device.pid, l.b.device.pid)
+            if connection_exists(pid1, pid2, l.a.name, l.b.name):
+                logger.debug("skipping existing connection %s" % l.label())
+                continue
+            logger.info("creating connection  %s" % l.label())
+            links.append({"pid1": pid1, "pid2": pid2, "label": l.label(),
+                "link1": l.a.name, "link2": l.b.name})
+    success = True
+    for (link, ok, err) in build_links(links):
+        if not ok:
+            logger.error("failed to create connection %s: %s" % (
+                link["label"], err))
+            success = False
+    return success
+
+def start_topology(path, topo, fs_image=None, dopt=None, run_images=None,
+                   claimed=None, snapshot=None, stage=0, start_stage=1):
+    """ bring up all devices within topology using a dependency graph per
+        device instead of global phases:
+            image pull -> container run -> pid -> links -> readiness -> stage
+        Links are created as soon as both peers have a pid, readiness is 
+        polled for all devices concurrently, and native stage requests for a
+        device are applied as soon as that device is ready.  Stages that 
+        require bash run after all devices are ready.
+        run_images - dict of device name to docker image overriding topology
+        claimed - set of devices already running from the container pool
+        snapshot - container snapshot used to determine existing containers
+        returns tuple (started, staged) of boolean success bringing up the
+        devices and links and boolean success applying the stages.  A 
+        failed stage does not affect started
+    """
+    if run_images is None: run_images = {}
+    if claimed is None: claimed = set()
+    if snapshot is None: snapshot = {}
+    try: clear_stale_connections()
+    except Exception as e: pass
+
+    sched = Scheduler()
+    stop = threading.Event()
+    progress = PullProgress()
+    wired = {"lock": threading.Lock(), "links": set()}
 
-def execute_threads(threads):
-    """ receive list of threading.Thread objects that have not yet been 
-        started. Start each thread and Ensure that only MAX_THREADS are 
-        running at a time. Ensure all threads complete
-    """
-    batch_count = 0
-    logger.debug("execute %s threads batch-size:%s"%(len(threads),MAX_THREADS))
-    while len(threads)>0:
-        batch_count+=1
-        active_threads = []
-        while len(threads)>0 and len(active_threads) < MAX_THREADS:
-            active_threads.append(threads.pop())
-        # start batch of threads
-        logger.debug("starting batch:%s" % batch_count)
-        for t in active_threads:
-            t.setDaemon(True)
-            t.start()
-            time.sleep(0.1)
-        # wait until all threads end
-        for t in active_threads: t.join()
-        logger.debug("completed batch:%s (%s remaining)" % (batch_count, 
-            len(threads)))
+    # (device_name, started) is posted to the readiness poller once a 
+    # device's run task completes or the image it depends on fails
+    admit = Queue.Queue()
+    image_devices = {}
+    def pull_image(image):
+        ok = False
+        try:
+            ok = check_docker_image(image, progress) is not False
+            return ok
+        finally:
+            if not ok:
+                for n in image_devices.get(image, []): admit.put((n, False))
+    def run_device(device_name, *args):
+        started = False
+        try:
+            started = create_flexswitch_container(device_name, *args) \
+                is not False
+            return started
+        finally: admit.put((device_name, started))
+
+    # docker image, container, pid, and link tasks per device
+    for device_name in sorted(topo):
+        d = topo[device_name]
+        image = run_images.get(device_name, d.dockerimage)
+        deps = []
+        if device_name not in claimed and not image_index.has(image):
+            # missing images are pulled concurrently while devices with 
+            # local images are already starting
+            deps = ["image:%s" % image]
+            if deps[0] not in sched.tasks:
+                sched.add(deps[0], pull_image, (image,))
+            image_devices.setdefault(image, []).append(device_name)
+        if device_name in claimed: 
+            sched.add("run:%s" % device_name)
+            admit.put((device_name, True))
+        else:
+            sched.add("run:%s" % device_name, run_device, (device_name, 
+                d.port, d.port_internal, fs_image, dopt, image, 
+                device_name in snapshot), deps)
+        sched.add("pid:%s" % device_name, set_device_pid, 
+            (topo, device_name, stop), ["run:%s" % device_name])
+        sched.add("links:%s" % device_name, wire_device_links, (topo, 
+            device_name, wired), ["pid:%s" % device_name])
+
+    # readiness is polled for all devices by a single poller that starts 
+    # polling each device as soon as its own run task has completed and 
+    # resolves that device's ready task as soon as it is ready
+    flex = dict([(n, topo[n]) for n in topo if topo[n].has_flexswitch()])
+    for device_name in sorted(topo):
+        if device_name in flex:
+            sched.add("ready:%s" % device_name, deps=["run:%s" % 
+                device_name], external=True)
+        else:
+            sched.add("ready:%s" % device_name, 
+                deps=["pid:%s" % device_name])
+    def poll_ready():
+        return verify_flexswitch_running(flex, stop=stop, admit=admit,
+            on_ready=lambda n: sched.complete("ready:%s" % n))
+    sched.add("ready", poll_ready, timed=False)
+    all_ready = ["ready:%s" % n for n in sorted(topo)]
+    all_links = ["links:%s" % n for n in sorted(topo)]
+    sched.add("env", generate_environment_variables, (path, topo),
+        ["pid:%s" % n for n in sorted(topo)])
+
+    # stages
+    if stage >= start_stage:
+        # pids of new containers are not known until the pid tasks run, so 
+        # stages referencing <DEVICE>_PID are never planned natively and run
+        # through bash with source.env generated by the env task
+        env = dict([(k, v) for (k, v) in os.environ.items() + 
+            environment_variables(topo) if not k.endswith("_PID")])
+        requests = plan_stage_requests(path, stage, start_stage, env)
+        if requests is None:
+            sched.add("stage", execute_stages, (path, stage, start_stage),
+                all_ready + all_links + ["env"])
+        else:
+            logger.info("applying stage %s to %s configuration natively" % (
+                start_stage, stage))
+            ports = dict([("%s" % topo[n].port, n) for n in topo])
+            queues = {}
+            for r in requests:
+                queues.setdefault(ports.get("%s" % r["port"]), []).append(r)
+            for (device_name, q) in sorted(queues.items()):
+                if device_name is None:
+                    deps = all_ready + all_links
+                    device_name = "*"
+                else:
+                    peers = set([device_name])
+                    for l in topo[device_name].links():
+                        peers|= set([l.a.device.key, l.b.device.key])
+                    deps = ["ready:%s" % device_name] + ["links:%s" % n for
+                        n in sorted(peers)]
+                sched.add("stage:%s" % device_name, execute_device_requests,
+                    (q,), deps)
+
+    results = sched.run()
+    failed = sorted([n for n in results if not results[n]])
+    if len(failed) > 0: logger.error("failed tasks: %s" % ", ".join(failed))
+    write_runtime_state(path, topo, set([n for n in topo if 
+        results.get("ready:%s" % n)]))
+    staged = [n for n in failed if n == "stage" or n.startswith("stage:")]
+    return (len(failed) == len(staged), len(staged) == 0)
+
+def execute_threads(funcs):
+    """ receive list of callables and run each on a pool of MAX_THREADS 
+        workers, starting the next as soon as a worker is free. Exceptions
+        raised by a callable are logged and its result is False.  Returns
+        list of results once all callables complete
+    """
+    if len(funcs) == 0: return []
+    logger.debug("execute %s threads pool-size:%s"%(len(funcs),MAX_THREADS))
+    def run(func):
+        try: return func()
+        except Exception as e:
+            logger.error("thread failed: %s" % e)
+            logger.debug(traceback.format_exc())
+            return False
+    pool = ThreadPool(min(MAX_THREADS, len(funcs)))
+    try: return pool.map(run, funcs)
+    finally: pool.close()
+
+class Scheduler(object):
+    """ run a graph of named tasks on a bounded thread pool.  Each task runs
+        as soon as all of its dependencies have succeeded.  A task fails if
+        it raises an exception or returns False, and all tasks depending on
+        a failed task are skipped and marked failed.  External tasks have 
+        no function and are resolved by calling complete() from another 
+        task.  Start and end time of each task is kept in times for tasks
+        added with timed=True
+    """
+    def __init__(self, workers=None):
+        if workers is None: workers = MAX_THREADS
+        self.workers = workers
+        self.tasks = {}
+        self.order = []
+        self.events = Queue.Queue()
+        self.times = {}
+
+    def add(self, name, func=None, args=(), deps=(), external=False, 
+            timed=True):
+        """ add task, dependencies must already be added """
+        for d in deps:
+            if d not in self.tasks: raise Exception("unknown dependency %s"%d)
+        self.tasks[name] = {"func": func, "args": args, "deps": set(deps),
+            "external": external, "dependents": [], "timed": timed}
+        for d in deps: self.tasks[d]["dependents"].append(name)
+        self.order.append(name)
+        return name
+
+    def complete(self, name, success=True):
+        """ resolve external task """
+        self.events.put((name, success, None))
+
+    def execute(self, name):
+        """ execute task function within worker and post result """
+        task = self.tasks[name]
+        start = time.time()
+        try:
+            result = True
+            if task["func"] is not None: result = task["func"](*task["args"])
+            self.times[name] = (start, time.time())
+            self.events.put((name, result is not False, result))
+        except CommandInterrupted as e:
+            # re-raised by run so the interrupt stops all tasks
+            self.events.put((name, False, e))
+        except Exception as e:
+            logger.error("task %s failed: %s" % (name, e))
+            logger.debug("Error occurred: %s" % traceback.format_exc())
+            self.times[name] = (start, time.time())
+            self.events.put((name, False, None))
+
+    def run(self):
+        """ run all tasks and return dict of task name to boolean success """
+        results = {}
+        waiting = dict([(n, len(self.tasks[n]["deps"])) for n in self.order])
+        runnable = collections.deque([n for n in self.order if waiting[n]==0])
+        pool = ThreadPool(self.workers)
+        running = [0]
+        start = time.time()
+        def resolve(name, success):
+            if name in results: return
+            results[name] = success
+            for dep in self.tasks[name]["dependents"]:
+                if not success: resolve(dep, False)
+                else:
+                    waiting[dep]-= 1
+                    if waiting[dep] == 0: runnable.append(dep)
+        try:
+            while len(results) < len(self.order):
+                while len(runnable) > 0:
+                    n = runnable.popleft()
+                    if n in results or self.tasks[n]["external"]: continue
+                    running[0]+= 1
+                    pool.apply_async(self.execute, (n,))
+                try: event = self.events.get(block=running[0]>0)
+                except Queue.Empty:
+                    # nothing left that can resolve remaining tasks
+                    for n in self.order:
+                        if n not in results:
+                            logger.debug("task %s unresolved" % n)
+                            resolve(n, False)
+                    break
+                (name, success, result) = event
+                if isinstance(result, CommandInterrupted): raise result
+                if not self.tasks[name]["external"]: running[0]-= 1
+                elif name not in results:
+                    # external task starts once its dependencies are done
+                    self.times[name] = (max([start] + [self.times[d][1] for
+                        d in self.tasks[name]["deps"] if d in self.times]),
+                        time.time())
+                resolve(name, success)
+        finally: pool.close()
+        if tracer is not None: 
+            tracer.add_graph(self.tasks, dict([(n, t) for (n, t) in 
+                self.times.items() if self.tasks[n]["timed"]]))
+        return results
 
 if __name__ == "__main__":
 
@@ -841,13 +4323,18 @@ if __name__ == "__main__":
         # get user arguments, setup logging, and get list of available labs
         args = get_args()
         setup_logger(logger, args)
-        all_labs = get_labs()
+        lab_id = args.lab.lower() if args.lab is not None else None
+        if args.instance is not None:
+            if not re.search(instance_name_reg, args.instance):
+                sys.exit("Invalid instance name '%s'" % args.instance)
+            instance = args.instance
     
         # handle describe options first
         if args.describe:
             # handle describe for single lab
-            if args.lab is not None and args.lab.lower() in all_labs:
-                print describe_lab(all_labs[args.lab.lower()])
+            all_labs = get_labs(lab_id)
+            if lab_id is not None and lab_id in all_labs:
+                print describe_lab(all_labs[lab_id])
             else:
                 print "\nThe following %s labs are available:\n" % len(all_labs)
                 for l in sorted(all_labs.keys()):
@@ -859,8 +4346,16 @@ if __name__ == "__main__":
             rmsg = "Sorry, you must be root. "
             rmsg+= "Use 'sudo python %s' to execute this script." % __file__
             sys.exit(rmsg)
+
+        # record phase spans written on exit if requested
+        if args.trace is not None:
+            tracer = Tracer()
+            atexit.register(lambda: write_trace(args.trace or "trace.json"))
+        if args.metrics is not None:
+            atexit.register(write_metrics, args.metrics or None)
     
         # check that docker is running
+        get_docker(args.docker)
         if not check_docker_running():
             emsg = "Cannot connect to Docker daemon.  Is it running?\n"
             emsg+= "Try 'sudo service docker start' to enable the service"
@@ -883,26 +4378,42 @@ if __name__ == "__main__":
                 sys.exit(1)
             if len(args.upgrade)==1 and args.upgrade[0]=="*":
                 upgrade_all = True
-            else:
-                threads = []
-                for device_name in args.upgrade:
-                    t = threading.Thread(target=upgrade_flexswitch_container,
-                        args=(device_name, args.image,))
-                    threads.append(t)
-                execute_threads(threads)
-                #logger.info("completed upgrade of all selected device(s)")
+            elif args.lab is None:
+                # readiness can only be verified with lab topology
+                if not upgrade_devices(args.upgrade, args.image, None,
+                    args.upgrade_wave, args.upgrade_parallel):
+                    sys.exit(1)
                 sys.exit()
     
+        # background pool replenishment and pool removal
+        if args.pool_fill is not None:
+            fill_pool(json.loads(args.pool_fill))
+            sys.exit()
+        if args.pool_clear:
+            logger.info("removing pooled containers")
+            clear_pool()
+            sys.exit()
+
+        # invalidate stage checkpoint cache if requested
+        if args.cache_clear:
+            logger.info("clearing stage cache%s" % (
+                " for %s" % lab_id if lab_id is not None else ""))
+            StageCache().clear(lab_id)
+            sys.exit()
+
         # all other operations required a --lab attribute. Ensure it's present.
         if args.lab is None:
             sys.exit("A lab name is required. Use --help for more information")
-        if args.lab.lower() not in all_labs:
+        all_labs = get_labs(lab_id)
+        if lab_id not in all_labs:
             emsg = "Lab '%s' not found. " % args.lab.lower()
             emsg+= "Use --describe to view currently available labs"
             sys.exit(emsg)
     
         # user selected lab
-        current_lab = all_labs[args.lab.lower()]
+        current_lab = all_labs[lab_id]
+        if args.trace == "":
+            args.trace = "%s/trace.json" % generated_dir(current_lab["path"])
     
         # check provided stage before doing any other work
         if args.stage > 0 and args.stage > current_lab["stage_max"]:
@@ -912,88 +4423,157 @@ if __name__ == "__main__":
             sys.exit(emsg)
     
         # build/validate topology file from provided lab
-        topo = get_topology("%s/topology.json" % current_lab["path"])
+        if args.scale: MAX_THREADS = SCALE_MAX_THREADS
+        topo = get_topology("%s/topology.json" % current_lab["path"], 
+            scale=args.scale)
         if topo is None:
             logger.error("failed to parse device topology")
             sys.exit(1)
     
-        # handle upgrade of all devices in lab
-        if upgrade_all:
-            threads = []
-            for device_name in sorted(topo.keys()):
-                t = threading.Thread(target=upgrade_flexswitch_container,
-                    args=(device_name, args.image,))
-                threads.append(t)
-            execute_threads(threads)
-            #logger.info("completed upgrade of all devices")
-            sys.exit(1)
+        # handle upgrade of all/selected devices in lab
+        if len(args.upgrade)>0:
+            devices = args.upgrade
+            if upgrade_all: 
+                devices = sorted(topo.keys())
+                # skip devices not running according to runtime state
+                if read_runtime_state(current_lab["path"]) is not None:
+                    devices = sorted(load_runtime_state(current_lab["path"],
+                        topo))
+            if not upgrade_devices(devices, args.image, topo, 
+                args.upgrade_wave, args.upgrade_parallel):
+                sys.exit(1)
+            sys.exit()
     
         # perform cleanup option if requested
         if args.cleanup:
             logger.info("cleaning up existing containers")
-            cleanup(topo)
+            if not cleanup(topo, current_lab["path"]): sys.exit(1)
             sys.exit()
     
         # repair broken connections if requested
         if args.repair:
             logger.info("repairing connections for running containers")
-            repair_connections(topo)
+            repair_connections(topo, current_lab["path"])
+            sys.exit()
+
+        # rewire restarted containers until interrupted
+        if args.watch:
+            watch_topology(current_lab["path"], topo)
             sys.exit()
     
+        # stage scripts of an instance use the instance host ports
+        if instance is not None and args.stage > 0:
+            write_instance_stages(current_lab["path"], topo, args.stage)
+
+        # verify host limits before creating large topologies
+        if len(topo) > MAX_DEVICE_COUNT and args.capacity_check and \
+            not check_host_capacity(len(topo)):
+            sys.exit(1)
+
+        # incrementally converge running lab to topology if requested
+        if args.reconcile:
+            logger.info("reconciling running containers with topology")
+            if args.stage > 0:
+                logger.warn("--stage is not applied with --reconcile")
+            if not pull_docker_images([topo[k].dockerimage for k in topo]):
+                sys.exit(1)
+            if reconcile_topology(current_lab["path"], topo, args.image,
+                args.dopt):
+                generate_environment_variables(current_lab["path"], topo)
+                logger.info("Successfully reconciled '%s'" % (
+                    current_lab["name"]))
+                sys.exit()
+            logger.error("failed to reconcile topology")
+            sys.exit(1)
+
         # prepare for creating new containers...
         # if script is executed without a stage option, then notify user of
         # any containers that will be automatically deleted
         if args.stage == 0:
-            prompt_for_container_delete(topo)
-
-        # get full list of all docker images that need to be deployed and 
-        # pre-download each
-        all_images = []
-        for k in topo:
-            d = topo[k]
-            if "dockerimage" in d and len(d["dockerimage"])>0 and \
-                d["dockerimage"] not in all_images:
-                all_images.append(d["dockerimage"])
-                try: check_docker_image(d["dockerimage"])
-                except Exception as e:
-                    logger.error("Failed to verify/pull docker image: %s" % e)
-                    sys.exit(1)
-    
-        # create containers and map pid to each device in topology
-        start_success = True
-        threads = []
-        for device_name in sorted(topo.keys()):
-            t = threading.Thread(target=create_flexswitch_container,
-                args=(device_name, topo[device_name]["port"], 
-                        topo[device_name]["port_internal"],
-                        args.image, args.dopt, 
-                        topo[device_name].get("dockerimage", docker_image)))
-            threads.append(t)
-        execute_threads(threads)
-
-        # gather pid for each device
-        for device_name in topo:
-            pid = get_container_pid(device_name)
-            if pid is None: 
-                logger.error("'%s' failed to start" % device_name)
-                start_success = False
-                break
-            topo[device_name]["pid"] = pid
-    
-        # create topology connections
-        if start_success:
-            start_success = create_topology_connections(topo)
+            snapshot = prompt_for_container_delete(topo)
+        else: snapshot = get_container_snapshot(topo.keys())
+
+        # validate all docker images that need to be deployed, missing 
+        # images are pulled concurrently while containers are created
+        for image in set([topo[k].dockerimage for k in topo]):
+            repo, tag = split_image_name(image)
+            if len(repo) == 0 or len(tag) == 0:
+                logger.error("invalid docker image name: %s" % image)
+                sys.exit(1)
+
+        # start from highest cached stage if available
+        stage_cache, stage_keys, start_stage = (None, {}, 1)
+        run_images = {}
+        if args.stage > 0 and args.cache:
+            stage_cache = StageCache(max_bytes=int(
+                args.cache_size*1024*1024*1024))
+            stage_keys = stage_cache_keys(current_lab["path"], topo, 
+                args.stage, args.image, args.dopt)
+            for s in xrange(args.stage, 0, -1):
+                entry = stage_cache.lookup(stage_keys[s])
+                if entry is not None:
+                    logger.info("starting from cached stage %s" % s)
+                    start_stage = s+1
+                    run_images = entry["images"]
+                    break
     
+        # remove host port rules of previously claimed pooled containers
+        pooled = [n for n in snapshot if pool_label in snapshot[n]["labels"]]
+        if len(pooled) > 0: 
+            unpublish_ports([container_name(n) for n in pooled])
+
+        # claim warm containers from pool where available
+        claimed = set()
+        if args.pool > 0 and len(run_images) == 0:
+            logger.warn("--pool publishes ports of claimed containers with "\
+                "iptables DNAT rules and enables net.ipv4.conf.all."\
+                "route_localnet until the lab is removed with --cleanup")
+            pool = get_pool_containers()
+            assignments = []
+            for device_name in sorted(topo.keys()):
+                key = pool_key(topo[device_name].dockerimage, args.image,
+                    args.dopt)
+                if len(pool.get(key, [])) == 0: continue
+                if device_name in snapshot:
+                    remove_flexswitch_container(device_name, force=True)
+                assignments.append((pool[key].pop(0), device_name, 
+                    topo[device_name].port, topo[device_name].port_internal))
+            claimed = claim_pool_containers(assignments)
+
+        # create containers, connections, and apply stage configs with each
+        # device progressing independently
+        (start_success, stage_success) = start_topology(current_lab["path"],
+            topo, args.image, args.dopt, run_images=run_images, 
+            claimed=claimed, snapshot=snapshot, stage=args.stage, 
+            start_stage=start_stage)
+        
+        # checkpoint the last stage unless the lab started from it
+        if start_success and stage_success and stage_cache is not None and \
+            start_stage <= args.stage:
+            stage_cache.record(stage_keys[args.stage], current_lab["id"],
+                args.stage, topo)
+
         if start_success:
-            # verify/wait for flexswitch to start on all containers
-            verify_flexswitch_running(topo)
-            generate_environment_variables(current_lab["path"])
-            # apply stage configs
-            if args.stage>0: execute_stages(current_lab["path"], args.stage)
+            write_applied_topology(current_lab["path"], topo, args.image,
+                args.dopt)
             logger.info("Successfully started '%s'" % current_lab["name"])
+            if args.pool > 0:
+                images = set([topo[d].dockerimage for d in topo])
+                flexswitch = dict([(topo[d].dockerimage, 
+                    topo[d].port_internal) for d in topo 
+                    if topo[d].has_flexswitch()])
+                spawn_pool_fill({"images": dict([(i, args.pool) for i in 
+                    images]), "fs_image": args.image, "dopt": args.dopt,
+                    "flexswitch": flexswitch}, args.docker)
+            # devices and links stay up when only a stage failed
+            if not stage_success:
+                logger.error("failed to apply stage %s configuration, lab "\
+                    "'%s' left running" % (args.stage, current_lab["name"]))
+                sys.exit(1)
         else:
             logger.error("failed to build topology, cleaning up...")
-            cleanup(topo)
+            cleanup(topo, current_lab["path"])
+            sys.exit(1)
 
     except KeyboardInterrupt as e: 
         sys.exit("\nExiting...\n")
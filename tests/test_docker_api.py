@@ -0,0 +1,120 @@
+#!/usr/bin/python
+"""
+DockerAPI backend against a fake docker daemon on a temporary unix socket.
+
+    python -m unittest discover -s tests
+"""
+import os, sys, logging, json, struct, shutil, tempfile, threading, unittest
+import BaseHTTPServer, SocketServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."))
+import labtool
+labtool.logger.addHandler(logging.NullHandler())
+
+class UnixHTTPServer(SocketServer.ThreadingUnixStreamServer):
+    """ http server on a unix socket counting accepted connections """
+    daemon_threads = True
+
+    def __init__(self, path, handler):
+        SocketServer.ThreadingUnixStreamServer.__init__(self, path, handler)
+        self.connections = 0
+
+    def get_request(self):
+        request = SocketServer.ThreadingUnixStreamServer.get_request(self)
+        self.connections+= 1
+        return (request[0], ("local", 0))
+
+def frame(stream, data):
+    """ docker exec stream frame with 8 byte header """
+    return struct.pack(">BxxxI", stream, len(data)) + data
+
+events = [{"Type": "container", "Action": "start", "timeNano": 1,
+    "Actor": {"ID": "c1", "Attributes": {"name": "leaf1"}}},
+    {"Type": "container", "Action": "die", "timeNano": 2,
+    "Actor": {"ID": "c2", "Attributes": {"name": "leaf2"}}}]
+
+class DockerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ minimal docker engine API """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args): pass
+
+    def reply(self, status, body, content_type="application/json"):
+        if not isinstance(body, str): body = json.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/_ping": self.reply(200, "OK", "text/plain")
+        elif path == "/containers/leaf1/json":
+            self.reply(200, {"Id": "c1", "Name": "/leaf1",
+                "State": {"Running": True, "Status": "running", "Pid": 42}})
+        elif path == "/exec/e1/json": self.reply(200, {"ExitCode": 0})
+        elif path == "/events":
+            # chunk boundaries deliberately split the json lines
+            body = "".join(["%s\n" % json.dumps(e) for e in events])
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in xrange(0, len(body), 7):
+                chunk = body[i:i+7]
+                self.wfile.write("%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write("0\r\n\r\n")
+            self.close_connection = 1
+        else: self.reply(404, {"message": "No such container"})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader("content-length", 0)))
+        path = self.path.split("?")[0]
+        if path == "/containers/leaf1/exec": self.reply(201, {"Id": "e1"})
+        elif path == "/exec/e1/start":
+            self.reply(200, frame(1, "hello ") + frame(2, "world"),
+                "application/vnd.docker.raw-stream")
+        else: self.reply(404, {"message": "page not found"})
+
+class TestDockerAPI(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.server = UnixHTTPServer("%s/docker.sock" % self.dir,
+            DockerHandler)
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        self.api = labtool.DockerAPI(self.server.server_address, timeout=5)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def test_keep_alive_reuse(self):
+        self.assertTrue(self.api.ping())
+        for i in xrange(3): self.assertIsNotNone(self.api.inspect("leaf1"))
+        self.assertEqual(self.server.connections, 1)
+
+    def test_inspect_not_found(self):
+        self.assertIsNone(self.api.inspect("missing"))
+        self.assertEqual(self.api.inspect("leaf1")["State"]["Pid"], 42)
+
+    def test_exec_stream_demux(self):
+        self.assertEqual(self.api.execute("leaf1", ["echo"]), "hello world")
+
+    def test_chunked_events(self):
+        records = list(self.api.events())
+        self.assertEqual([(r["action"], r["name"]) for r in records],
+            [("start", "leaf1"), ("die", "leaf2")])
+
+    def test_route_metrics(self):
+        self.api.inspect("leaf1")
+        self.assertIn("docker api GET /containers/{id}/json",
+            labtool.exec_stats.metrics())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+"""
+concurrent docker image pulls against a fake docker backend.
+
+    python -m unittest discover -s tests
+"""
+import os, sys, logging, threading, time, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."))
+import labtool
+labtool.logger.addHandler(logging.NullHandler())
+
+class FakeDocker(labtool.DockerBackend):
+    """ docker backend with local images and pull counts """
+    def __init__(self, images, missing=()):
+        self.local = set(images)
+        self.missing = set(missing)
+        self.lock = threading.Lock()
+        self.pulls = []
+        self.queries = 0
+
+    def images(self):
+        with self.lock:
+            self.queries+= 1
+            return set(self.local)
+
+    def pull(self, image, progress=None):
+        time.sleep(0.05)
+        with self.lock: self.pulls.append(image)
+        if image in self.missing: raise Exception("not found: %s" % image)
+        if progress is not None:
+            progress(image, {"id": "l1", "status": "Pull complete"})
+        with self.lock: self.local.add("%s:%s" % labtool.split_image_name(
+            image))
+
+class TestPullDockerImages(unittest.TestCase):
+
+    def setUp(self):
+        self.docker = labtool.docker
+        labtool.image_index.invalidate()
+
+    def tearDown(self):
+        labtool.docker = self.docker
+        labtool.image_index.invalidate()
+
+    def test_pull_missing_images(self):
+        labtool.docker = FakeDocker(["snapos/flex:latest"])
+        self.assertTrue(labtool.pull_docker_images(["snapos/flex",
+            "snapos/flex:latest", "a/b:1", "c/d:2", "a/b:1"]))
+        self.assertEqual(sorted(labtool.docker.pulls), ["a/b:1", "c/d:2"])
+        self.assertEqual(labtool.docker.queries, 1)
+        self.assertTrue(labtool.image_index.has("c/d:2"))
+
+    def test_pull_failure(self):
+        labtool.docker = FakeDocker([], missing=["a/b:1"])
+        self.assertFalse(labtool.pull_docker_images(["a/b:1", "c/d:2"]))
+        self.assertFalse(labtool.image_index.has("a/b:1"))
+        self.assertTrue(labtool.image_index.has("c/d:2"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+"""
+exec_batch failure index mapping against a fake 'ip' executable.
+
+    python -m unittest discover -s tests
+"""
+import os, sys, logging, shutil, stat, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."))
+import labtool
+labtool.logger.addHandler(logging.NullHandler())
+
+# fails every batch line containing 'fail' the same way 'ip -force -batch'
+# reports errors: message(s) followed by 'Command failed -:<line>'
+fake_ip = """#!/bin/sh
+n=0; rc=0
+while read line; do
+    n=$((n+1))
+    case "$line" in
+        *fail*) echo "RTNETLINK answers: File exists"
+                echo "Command failed -:$n"; rc=1;;
+        *broken*) rc=2;;
+    esac
+done
+exit $rc
+"""
+
+class TestExecBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = "%s/ip" % self.dir
+        with open(path, "w") as f: f.write(fake_ip)
+        os.chmod(path, stat.S_IRWXU)
+        self.path = os.environ["PATH"]
+        os.environ["PATH"] = "%s:%s" % (self.dir, self.path)
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        shutil.rmtree(self.dir)
+
+    def test_success(self):
+        self.assertEqual(labtool.exec_batch(["link add a", "link add b"]), {})
+        self.assertEqual(labtool.exec_batch([]), {})
+
+    def test_failure_index(self):
+        failed = labtool.exec_batch(["link add a", "link fail b",
+            "link add c", "link fail d"])
+        self.assertEqual(sorted(failed), [1, 3])
+        self.assertEqual(failed[1], "RTNETLINK answers: File exists")
+
+    def test_failure_without_detail(self):
+        failed = labtool.exec_batch(["link add a", "link broken b"])
+        self.assertEqual(sorted(failed), [0, 1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+"""
+flexswitch image downloads against a local http server.
+
+    python -m unittest discover -s tests
+"""
+import os, sys, logging, hashlib, shutil, tempfile, threading, time, unittest
+import BaseHTTPServer, SocketServer
+
+# downloads from the local server must not go through a proxy
+os.environ["no_proxy"] = "127.0.0.1,localhost"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."))
+import labtool
+labtool.logger.addHandler(logging.NullHandler())
+
+payload = "".join([chr(i % 251) for i in xrange(256*1024)])
+payload_digest = hashlib.sha256(payload).hexdigest()
+
+class ImageHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ serve payload with support for 'bytes=<offset>-' range requests """
+
+    def log_message(self, *args): pass
+
+    def do_GET(self):
+        with self.server.lock: self.server.requests.append(
+            self.headers.getheader("range"))
+        time.sleep(self.server.delay)
+        r = self.headers.getheader("range")
+        offset = 0
+        if r is not None: offset = int(r.split("=")[1].rstrip("-"))
+        self.send_response(206 if offset > 0 else 200)
+        if offset > 0:
+            self.send_header("Content-Range", "bytes %s-%s/%s" % (offset,
+                len(payload)-1, len(payload)))
+        self.send_header("Content-Length", len(payload) - offset)
+        self.end_headers()
+        self.wfile.write(payload[offset:])
+
+class ImageServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+            ImageHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.delay = 0
+
+class TestFlexswitchImageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.server = ImageServer()
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        self.url = "http://127.0.0.1:%s/flexswitch_docker-1.0.deb" % (
+            self.server.server_address[1])
+        self.cache = labtool.FlexswitchImageCache(self.dir)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def test_range_resume(self):
+        # partial download left behind by an interrupted run
+        partial = "%s/.partial" % self.dir
+        os.makedirs(partial)
+        part = "%s/%s.part" % (partial, hashlib.md5(self.url).hexdigest())
+        with open(part, "wb") as f: f.write(payload[:100000])
+        path = self.cache.download(self.url, "flexswitch_docker-1.0.deb",
+            payload_digest)
+        self.assertIsNotNone(path)
+        with open(path, "rb") as f: self.assertEqual(f.read(), payload)
+        self.assertEqual(self.server.requests, ["bytes=100000-"])
+        self.assertEqual(self.cache.lookup_url(self.url), path)
+
+    def test_sha256_mismatch(self):
+        path = self.cache.download(self.url, "flexswitch_docker-1.0.deb",
+            "0"*64)
+        self.assertIsNone(path)
+        self.assertIsNone(self.cache.lookup_url(self.url))
+        self.assertEqual(os.listdir("%s/.partial" % self.dir),
+            ["%s.part.lock" % hashlib.md5(self.url).hexdigest()])
+
+    def test_concurrent_download(self):
+        # downloads of the same url are serialized by the per-url lock and
+        # later downloads are served from the cache
+        self.server.delay = 0.2
+        results = []
+        def download():
+            results.append(self.cache.download(self.url,
+                "flexswitch_docker-1.0.deb", payload_digest))
+        threads = [threading.Thread(target=download) for i in xrange(4)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(len(set(results)), 1)
+        self.assertIsNotNone(results[0])
+
+    def test_concurrent_index_updates(self):
+        def update(i):
+            with self.cache.locked() as index:
+                n = index["entries"].get("count", 0)
+                time.sleep(0.01)
+                index["entries"]["count"] = n + 1
+        threads = [threading.Thread(target=update, args=(i,)) for i in
+            xrange(8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        with self.cache.locked() as index:
+            self.assertEqual(index["entries"]["count"], 8)
+
+class MountedDocker(labtool.DockerBackend):
+    """ docker backend with a single container mounting provided image """
+    def __init__(self, source):
+        self.source = source
+
+    def containers(self, names=None):
+        return [{"id": "c1", "name": "leaf1", "running": True, "pid": "",
+            "state": "running", "image": "", "labels": {}, "ip": "",
+            "mounts": [{"Source": self.source,
+                "Destination": labtool.gen_flex_path}]}]
+
+class TestFlexswitchImageCacheEviction(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.docker = labtool.docker
+        self.cache = labtool.FlexswitchImageCache(self.dir, max_bytes=1)
+
+    def tearDown(self):
+        labtool.docker = self.docker
+        shutil.rmtree(self.dir)
+
+    def add(self, data):
+        src = "%s/flexswitch_docker-%s.deb" % (self.dir, data)
+        with open(src, "wb") as f: f.write(data)
+        return self.cache.add(src, os.path.basename(src))
+
+    def test_mounted_image_not_evicted(self):
+        labtool.docker = MountedDocker("/nonexistent")
+        first = self.add("first")
+        labtool.docker = MountedDocker(first)
+        second = self.add("second")
+        self.assertTrue(os.path.isfile(first))
+        self.assertTrue(os.path.isfile(second))
+        # once no longer mounted the least recently used image is evicted
+        labtool.docker = MountedDocker("/nonexistent")
+        self.add("third")
+        self.assertFalse(os.path.isfile(first))
+        self.assertFalse(os.path.isfile(second))
+
+if __name__ == "__main__":
+    unittest.main()
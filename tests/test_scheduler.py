@@ -0,0 +1,93 @@
+#!/usr/bin/python
+"""
+Scheduler dependency ordering, failure propagation, and external tasks.
+
+    python -m unittest discover -s tests
+"""
+import os, sys, logging, threading, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."))
+import labtool
+labtool.logger.addHandler(logging.NullHandler())
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = labtool.Scheduler(workers=4)
+        self.lock = threading.Lock()
+        self.order = []
+
+    def task(self, name, result=True):
+        with self.lock: self.order.append(name)
+        if isinstance(result, Exception): raise result
+        return result
+
+    def add(self, name, result=True, deps=()):
+        return self.scheduler.add(name, self.task, (name, result), deps=deps)
+
+    def test_dependency_order(self):
+        self.add("a")
+        self.add("b", deps=["a"])
+        self.add("c", deps=["a"])
+        self.add("d", deps=["b", "c"])
+        results = self.scheduler.run()
+        self.assertEqual(results, {"a": True, "b": True, "c": True,
+            "d": True})
+        self.assertEqual(self.order[0], "a")
+        self.assertEqual(self.order[-1], "d")
+        self.assertEqual(sorted(self.scheduler.times), ["a", "b", "c", "d"])
+
+    def test_failure_propagation(self):
+        self.add("a")
+        self.add("b", result=False, deps=["a"])
+        self.add("c", result=Exception("boom"), deps=["a"])
+        self.add("d", deps=["b"])
+        self.add("e", deps=["c"])
+        self.add("f", deps=["a"])
+        results = self.scheduler.run()
+        self.assertEqual(results, {"a": True, "b": False, "c": False,
+            "d": False, "e": False, "f": True})
+        self.assertNotIn("d", self.order)
+        self.assertNotIn("e", self.order)
+
+    def test_none_result_succeeds(self):
+        self.add("a", result=None)
+        self.add("b", deps=["a"])
+        self.assertEqual(self.scheduler.run(), {"a": True, "b": True})
+
+    def test_unknown_dependency(self):
+        self.assertRaises(Exception, self.add, "a", deps=["missing"])
+
+    def test_external_complete(self):
+        ext = self.scheduler.add("ext", external=True)
+        self.scheduler.add("resolve", self.scheduler.complete, (ext, True))
+        self.add("after", deps=[ext])
+        results = self.scheduler.run()
+        self.assertEqual(results, {"ext": True, "resolve": True,
+            "after": True})
+        self.assertIn("ext", self.scheduler.times)
+
+    def test_external_failure(self):
+        ext = self.scheduler.add("ext", external=True)
+        self.scheduler.add("resolve", self.scheduler.complete, (ext, False))
+        self.add("after", deps=[ext])
+        results = self.scheduler.run()
+        self.assertEqual(results, {"ext": False, "resolve": True,
+            "after": False})
+
+    def test_external_unresolved(self):
+        ext = self.scheduler.add("ext", external=True)
+        self.add("a")
+        self.add("after", deps=[ext])
+        results = self.scheduler.run()
+        self.assertEqual(results, {"ext": False, "a": True, "after": False})
+
+    def test_interrupt(self):
+        self.add("a", result=labtool.CommandInterrupted("interrupted"))
+        self.add("b", deps=["a"])
+        self.assertRaises(labtool.CommandInterrupted, self.scheduler.run)
+        self.assertNotIn("b", self.order)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+"""
+native stage script parsing (expand_shell_variables, parse_curl_command, and
+parse_stage_script) including fallback to bash on unsupported syntax.
+
+    python -m unittest discover -s tests
+"""
+import os, sys, logging, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."))
+import labtool
+labtool.logger.addHandler(logging.NullHandler())
+
+env = {"LEAF1_PORT": "8001", "LEAF1_USERNAME": "admin", "EMPTY": ""}
+
+class TestExpandShellVariables(unittest.TestCase):
+
+    def expand(self, line): return labtool.expand_shell_variables(line, env)
+
+    def test_expand(self):
+        self.assertEqual(self.expand("a $LEAF1_PORT ${LEAF1_PORT}b"),
+            "a 8001 8001b")
+        self.assertEqual(self.expand('"x:$LEAF1_PORT"'), '"x:8001"')
+        self.assertEqual(self.expand("x$EMPTY"), "x")
+
+    def test_quoting(self):
+        self.assertEqual(self.expand("'$LEAF1_PORT'"), "'$LEAF1_PORT'")
+        self.assertEqual(self.expand("\"it's $LEAF1_PORT\""),
+            "\"it's 8001\"")
+        self.assertEqual(self.expand("\\$LEAF1_PORT"), "\\$LEAF1_PORT")
+        self.assertEqual(self.expand("'a;b|c'"), "'a;b|c'")
+        self.assertEqual(self.expand("cost $ 5"), "cost $ 5")
+
+    def test_requires_bash(self):
+        for line in ("a; b", "a | b", "a && b", "a > f", "a < f", "(a)",
+            "echo `date`", "echo $(date)", "echo $UNDEFINED",
+            "echo ${LEAF1_PORT:-1}", "echo $1x"):
+            self.assertIsNone(self.expand(line), line)
+
+class TestParseCurlCommand(unittest.TestCase):
+
+    def parse(self, args): return labtool.parse_curl_command(args)
+
+    def test_patch(self):
+        req = self.parse(["-sX", "PATCH", "-d", '{"Enable":true}',
+            "http://localhost:8001/public/v1/config/LLDPGlobal"])
+        self.assertEqual((req["method"], req["body"], req["schema"],
+            req["port"], req["path"]), ("PATCH", '{"Enable":true}', "http",
+            8001, "/public/v1/config/LLDPGlobal"))
+
+    def test_defaults_and_long_options(self):
+        req = self.parse(["http://127.0.0.1:8001/x?a=1"])
+        self.assertEqual((req["method"], req["path"], req["username"]),
+            ("GET", "/x?a=1", None))
+        req = self.parse(["--silent", "--insecure", "--data", "{}",
+            "--user", "admin:pw", "https://localhost:8443/y"])
+        self.assertEqual((req["method"], req["schema"], req["username"],
+            req["password"]), ("POST", "https", "admin", "pw"))
+
+    def test_unsupported(self):
+        for args in (["-o", "f", "http://localhost:8001/"],
+            ["http://example.com:8001/"], ["http://localhost/"],
+            ["ftp://localhost:21/"], ["http://localhost:1/", "extra"],
+            ["http://localhost:port/"], ["-X"], []):
+            self.assertIsNone(self.parse(args), args)
+
+class TestParseStageScript(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def parse(self, script):
+        fname = "%s/stage1.sh" % self.dir
+        with open(fname, "w") as f: f.write(script)
+        return labtool.parse_stage_script(fname, env)
+
+    def test_native(self):
+        requests = self.parse("#!/bin/bash\n# comment\n\n"
+            "source ../.generated/source.env\necho 'configuring'\n"
+            "curl -sX PATCH -d '{\"Enable\":true}' "
+            "\"http://localhost:$LEAF1_PORT/public/v1/config/LLDPGlobal\"\n"
+            "curl -s http://localhost:${LEAF1_PORT}/public/v1/state/Ports\n")
+        self.assertEqual([(r["method"], r["port"], r["path"]) for r in
+            requests], [("PATCH", 8001, "/public/v1/config/LLDPGlobal"),
+            ("GET", 8001, "/public/v1/state/Ports")])
+        self.assertTrue(requests[0]["source"].endswith("stage1.sh:6"))
+
+    def test_bash_fallback(self):
+        for line in ("sleep 5", "curl -s http://localhost:8001/ | jq .",
+            "source other.env", "curl -s http://localhost:$UNDEFINED/",
+            "curl -s 'http://localhost:8001/", "for i in 1 2; do echo; done",
+            "curl -s http://localhost:$LEAF1_PID/",
+            "curl -s 'http://localhost:$LEAF1_PORT/'"):
+            self.assertIsNone(self.parse("curl -s http://localhost:8001/\n"
+                "%s\n" % line), line)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+"""
+validate_topology reporting every problem found in a topology in one pass.
+
+    python -m unittest discover -s tests
+"""
+import os, sys, logging, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."))
+import labtool
+labtool.logger.addHandler(logging.NullHandler())
+
+def topology(devices=None, connections=None):
+    if devices is None:
+        devices = [{"name": "leaf1", "port": 8001},
+            {"name": "leaf2", "port": 8002}, {"name": "spine1"}]
+    if connections is None:
+        connections = [{"leaf1": "fpPort1", "spine1": "fpPort1"},
+            {"leaf2": "fpPort1", "spine1": "fpPort2"}]
+    return {"devices": devices, "connections": connections}
+
+class TestValidateTopology(unittest.TestCase):
+
+    def validate(self, js, scale=False):
+        return labtool.validate_topology(js, scale=scale)
+
+    def assertErrors(self, js, expected, scale=False):
+        """ assert each expected substring is found in its own error """
+        (devices, errors) = self.validate(js, scale)
+        self.assertEqual(len(errors), len(expected), errors)
+        for (e, s) in zip(errors, expected): self.assertIn(s, e)
+        return devices
+
+    def test_valid(self):
+        (devices, errors) = self.validate(topology())
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(devices.keys()), ["leaf1", "leaf2", "spine1"])
+        self.assertEqual(devices["leaf1"].port, 8001)
+        self.assertIsNone(devices["spine1"].port)
+        self.assertEqual(len(devices.links), 2)
+        self.assertIn("fpPort2", devices["spine1"].ports)
+
+    def test_missing_devices_and_connections(self):
+        self.assertErrors({}, ["'devices'", "'connections'"])
+        self.assertErrors(topology(connections=[]), ["'connections'"])
+        self.assertErrors({"devices": {}, "connections": [{}]},
+            ["'devices'"])
+
+    def test_device_errors(self):
+        self.assertErrors(topology(devices=[
+            {"name": "leaf1", "port": 8001}, {"name": "LEAF1", "port": 8003},
+            {"name": "leaf2", "port": 8001}, {"name": "spine1", "port": "x"},
+            {"name": "a b"}, {"port": 8004}, {"name": "leaf3", "port": 80},
+            {"name": "spine2"}],
+            connections=[{"leaf1": "fpPort1", "spine2": "fpPort1"}]),
+            ["LEAF1 defined multiple times", "host port 8001 used by leaf1",
+            "invalid port for spine1", "invalid device name 'a b'",
+            "invalid device object", "invalid port 80"])
+
+    def test_connection_errors(self):
+        self.assertErrors(topology(connections=[
+            {"leaf1": "fpPort1", "spine1": "fpPort1"},
+            {"leaf1": "fpPort1", "leaf2": "fpPort2"},
+            {"leaf1": "fpPort3", "leaf1": "fpPort4"},
+            {"leaf1": "fpPort5", "spine2": "fpPort1"},
+            {"leaf1": "eth0", "leaf2": "fpPort3"},
+            {"leaf1": "bad-name", "leaf2": "fpPort4"},
+            {"leaf2": "fpPort5", "spine1": "fpPort6", "leaf1": "fpPort6"},
+            "leaf1"]),
+            ["leaf1 interface fpPort1 referenced multiple times",
+            "invalid connection", "spine2 not in devices",
+            "eth0 is reserved", "invalid connection name 'bad-name'",
+            "invalid connection", "invalid connection"])
+
+    def test_back_to_back(self):
+        self.assertErrors(topology(connections=[
+            {"leaf1": "fpPort1", "LEAF1": "fpPort2"}]),
+            ["unsupported back-to-back connection"])
+
+    def test_all_errors_reported(self):
+        # device and connection errors are reported together and valid
+        # connections are still applied
+        devices = self.assertErrors(topology(
+            devices=[{"name": "leaf1", "port": 8001},
+            {"name": "leaf1", "port": 8002}, {"name": "leaf2"},
+            {"name": "spine1"}],
+            connections=[{"leaf1": "fpPort1", "spine1": "fpPort1"},
+            {"leaf2": "eth0", "spine1": "fpPort2"},
+            {"leaf2": "fpPort1", "spine9": "fpPort1"}]),
+            ["leaf1 defined multiple times", "eth0 is reserved",
+            "spine9 not in devices"])
+        self.assertEqual(len(devices.links), 1)
+
+    def test_scale(self):
+        names = ["d%s" % i for i in xrange(labtool.MAX_DEVICE_COUNT + 1)]
+        js = topology(devices=[{"name": n} for n in names],
+            connections=[{names[0]: "swp1", names[1]: "swp1"}])
+        self.assertErrors(js, ["invalid connection name 'swp1'",
+            "invalid connection name 'swp1'",
+            "exceeds maximum count %s, use --scale" % (
+            labtool.MAX_DEVICE_COUNT)])
+        self.assertErrors(js, [], scale=True)
+
+if __name__ == "__main__":
+    unittest.main()